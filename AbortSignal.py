@@ -0,0 +1,159 @@
+import threading
+import time
+import logging
+import MySQLdb
+from Repositories import QueueAbortRepository
+
+class AbortSignal:
+    """
+    In-process mirror of the abort flag (QueueStat in the queueabort table).
+
+    The signal is "set" while the queue is not running or was aborted (QueueStat = 0), and
+    "cleared" while the queue is running (QueueStat = 1). Components which wait for a long
+    time (e.g. the Spinsolve measurement loops) block on this signal instead of querying the
+    database themselves.
+
+    The signal can be raised in three ways:
+    - in-process, by calling trigger() (used by the Queue, the Spinsolve listener and the GUI),
+    - by the webinterface or any other external program which sets QueueStat = 0 in the
+      database; this is picked up by a single watcher thread which polls the queueabort table,
+    - by calling trigger() from any other thread, e.g. a script which imports this program.
+    """
+
+    def __init__(self, mysql_reader, poll_interval=0.5):
+        """
+        Create an AbortSignal and start the watcher thread.
+
+        Arguments:
+        mysql_reader  -- a MySQLReader object
+        poll_interval -- time in seconds between two reads of the queueabort table
+        """
+        self.mysql_reader = mysql_reader
+        self.queueabort = QueueAbortRepository(mysql_reader)
+        self.poll_interval = poll_interval
+        # the queue is not running when the program is started.
+        self._event = threading.Event()
+        self._event.set()
+        # guards the state below; it is never held during a DB access, so that trigger() raises
+        # the signal without delay.
+        self._lock = threading.Lock()
+        # incremented by every trigger() and release(): the watcher discards a QueueStat which it
+        # has read while the generation changed, so that it can never overwrite a fresh abort
+        # with a stale value.
+        self._generation = 0
+        self._writing = 0     # number of trigger()/release() calls whose DB write is pending
+        # serializes the DB writes of trigger() and release()
+        self._write_lock = threading.Lock()
+        self._listeners = []
+
+        self.watcher = threading.Thread(target=self.watch, args=())
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def add_listener(self, callback):
+        """
+        Registers a function which is called with one boolean argument (True = aborted,
+        False = queue running) whenever the state of the signal changes.
+        The callback runs in the thread which changed the state, so it should return quickly.
+        """
+        self._listeners.append(callback)
+
+    def is_set(self):
+        """
+        Returns True if the queue is not running or was aborted.
+        """
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the abort signal is set, or until the timeout (in seconds) has passed.
+        Returns True if the signal is set.
+        """
+        return self._event.wait(timeout)
+
+    def trigger(self, reason=""):
+        """
+        Aborts the queue: raises the signal immediately, and writes QueueStat = 0 to the
+        database so that the webinterface shows the queue as stopped.
+
+        Arguments:
+        reason -- optional text for the log
+        """
+        with self._lock:
+            self._generation += 1
+            self._writing += 1
+            changed = self._update(True)
+        if changed and reason:
+            logging.info("Queue aborted: " + reason)
+        try:
+            with self._write_lock:
+                self.queueabort.set(0)
+        except (ConnectionError, MySQLdb.Error):
+            logging.error("Could not write the abort flag to the DB.")
+        finally:
+            with self._lock:
+                self._writing -= 1
+                self._generation += 1
+
+    def release(self):
+        """
+        Starts the queue: writes QueueStat = 1 to the database and clears the signal, unless
+        the queue has been aborted in the meantime.
+        """
+        with self._lock:
+            self._generation += 1
+            self._writing += 1
+            generation = self._generation
+        try:
+            with self._write_lock:
+                self.queueabort.set(1)
+        except (ConnectionError, MySQLdb.Error):
+            logging.error("Could not write the abort flag to the DB.")
+        finally:
+            with self._lock:
+                self._writing -= 1
+                if self._generation == generation:
+                    self._update(False)
+                self._generation += 1
+
+    def watch(self):
+        """
+        Background process which mirrors QueueStat from the database into the signal.
+        This is the only place where the queueabort table is polled.
+        """
+        while True:
+            try:
+                with self._lock:
+                    generation = self._generation
+                aborted = self.queueabort.read() == 0
+                with self._lock:
+                    # skip the value if trigger() or release() ran during the read
+                    if self._generation == generation and not self._writing:
+                        self._update(aborted)
+            except ConnectionError:
+                # already logged by the connection pool
+                pass
+            except MySQLdb.Error:
+                logging.error("Could not read the abort flag from the DB.")
+            except:
+                logging.error("Something TERRIBLE happened to the abort signal watcher!!! :-(")
+                logging.exception("")
+            time.sleep(self.poll_interval)
+
+    def _update(self, aborted):
+        """
+        Sets the state of the signal and notifies the listeners.
+        Returns True if the state has changed.
+        """
+        if aborted == self._event.is_set():
+            return False
+        if aborted:
+            self._event.set()
+        else:
+            self._event.clear()
+        for callback in self._listeners:
+            try:
+                callback(aborted)
+            except:
+                logging.exception("")
+        return True
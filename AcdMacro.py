@@ -1,4 +1,5 @@
-import code
+import contextlib
+import math
 import os
 import subprocess
 import time
@@ -6,260 +7,524 @@ import threading
 import logging
 from datetime import datetime
 from MySQLReader import *
+from Jcamp import Jcamp
+from Repositories import MethodRepository
 
 class AcdMacro:
     """
-    Runs ACD macro as a non-blocking thread
+    Evaluates one spectrum with an ACD macro. Blocks until the evaluation is done; it is run by
+    the workers of the EvaluationQueue.
+
+    The evaluation is split into steps: load_method() reads the method and its peaks from the
+    DB, build_macro() writes the macro, run_specman() lets the ACD NMR Processor execute it, and
+    evaluate() reads the integrals from the exported JCAMP file and writes the results.
     """
-    
-    def __init__(self, mysql_reader, fname, method_id):
+
+    # has to be increased whenever build_macro() is changed, so that cached evaluations
+    # (see EvaluationCache) made with an older macro are not used anymore.
+    MACRO_VERSION = 3
+    # time in seconds the ESP file has to stay unchanged before the macro is considered done,
+    # see run_specman()
+    STABLE_TIME = 2
+
+    # number of specman instances which are currently running, see cleanup()
+    active = 0
+    active_lock = threading.Lock()
+    # if True, the leftover ACD processes are killed after the last macro of this process has
+    # finished (see kill_leftovers). BatchEvaluation sets it to False in its worker processes
+    # and kills the leftovers itself when all workers are done.
+    kill_all = True
+    # While macros are running, every process holds a locked marker file in the ACDFolder, so
+    # that other programs on the same machine (e.g. BatchEvaluation next to the control
+    # program) do not kill its specman instances in kill_leftovers(). The marker files are
+    # created and checked while holding LOCK_FILE.
+    LOCK_FILE = "nmr_autosampler.lock"
+    MARKER_PREFIX = "nmr_autosampler_macros_"
+    marker = None    # the open marker file of this process, see register()
+
+    def __init__(self, mysql_reader, fname, method_id, workdir=None, timeout=60, cache=None, write_result=True):
+        """
+        Arguments:
+        mysql_reader -- a MySQLReader object
+        fname        -- Folder name of the NMR spectrum
+        method_id    -- The method ID in the mysql DB
+        workdir      -- directory for the macro file, the current directory by default. Jobs
+                        which run at the same time need separate directories.
+        timeout      -- time in seconds for specman to finish
+        cache        -- an EvaluationCache, or None
+        write_result -- if False, the result is not written to the DB, but only stored in
+                        self.result (for writing many results at once)
+        """
         self.mysql_reader = mysql_reader
         self.fname = fname
         self.method_id = method_id
-        
-        self.running = False
+        self.workdir = workdir if workdir is not None else os.getcwd()
+        self.timeout = timeout
+        self.cache = cache
+        self.write_result = write_result
+        self.result = None
+        # phases of the evaluation as (phase, start, end, detail), see Timeline
+        self.phases = []
 
-    def run_macro(self):
-        if not self.running:
-            self.running = True
-            macro_thread = threading.Thread(target=self.macro, args=())
-            macro_thread.start()
+        self.method = None
+        self.standard_peaks = []
+        self.starting_material_peaks = []
+        self.product_peaks = []
+
+        # file name for the actual file must not contain a dot, otherwise ACD will not work
+        self.fname1 = fname.replace(".", "_")
 
     def macro(self):
+        """
+        Runs the evaluation. Returns True if it was successful (or if there was nothing to
+        evaluate), and False otherwise.
+        """
+        config = self.mysql_reader.read_config()
+        if config is None:
+            return False
+
+        # Check if acd folder is correctly configured
+        if config["ACDFolder"] is not None and config["ACDFolder"] != "":
+            specman_path = config["ACDFolder"] + "/specman.exe"
+        else:
+            logging.debug("ACDFolder is not configured. Automatic evaluation skipped.")
+            return True
+        if not os.path.isfile(specman_path):
+            logging.warning("ACD NMR Processor was not found at the specified location.")
+            return False
+
+        if self.method_id is None or self.method_id == 0:
+            logging.debug("No method selected for " + self.fname + ". Automatic evaluation skipped.")
+            return True
+        if not self.load_method():
+            return False
+
+        # skip specman if the same FID was already evaluated with the same method
+        fidfile = config["NMRFolder"] + self.fname + "/nmr_fid.dx"
+        outputs = self.outputs(config)
+        key = None
+        if self.cache is not None and os.path.isfile(fidfile):
+            key = self.cache.key(fidfile, self.method, self.standard_peaks + self.starting_material_peaks + self.product_peaks, self.MACRO_VERSION)
+            if self.timed("cache_restore", self.cache.restore, key, outputs):
+                logging.debug("Evaluation of " + self.fname + " was taken from the cache.")
+                self.timed("evaluate", self.evaluate, config)
+                return True
+
+        macro = self.build_macro(config)
+        if not self.timed("specman", self.run_specman, specman_path, macro, config):
+            return False
+        if key is not None and all(os.path.isfile(path) for path in outputs.values()):
+            self.cache.store(key, outputs)
+        self.timed("evaluate", self.evaluate, config)
+        return True
+
+    def timed(self, phase, function, *args):
+        """
+        Calls function(*args), and appends its duration to self.phases.
+        """
+        started = time.time()
         try:
-            config = self.mysql_reader.read_config()
-            
-            # Check if acd folder is correctly configured
-            if config["ACDFolder"] is not None and config["ACDFolder"] != "":
-                specman_path = config["ACDFolder"] + "/specman.exe"
-            else:
-                logging.debug("ACDFolder is not configured. Automatic evaluation skipped.")
-                self.running = False
-                return False
-            if not os.path.isfile(specman_path):
-                logging.warning("ACD NMR Processor was not found at the specified location.")
-                self.running = False
-                return False
-            
-            fname = self.fname # So I don't have to write self all the time
-
-            method = None
-            standard_peaks = None
-            starting_material_peaks = None
-            product_peaks = None
-            conn, cur = self.mysql_reader.connect_db()
-            # if mysql connection can not be established, crash and die
-            if conn is None or cur is None:
-                return False
-            if self.method_id is not None and self.method_id != 0:
-                # Get config, method, nucleus & peaks from DB
-                cur.execute("SELECT * FROM methods INNER JOIN nuclei ON Methods.Nucleus=nuclei.Mass WHERE ID = " + str(self.method_id))
-                method = cur.fetchall()[0]
-                cur.execute("SELECT * FROM peaks WHERE method = " + str(method["ID"]) + " AND role = 0")
-                standard_peaks = cur.fetchall()
-                cur.execute("SELECT * FROM peaks WHERE method = " + str(method["ID"]) + " AND role = 1")
-                starting_material_peaks = cur.fetchall()
-                cur.execute("SELECT * FROM peaks WHERE method = " + str(method["ID"]) + " AND role = 2")
-                product_peaks = cur.fetchall()
-                conn.close()
-
-            # Build macro file
-
-            # file name for the actual file must not contain a dot, otherwise ACD will not work
-            fname1 = fname.replace(".", "_")
-
-            # for now only handle the case of 1 internal standard
-            # in the future, might implement multiple standards as a loop (for standard_peak in standard_peaks)
-
-            # General stuff & Internal standard
-            if standard_peaks is not None and len(standard_peaks) >= 1:
-                standard = standard_peaks[0]
-            else:
-                standard = None
-                
-            if method is None or method["LB"] is None:
-                methodLB = "0.2"
-            else:
-                methodLB = str(method["LB"])
-                
-            macro = ('ACD/MACRO <1D NMR> v12.01(14 Oct 2020 by "Marco")\r\n'
-                    'CheckDocument (Type = "FID"; Nucleus = "' + method["FriendlyName"] + '")\r\n'
-                    'ZeroFilling (PointsCount = "131072")\r\n'
-                    'WindowFunction (Method = "Exponential"; LB = ' + methodLB + ')\r\n'
-                    'FT (Operation = "Default")\r\n'
-                    'Phase (Method = "Simple")\r\n')
-            
-            if method is not None:
-                if method["BaseLine"] == "SpAveraging":
-                    macro += 'BaseLine (Range = Full; Method = "' + method["BaseLine"] + '"; BoxHalfWidth = ' + str(method["BoxHalfWidth"]) + '; NoiseFactor = ' + str(method["NoiseFactor"]) + ')\r\n'
-                elif method["BaseLine"] == "FIDReconstruction":
-                    macro += 'BaseLine (Range = Full; Method = "' + method["BaseLine"] + '")\r\n'
-            else:
-                # default SpAveraging BHW=50 / NF=3
-                macro += 'BaseLine (Range = Full; Method = "SpAveraging"; BoxHalfWidth = 50; NoiseFactor = 3)\r\n'
-                    
-            macro += 'PeakPicking (Range = Full; NoiseFactor = 6; Threshold = "SignalNoise"; MinSN = 20; PosPeaks = True; NegPeaks = True; EqualPosition = True; UseDerivation = True)\r\n'
-
-            if standard is not None:
-                macro += ('FindPeak (Position = ' + str(standard["reference_ppm"]) + '; Tolerance = ' + str(standard["reference_tolerance"]) + '; Property = "AbsHeight"; Criteria = "Maximal"; Range = 0.0000..0.0000; Value = 0.0000; IgnoreAnnotated = False; Result = IntStand)\r\n'
-                          'Reference (OldPosition = $(IntStand); NewPosition = ' + str(standard["reference_ppm"]) + '; Name = "' + standard["annotation"] + '")\r\n')
-
-            # Peaks
-            if method is not None:
-                for peak in starting_material_peaks + product_peaks:
-                    macro += 'Integration (Method = "SelectedInterval"; Range = ' + str(peak["begin_ppm"]) + '..' + str(peak["end_ppm"]) + '; RefValue = 1.0000)\r\n'
-                    macro += 'Annotation (Range = ' + str(peak["begin_ppm"]) + '..' + str(peak["end_ppm"]) + '; Text = "' + peak['annotation'] + '"; Layer = 1)\r\n'
-
-            # Set last integral to the internal standard
-            if standard is not None:
-                ref_value = 100 * standard["nF"] * standard["Eq"]
-                macro += 'Integration (Method = "SelectedInterval"; Range = ' + str(standard["begin_ppm"]) + '..' + str(standard["end_ppm"]) + '; RefValue = ' + str(ref_value) + ')\r\n'
-
-            # Jcamp export
-            macro += 'ExportDocument (Format = "JCAMP"; Dir = "' + config["NMRFolder"] + fname + '"; FileName = "' + fname1 + '.jdx"; IfExist = Overwrite; Setup=False)\r\n'
-            # pdf export
-            sk2file = "19f.sk2" # 19F is the default (shows full spectrum)
-            if method is not None: 
-                if method["FriendlyName"] == "1H":
-                    sk2file = "1h.sk2" # in case of 1H, only show -0.5 to 10 ppm
-            macro += 'ExportReportToPDF (Dir = "' + config["NMRFolder"] + fname + '"; FileName = "' + fname1 + '.pdf"; ReportType = "Template"; TemplateFile = "' + os.getcwd() + '\\' + sk2file + '")\r\n'
-            # Save as ESP
-            macro += 'SaveDocument (Dir = "' + config["NMRFolder"] + fname + '"; FileName = "' + fname1 + '.esp"; IfExist = "Overwrite")\r\n'
-            
-            macro += 'Execute (Application = ">taskkill"; Parameters = "/IM specman.exe"; Mode = "continue"; Hidden = false)'
-
-            makro_file = open("makro.mcr", "w")
-            makro_file.write(macro)
-            makro_file.close()
-            # timeout of 20 seconds for specman to finish (otherwise there may be an error in the macro execution)
-            fidfile = config["NMRFolder"] + fname + "/nmr_fid.dx"
-            macrofile = os.getcwd() + "/makro.mcr"
-            command = specman_path + " /SP" + fidfile + " /m" + macrofile + " /nobanner"
-            logging.debug("Begin ACD macro with command: " + command)
-            macro_process = subprocess.Popen(command)
-            timed_out = False
-            for i in range(60): # 60 seconds
-                if macro_process.poll() is not None:  # process just ended
+            return function(*args)
+        finally:
+            self.phases.append((phase, started, time.time(), None))
+
+    def outputs(self, config):
+        """
+        Returns the files exported by the macro, as dictionary of the names under which they 
+        are cached and their paths.
+        """
+        folder = config["NMRFolder"] + self.fname + "/" + self.fname1
+        return {"spectrum.jdx": folder + ".jdx", "spectrum.pdf": folder + ".pdf", "spectrum.esp": folder + ".esp"}
+
+    def load_method(self):
+        """
+        Reads the method, nucleus & peaks (from the ReferenceCache of the MySQLReader). 
+        Returns True if the method was found.
+        """
+        methods = MethodRepository(self.mysql_reader)
+        self.method = methods.method(self.method_id)
+        if self.method is None:
+            logging.warning("Method " + str(self.method_id) + " was not found.")
+            return False
+        self.standard_peaks = methods.peaks(self.method["ID"], methods.STANDARD)
+        self.starting_material_peaks = methods.peaks(self.method["ID"], methods.STARTING_MATERIAL)
+        self.product_peaks = methods.peaks(self.method["ID"], methods.PRODUCT)
+        return True
+
+    @property
+    def standard(self):
+        """
+        The internal standard, or None.
+        For now only handle the case of 1 internal standard. In the future, might implement
+        multiple standards as a loop (for standard_peak in standard_peaks)
+        """
+        if len(self.standard_peaks) >= 1:
+            return self.standard_peaks[0]
+        return None
+
+    def build_macro(self, config):
+        """
+        Returns the ACD macro for the spectrum as a string.
+        """
+        method = self.method
+        standard = self.standard
+        fname = self.fname
+        fname1 = self.fname1
+
+        # General stuff & Internal standard
+        if method["LB"] is None:
+            methodLB = "0.2"
+        else:
+            methodLB = str(method["LB"])
+
+        macro = ('ACD/MACRO <1D NMR> v12.01(14 Oct 2020 by "Marco")\r\n'
+                'CheckDocument (Type = "FID"; Nucleus = "' + method["FriendlyName"] + '")\r\n'
+                'ZeroFilling (PointsCount = "131072")\r\n'
+                'WindowFunction (Method = "Exponential"; LB = ' + methodLB + ')\r\n'
+                'FT (Operation = "Default")\r\n'
+                'Phase (Method = "Simple")\r\n')
+
+        if method["BaseLine"] == "SpAveraging":
+            macro += 'BaseLine (Range = Full; Method = "' + method["BaseLine"] + '"; BoxHalfWidth = ' + str(method["BoxHalfWidth"]) + '; NoiseFactor = ' + str(method["NoiseFactor"]) + ')\r\n'
+        elif method["BaseLine"] == "FIDReconstruction":
+            macro += 'BaseLine (Range = Full; Method = "' + method["BaseLine"] + '")\r\n'
+
+        macro += 'PeakPicking (Range = Full; NoiseFactor = 6; Threshold = "SignalNoise"; MinSN = 20; PosPeaks = True; NegPeaks = True; EqualPosition = True; UseDerivation = True)\r\n'
+
+        if standard is not None:
+            macro += ('FindPeak (Position = ' + str(standard["reference_ppm"]) + '; Tolerance = ' + str(standard["reference_tolerance"]) + '; Property = "AbsHeight"; Criteria = "Maximal"; Range = 0.0000..0.0000; Value = 0.0000; IgnoreAnnotated = False; Result = IntStand)\r\n'
+                      'Reference (OldPosition = $(IntStand); NewPosition = ' + str(standard["reference_ppm"]) + '; Name = "' + standard["annotation"] + '")\r\n')
+
+        # Peaks
+        for peak in self.starting_material_peaks + self.product_peaks:
+            macro += 'Integration (Method = "SelectedInterval"; Range = ' + str(peak["begin_ppm"]) + '..' + str(peak["end_ppm"]) + '; RefValue = 1.0000)\r\n'
+            macro += 'Annotation (Range = ' + str(peak["begin_ppm"]) + '..' + str(peak["end_ppm"]) + '; Text = "' + peak['annotation'] + '"; Layer = 1)\r\n'
+
+        # Set last integral to the internal standard
+        if standard is not None:
+            ref_value = 100 * standard["nF"] * standard["Eq"]
+            macro += 'Integration (Method = "SelectedInterval"; Range = ' + str(standard["begin_ppm"]) + '..' + str(standard["end_ppm"]) + '; RefValue = ' + str(ref_value) + ')\r\n'
+
+        # Jcamp export
+        macro += 'ExportDocument (Format = "JCAMP"; Dir = "' + config["NMRFolder"] + fname + '"; FileName = "' + fname1 + '.jdx"; IfExist = Overwrite; Setup=False)\r\n'
+        # pdf export
+        sk2file = "19f.sk2" # 19F is the default (shows full spectrum)
+        if method["FriendlyName"] == "1H":
+            sk2file = "1h.sk2" # in case of 1H, only show -0.5 to 10 ppm
+        macro += 'ExportReportToPDF (Dir = "' + config["NMRFolder"] + fname + '"; FileName = "' + fname1 + '.pdf"; ReportType = "Template"; TemplateFile = "' + os.getcwd() + '\\' + sk2file + '")\r\n'
+        # Save as ESP
+        macro += 'SaveDocument (Dir = "' + config["NMRFolder"] + fname + '"; FileName = "' + fname1 + '.esp"; IfExist = "Overwrite")\r\n'
+
+        # specman is not closed by the macro (a taskkill by image name would also hit the specman
+        # instances of other jobs), run_specman() waits for the exported files and cleanup()
+        # kills the process tree of this macro only.
+        return macro
+
+    def run_specman(self, specman_path, macro, config):
+        """
+        Writes the macro into the working directory and lets specman execute it.
+        Returns True if the PDF report was exported, which means that the macro was successful.
+
+        specman stays open after the macro, so the macro is considered done as soon as the ESP
+        file (the last export of the macro) was written completely, or when specman exits. The
+        ESP file is complete when it is not empty, has not changed for STABLE_TIME seconds and
+        is not held open by specman anymore (see is_released); the process tree is killed
+        afterwards, so a file which is still being saved would end up truncated.
+        """
+        macrofile = os.path.join(self.workdir, "makro.mcr")
+        makro_file = open(macrofile, "w")
+        makro_file.write(macro)
+        makro_file.close()
+        fidfile = config["NMRFolder"] + self.fname + "/nmr_fid.dx"
+        command = specman_path + " /SP" + fidfile + " /m" + macrofile + " /nobanner"
+        outputs = self.outputs(config)
+        logging.debug("Begin ACD macro with command: " + command)
+        with AcdMacro.active_lock:
+            AcdMacro.active += 1
+            if AcdMacro.active == 1:
+                AcdMacro.register(config["ACDFolder"])
+        started = time.time()
+        try:
+            macro_process = subprocess.Popen(command, cwd=self.workdir)
+        except:
+            AcdMacro.finish(config["ACDFolder"], kill=False)
+            raise
+        try:
+            # timeout for specman to finish (otherwise there may be an error in the macro execution)
+            done = False
+            last_signature = None
+            stable_since = None
+            while time.time() - started < self.timeout:
+                if macro_process.poll() is not None:
+                    done = True
                     break
-                time.sleep(1)
-            else:
-                timed_out = True
+                signature = self.file_signature(outputs["spectrum.esp"], started)
+                if signature is None or signature[0] == 0:
+                    stable_since = None
+                elif signature != last_signature:
+                    stable_since = time.time()
+                elif time.time() - stable_since >= self.STABLE_TIME and self.is_released(outputs["spectrum.esp"]):
+                    done = True
+                    break
+                last_signature = signature
+                time.sleep(0.2)
+            if not done:
                 logging.warning("ACD macro timed out!")
             logging.debug("End ACD macro")
             success = False
-            if not timed_out:
-                SuccessFile = config["NMRFolder"] + fname + "/" + fname1 + ".pdf"
-                #print("SuccessFile = " + SuccessFile)
+            if done:
                 # additional timeout of 5 seconds for the pdf to appear
                 timeout = 50
                 while timeout > 0:
                     timeout = timeout - 1
-                    if os.path.isfile(SuccessFile):
+                    if self.written_size(outputs["spectrum.pdf"], started) is not None:
                         success = True
                         break
                     time.sleep(0.1)
-            macro_process.kill()
-            # Need to also kill the auto-reloading "feature" of ACD, otherwise the macro will not finish properly
-            subprocess.run("taskkill /f /im SPECMAN.EXE", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            subprocess.run("taskkill /f /im CHEMSK.EXE", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            subprocess.run("taskkill /f /im ACDHOST.EXE", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
-            if method is not None:
-                # Now open the jdx and get the integral data
-                yields = []
-                conversions = []
-                if standard is not None:
-                    jdx_filename = config["NMRFolder"] + fname + "/" + fname1 + ".jdx"
-                    if os.path.isfile(jdx_filename):
-                        integral_block_found = False
-                        jdx_file = open(jdx_filename, "r")
-                        while (line := jdx_file.readline()) != "":
-                            if line.startswith("##$INTEGRALS=ACDTABLE(X1,X2,LogValue)"):
-                                # Found the Integral block, now get all the integrals.
-                                integral_block_found = True
-                                break
-                        peak_integrals = {}
-                        if integral_block_found:
-                            while (line := jdx_file.readline()) != "":
-                                # Break when next 'data-label' "##", or EOF is reached
-                                if line.startswith("##"):
-                                    break
-                                else:
-                                    if line.startswith("("):
-                                        splitted_line = line.replace("(", "").replace(")", "").split(",")
-                                        # find peak
-                                        for peak in starting_material_peaks + product_peaks + standard_peaks:
-                                            if peak["begin_ppm"] == float(splitted_line[0]) and peak["end_ppm"] == float(splitted_line[1]):
-                                                peak_integrals[peak["ID"]] = float(splitted_line[2])
-                                                break
-                        jdx_file.close()
-                    
-                    # Calculate yield & conversion
-                    for peak in product_peaks:
-                        if peak["ID"] in peak_integrals:
-                            yld = peak_integrals[peak["ID"]] * peak["Eq"] / peak["nF"] # the yield
-                            yields.append([peak, yld])
-                    for peak in starting_material_peaks:
-                        if peak["ID"] in peak_integrals:
-                            rem_percent = peak_integrals[peak["ID"]] / (peak["Eq"] * peak["nF"]) # remaining starting material
-                            conv = 100 - rem_percent # conversion
-                            conversions.append([peak, conv])
-                
-                # Generate Report.TXT for Sciformation ELN.
-                report_filename = config["NMRFolder"] + fname + "/Report.TXT"
-                report_string = ("###################################\n"
-                                 "# REPORT OF AUTOMATIC INTEGRATION #\n"
-                                 "###################################\n"
-                                 "Date: " + datetime.now().strftime("%d.%m.%Y %H:%M:%S") + "\n"
-                                 "Sample: " + fname + "\n"
-                                 "Method: " + method["Name"] + " (ID: " + str(method["ID"]) + ")\n")
-                if standard is not None:
-                    report_string += "Internal standard: " + standard["annotation"] + " @ " + str(standard["reference_ppm"]) + " ppm\n"
-                if yields:
-                    report_string += "\nYIELDS:\n"
-                    for yld in yields:
-                        report_string += "{:>20}: {:.2f}".format(yld[0]["annotation"], yld[1])
-                        report_string += "% @ {:.2f} ppm\n".format((yld[0]["begin_ppm"] + yld[0]["end_ppm"]) / 2)
-                if conversions:
-                    report_string += "\nCONVERSIONS:\n"
-                    for conv in conversions:
-                        report_string += "{:>20}: {:.2f}".format(conv[0]["annotation"], conv[1])
-                        report_string += "% @ {:.2f} ppm\n".format((conv[0]["begin_ppm"] + conv[0]["end_ppm"]) / 2)
-                report_file = open(report_filename, "w")
-                report_file.write(report_string)
-                report_file.close()
-                        
-                # Write to DB.
-                if standard is not None:
-                    result_string = ""
-                    if yields:
-                        result_string += "Yield: "
-                        first = True
-                        for yld in yields:
-                            if not first:
-                                result_string += "/"
-                            else:
-                                first = False
-                            result_string += str(round(yld[1]))
-                        result_string += "%. "
-                    if conversions:
-                        result_string += "Conv.: "
-                        first = True
-                        for conv in conversions:
-                            if not first:
-                                result_string += "/"
-                            else:
-                                first = False
-                            result_string += str(round(conv[1]))
-                        result_string += "%. "
-                else:
-                    result_string = "n.d."
-                self.mysql_reader.write_result(fname, result_string)
-            
-            self.running = False
-        except:
-            #just making sure that it always finishes
-            self.running = False
+        finally:
+            self.cleanup(macro_process, config["ACDFolder"])
+        return success
+
+    @staticmethod
+    def written_size(path, since):
+        """
+        Returns the size of a file which was written after the timestamp since, or None.
+        Files of an earlier evaluation of the same spectrum are ignored.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_mtime < since:
+            return None
+        return stat.st_size
+
+    @staticmethod
+    def file_signature(path, since):
+        """
+        Returns (size, modification time) of a file which was written after the timestamp
+        since, or None.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_mtime < since:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def is_released(path):
+        """
+        Returns False if the file cannot be opened for writing, i.e. on Windows if another
+        process (specman while it saves the file) still holds it open.
+        """
+        try:
+            open(path, "r+b").close()
+        except OSError:
+            return False
         return True
 
+    def cleanup(self, macro_process, acd_folder):
+        """
+        Kills the processes which ACD leaves behind after the macro. Other specman instances,
+        which are still evaluating spectra of other jobs, are not touched: the processes are
+        only killed when the last running macro has finished.
+        """
+        # the process tree of this macro
+        subprocess.run("taskkill /f /t /pid " + str(macro_process.pid), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        macro_process.kill()
+        AcdMacro.finish(acd_folder, kill=AcdMacro.kill_all)
+
+    @staticmethod
+    def finish(acd_folder, kill):
+        """
+        Counts a finished macro. After the last running macro of this process, the marker file
+        is released, and the leftovers are killed if kill is True.
+        """
+        with AcdMacro.active_lock:
+            AcdMacro.active -= 1
+            if AcdMacro.active > 0:
+                return
+            AcdMacro.unregister()
+            if kill:
+                AcdMacro.kill_leftovers(acd_folder)
+
+    @staticmethod
+    def lock(file, blocking):
+        """
+        Locks an open file exclusively. Raises OSError if the file is locked by another process
+        (or, if blocking is True, if the lock could not be taken after a while).
+        """
+        if os.name == "nt":
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def machine_lock(acd_folder):
+        """
+        Holds LOCK_FILE in the ACDFolder, which is shared by all programs on the machine.
+        """
+        with open(os.path.join(acd_folder, AcdMacro.LOCK_FILE), "a+b") as lock_file:
+            AcdMacro.lock(lock_file, blocking=True)
+            yield
+
+    @staticmethod
+    def register(acd_folder):
+        """
+        Creates and locks the marker file of this process, which tells the other programs that
+        macros are running here. Called when the first macro of this process starts.
+        """
+        marker = None
+        try:
+            with AcdMacro.machine_lock(acd_folder):
+                marker = open(os.path.join(acd_folder, AcdMacro.MARKER_PREFIX + str(os.getpid())), "a+b")
+                AcdMacro.lock(marker, blocking=False)
+        except OSError:
+            logging.warning("Could not register the ACD macros of this process in " + acd_folder + ".")
+            logging.exception("")
+            if marker is not None:
+                marker.close()
+            return
+        AcdMacro.marker = marker
+
+    @staticmethod
+    def unregister():
+        """
+        Releases and removes the marker file of this process.
+        """
+        if AcdMacro.marker is None:
+            return
+        path = AcdMacro.marker.name
+        AcdMacro.marker.close()
+        AcdMacro.marker = None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def kill_leftovers(acd_folder):
+        """
+        Kills all ACD processes on the machine, unless macros are still running in another
+        process (whose marker file is locked). Must only be called when no macro of this
+        process is running.
+        """
+        try:
+            with AcdMacro.machine_lock(acd_folder):
+                for name in os.listdir(acd_folder):
+                    if not name.startswith(AcdMacro.MARKER_PREFIX):
+                        continue
+                    path = os.path.join(acd_folder, name)
+                    try:
+                        with open(path, "a+b") as marker:
+                            AcdMacro.lock(marker, blocking=False)
+                    except OSError:
+                        logging.debug("ACD macros are running in another process, the ACD processes are not killed.")
+                        return
+                    # the marker of a process which has ended without removing it
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                # Need to also kill the auto-reloading "feature" of ACD, otherwise the macro will not finish properly
+                subprocess.run("taskkill /f /im SPECMAN.EXE", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                subprocess.run("taskkill /f /im CHEMSK.EXE", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                subprocess.run("taskkill /f /im ACDHOST.EXE", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            logging.warning("Could not lock " + acd_folder + ", the ACD processes are not killed.")
+            logging.exception("")
+
+    def evaluate(self, config):
+        """
+        Reads the integrals from the JCAMP file which was exported by the macro, calculates
+        yields & conversions, writes the Report.TXT and the result to the DB (unless
+        write_result is False). The result is also stored in self.result.
+        """
+        method = self.method
+        standard = self.standard
+        fname = self.fname
+
+        # Now open the jdx and get the integral data
+        yields = []
+        conversions = []
+        if standard is not None:
+            jdx_filename = config["NMRFolder"] + fname + "/" + self.fname1 + ".jdx"
+            peak_integrals = {}
+            if os.path.isfile(jdx_filename):
+                # find the integral of every peak in the ##$INTEGRALS table of the jdx
+                jdx = Jcamp.read(jdx_filename)
+                peaks = self.starting_material_peaks + self.product_peaks + self.standard_peaks
+                integrals = jdx.match_integrals([peak["begin_ppm"] for peak in peaks], [peak["end_ppm"] for peak in peaks])
+                for peak, integral in zip(peaks, integrals):
+                    if not math.isnan(integral):
+                        peak_integrals[peak["ID"]] = float(integral)
+
+            # Calculate yield & conversion
+            for peak in self.product_peaks:
+                if peak["ID"] in peak_integrals:
+                    yld = peak_integrals[peak["ID"]] * peak["Eq"] / peak["nF"] # the yield
+                    yields.append([peak, yld])
+            for peak in self.starting_material_peaks:
+                if peak["ID"] in peak_integrals:
+                    rem_percent = peak_integrals[peak["ID"]] / (peak["Eq"] * peak["nF"]) # remaining starting material
+                    conv = 100 - rem_percent # conversion
+                    conversions.append([peak, conv])
+
+        # Generate Report.TXT for Sciformation ELN.
+        report_filename = config["NMRFolder"] + fname + "/Report.TXT"
+        report_string = ("###################################\n"
+                         "# REPORT OF AUTOMATIC INTEGRATION #\n"
+                         "###################################\n"
+                         "Date: " + datetime.now().strftime("%d.%m.%Y %H:%M:%S") + "\n"
+                         "Sample: " + fname + "\n"
+                         "Method: " + method["Name"] + " (ID: " + str(method["ID"]) + ")\n")
+        if standard is not None:
+            report_string += "Internal standard: " + standard["annotation"] + " @ " + str(standard["reference_ppm"]) + " ppm\n"
+        if yields:
+            report_string += "\nYIELDS:\n"
+            for yld in yields:
+                report_string += "{:>20}: {:.2f}".format(yld[0]["annotation"], yld[1])
+                report_string += "% @ {:.2f} ppm\n".format((yld[0]["begin_ppm"] + yld[0]["end_ppm"]) / 2)
+        if conversions:
+            report_string += "\nCONVERSIONS:\n"
+            for conv in conversions:
+                report_string += "{:>20}: {:.2f}".format(conv[0]["annotation"], conv[1])
+                report_string += "% @ {:.2f} ppm\n".format((conv[0]["begin_ppm"] + conv[0]["end_ppm"]) / 2)
+        report_file = open(report_filename, "w")
+        report_file.write(report_string)
+        report_file.close()
 
+        # Write to DB.
+        if standard is not None:
+            result_string = ""
+            if yields:
+                result_string += "Yield: "
+                first = True
+                for yld in yields:
+                    if not first:
+                        result_string += "/"
+                    else:
+                        first = False
+                    result_string += str(round(yld[1]))
+                result_string += "%. "
+            if conversions:
+                result_string += "Conv.: "
+                first = True
+                for conv in conversions:
+                    if not first:
+                        result_string += "/"
+                    else:
+                        first = False
+                    result_string += str(round(conv[1]))
+                result_string += "%. "
+        else:
+            result_string = "n.d."
+        self.result = result_string
+        if self.write_result:
+            self.mysql_reader.write_result(fname, result_string)
@@ -3,6 +3,7 @@ import time
 import threading
 import logging
 from MySQLReader import *
+from StatusPublisher import StatusPublisher
 
 class Autosampler:
     """
@@ -24,9 +25,27 @@ class Autosampler:
             time.sleep(2)
         
         self.port = config['ASPort']
+        # a new port is used at the next connect()
+        self.mysql_reader.config_service.subscribe('ASPort', self.set_port)
         self.ser = False       # serial port
-        self.errorcode = -1    # error code
+        self.state = AutosamplerState(-1)    # error code, see the errorcode property
         self.last_contact = 0  # timestamp of last contact
+        # time in seconds without any status from the Autosampler, after which the connection
+        # is considered lost (unless the Autosampler is at work, errorcode 1).
+        self.contact_timeout = 5
+        # functions which are called with every status received from the Autosampler
+        self.subscribers = []
+        # functions which are called when the status, the connection or the port changes
+        self.listeners = []
+        # set while the serial port is open, the listener sleeps on it otherwise.
+        self.connected = threading.Event()
+        # counters, see stats()
+        self._stats_lock = threading.Lock()
+        self.statuses = 0       # status frames received from the Autosampler
+        self.transitions = {}   # number of status changes as {(old errorcode, new errorcode): count}
+        # writes the error code to the db, so that the webpage can read it.
+        # the heartbeat for last_contact can be configured in the config table (ASHeartbeat, in seconds).
+        self.status_publisher = StatusPublisher(self.mysql_reader, config.get('ASHeartbeat') or 5)
 
         # define all error codes
         self.errorcodelist = {
@@ -49,6 +68,13 @@ class Autosampler:
         self.listener.daemon = True
         self.listener.start()
         
+    def set_port(self, port):
+        """
+        Sets the serial port, which is used from the next connect() on.
+        """
+        self.port = port
+        self.notify_listeners()
+    
     def connect(self):
         """
         Establish connection to the Autosampler.
@@ -56,12 +82,15 @@ class Autosampler:
         Returns True if connection was successful.
         """
         try:
-            self.ser = serial.Serial(port=self.port, baudrate=9600, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, bytesize=serial.EIGHTBITS, xonxoff=False, rtscts=False, dsrdtr=False)
+            # the timeout lets the listener check for a lost connection while it waits for data
+            self.ser = serial.Serial(port=self.port, baudrate=9600, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, bytesize=serial.EIGHTBITS, xonxoff=False, rtscts=False, dsrdtr=False, timeout=0.5)
             # ignore the first few bytes of the stuff that is returned from the port, because sometimes
             # the program will complain about "invalid start bytes"
             if self.ser.is_open:
                 for i in range(5):
                     buffer_string = self.ser.read(self.ser.inWaiting())
+                self.connected.set()
+                self.notify_listeners()
                 return True
             else:
                 return False
@@ -73,9 +102,11 @@ class Autosampler:
         """
         Disconnect the Autosampler, and stop listening to the serial port.
         """
+        self.connected.clear()
         if self.is_connected():
             self.ser.close()
         self.ser = False
+        self.notify_listeners()
             
     def is_connected(self):
         """
@@ -86,42 +117,112 @@ class Autosampler:
         else:
             return False
 
+    @property
+    def errorcode(self):
+        """
+        The current status of the Autosampler, see errorcodelist.
+        """
+        return self.state.errorcode
+    
+    def wait_for(self, predicate, timeout=None):
+        """
+        Blocks until predicate(errorcode) is True, or until the timeout (in seconds) has passed.
+        Returns True if the predicate was fulfilled.
+        """
+        return self.state.wait_for(predicate, timeout)
+    
+    def subscribe(self, callback):
+        """
+        Registers a function which is called with every status (error code) received from the
+        Autosampler, in the order in which they were received, including repetitions of the 
+        same status. The callback runs in the listener thread, so it should return quickly.
+        """
+        self.subscribers.append(callback)
+    
+    def add_listener(self, callback):
+        """
+        Registers a function which is called without arguments whenever the status (error 
+        code), the connection or the port of the Autosampler changes. Unlike subscribe(), 
+        repetitions of the same status are not reported.
+        The callback runs in the thread which changed the state, so it should return quickly.
+        """
+        self.listeners.append(callback)
+    
+    def notify_listeners(self):
+        for callback in self.listeners:
+            try:
+                callback()
+            except:
+                logging.exception("")
+    
+    def stats(self):
+        """
+        Returns the status and the counters of the Autosampler as a dictionary (errorcode,
+        connected, last_contact, statuses, transitions).
+        """
+        with self._stats_lock:
+            transitions = dict(self.transitions)
+        return {"errorcode": self.errorcode, "connected": self.is_connected(), "last_contact": self.last_contact,
+                "statuses": self.statuses, "transitions": transitions}
+    
     def listen(self):
         """
         Keeps listening to the Autosampler, if it is connected.
         Should always run in the background as a daemon.
         """
-        timeout = 10000
         while True:
-            if self.ser != False and self.ser.is_open:
-                buffer_string = self.ser.read(self.ser.inWaiting())
-                buffer_string = buffer_string.decode('UTF-8')
-                if buffer_string != "":
-                    self.last_contact = time.time()
-                    timeout = 25
-                    new_errorcode = int(buffer_string[-1])
-                    if new_errorcode != self.errorcode:
-                        logging.info("Autosampler status changed from " + str(self.errorcode) + " [" + self.errorcodelist[int(self.errorcode)] + "] to " + str(new_errorcode) + " [" + self.errorcodelist[int(new_errorcode)] + "]!")
-                        self.errorcode = int(new_errorcode)
-                else:
+            if not self.is_connected():
+                self.set_errorcode(-2)
+                self.connected.wait()
+                continue
+            ser = self.ser
+            parser = StatusFrameParser()
+            silent_since = time.monotonic()
+            try:
+                while ser is self.ser:
+                    # block until the first byte arrives (or the timeout of the port passes), 
+                    # then take everything else which is already waiting.
+                    data = ser.read(1)
+                    if data:
+                        data += ser.read(ser.inWaiting())
+                    for new_errorcode in parser.feed(data):
+                        self.last_contact = time.time()
+                        self.statuses += 1
+                        silent_since = time.monotonic()
+                        self.set_errorcode(new_errorcode)
+                        for callback in self.subscribers:
+                            try:
+                                callback(new_errorcode)
+                            except:
+                                logging.exception("")
                     # in this case no comms were received from the Autosampler.
                     # after a certain time of no comms, change the status to -2 (connection lost)
                     # exception is if status is 1, because then it may happen that the autosampler 
                     # doesn't respond for a certain amount of time.
-                    if self.errorcode != 1:
-                        timeout -= 1
-                    if timeout <= 0:
-                        self.errorcode = -2
-            else:
-                self.errorcode = -2
-            
-            # write to db, so that the webpage can read it.
-            conn, cur = self.mysql_reader.connect_db()
-            if conn is not None and cur is not None:
-                cur.execute("UPDATE as_status SET as_status = " + str(self.errorcode) + ", last_contact = " + str(int(time.time())))
-                conn.close()
-            
-            time.sleep(0.2)
+                    if self.errorcode == 1:
+                        silent_since = time.monotonic()
+                    elif self.last_contact != 0 and time.monotonic() - silent_since > self.contact_timeout:
+                        self.set_errorcode(-2)
+            except:
+                if ser is self.ser:
+                    logging.error("Lost connection to the Autosampler!")
+                    logging.exception("")
+                    self.disconnect()
+    
+    def set_errorcode(self, new_errorcode):
+        """
+        Sets the status of the Autosampler, and hands it to the publisher, which writes it 
+        to the db.
+        """
+        old_errorcode = self.state.set(new_errorcode)
+        if new_errorcode != old_errorcode:
+            with self._stats_lock:
+                transition = (old_errorcode, new_errorcode)
+                self.transitions[transition] = self.transitions.get(transition, 0) + 1
+            self.notify_listeners()
+        if new_errorcode != old_errorcode and new_errorcode >= 0:
+            logging.info("Autosampler status changed from " + str(old_errorcode) + " [" + self.errorcodelist[int(old_errorcode)] + "] to " + str(new_errorcode) + " [" + self.errorcodelist[int(new_errorcode)] + "]!")
+        self.status_publisher.publish(new_errorcode)
     
     def yell(self, stuff):
         """
@@ -136,11 +237,14 @@ class Autosampler:
         else:
             logging.error("Autosampler is not connected.")
     
-    def is_error(self):
+    def is_error(self, errorcode=None):
         """
         Returns True if Errorcode is 2 or greater than 3, and False otherwise.
+        If errorcode is given, it is checked instead of the current status.
         """
-        if self.errorcode > 3 or self.errorcode == 2:
+        if errorcode is None:
+            errorcode = self.errorcode
+        if errorcode > 3 or errorcode == 2:
             return True
         else:
             return False
@@ -168,21 +272,13 @@ class Autosampler:
         
         Returns True if the sample wsa inserted successfully, and False otherwise.
         """
-        inserted = False
         if in_queue:
             self.yell("N" + str(sample))
         else:
             self.yell("M" + str(sample))
-        while timeout > 0:
-            time.sleep(1)
-            timeout -= 1
-            if self.errorcode == 3:
-                inserted = True
-                break
-            elif self.is_error():
-                inserted = False
-                break
-        return inserted
+        # returns as soon as the Autosampler reports that the sample is inside, or an error.
+        self.wait_for(lambda errorcode: errorcode == 3 or self.is_error(errorcode), timeout)
+        return self.errorcode == 3
     
     def return_sample(self, sample, timeout=120):
         """
@@ -196,15 +292,10 @@ class Autosampler:
         
         Returns True if the sample wsa returned successfully, and False otherwise.
         """
-        returned = False
         self.yell("R" + str(sample))
-        while timeout > 0:
-            time.sleep(1)
-            timeout -= 1
-            if self.errorcode == 0:
-                returned = True
-                break
-        return returned
+        # returns as soon as the Autosampler reports that it is ready again, or an error.
+        self.wait_for(lambda errorcode: errorcode == 0 or self.is_error(errorcode), timeout)
+        return self.errorcode == 0
     
     def homing(self):
         """
@@ -212,11 +303,95 @@ class Autosampler:
         """
         self.yell("h")
     
-    def move_to_pos(self, pos):
+    def move_to_pos(self, pos, timeout=0):
         """
         Tells the Autosampler to move to a certain holder.
         
         Arguments:
         pos -- the holder number the Autosampler should move to.
+        timeout -- time in seconds which the program waits for the Autosampler to acknowledge
+                   the command with a status. 0 returns right away.
+        
+        Returns True if the Autosampler has sent a status since the command (or if timeout is 0).
         """
+        updates = self.state.updates
         self.yell("m" + str(pos))
+        if not timeout:
+            return True
+        # the busy status of a short rotation may already be over when the caller looks at it,
+        # so wait for any status sent after the command instead of a certain one.
+        return self.state.wait_for_update(updates, timeout)
+
+
+class StatusFrameParser:
+    """
+    Splits the byte stream coming from the Autosampler into status frames.
+    
+    The Autosampler reports its status as a single ASCII digit (see Autosampler.errorcodelist),
+    so every digit is one frame. Line breaks and other bytes in between are skipped.
+    """
+    
+    def feed(self, data):
+        """
+        Returns the list of all status codes contained in data (bytes), in order.
+        """
+        codes = []
+        for byte in data:
+            if 48 <= byte <= 57:    # "0" to "9"
+                codes.append(byte - 48)
+            elif byte not in b"\r\n ":
+                logging.debug("Ignoring unexpected byte from Autosampler: " + repr(bytes([byte])))
+        return codes
+
+
+class AutosamplerState:
+    """
+    Thread-safe holder of the Autosampler's status (error code).
+    The listener sets the status, and other threads can block until the status fulfills a
+    condition, instead of polling it.
+    """
+    
+    def __init__(self, errorcode):
+        self._cond = threading.Condition()
+        self._errorcode = errorcode
+        self._updates = 0
+    
+    @property
+    def errorcode(self):
+        return self._errorcode
+    
+    @property
+    def updates(self):
+        """
+        The number of statuses set so far, including repetitions of the same status.
+        """
+        return self._updates
+    
+    def set(self, errorcode):
+        """
+        Sets a new status and wakes up all waiting threads.
+        Returns the previous status.
+        """
+        with self._cond:
+            old_errorcode = self._errorcode
+            self._errorcode = errorcode
+            self._updates += 1
+            self._cond.notify_all()
+        return old_errorcode
+    
+    def wait_for(self, predicate, timeout=None):
+        """
+        Blocks until predicate(errorcode) is True, or until the timeout (in seconds) has passed.
+        Returns True if the predicate was fulfilled.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: predicate(self._errorcode), timeout)
+    
+    def wait_for_update(self, updates, timeout=None):
+        """
+        Blocks until a status has been set after the given value of updates, or until the
+        timeout (in seconds) has passed.
+        Returns True if a status has been set.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._updates != updates, timeout)
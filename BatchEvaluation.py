@@ -0,0 +1,208 @@
+"""
+Evaluates many spectra of the archive again, e.g. after the peaks of a method were corrected.
+
+Usage:
+    python BatchEvaluation.py --method 12
+    python BatchEvaluation.py --sample "MD-123*" [--workers 4]
+
+The samples are selected from the samples table (by method and/or by a pattern for the name),
+and their folders are looked up in config['NMRFolder']. The spectra are evaluated by a pool
+of processes, each running its own ACD specman, and the results are written to the DB in
+batches.
+"""
+import argparse
+import fnmatch
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from AcdMacro import AcdMacro
+from EvaluationCache import EvaluationCache
+from MySQLReader import MySQLReader
+
+# state of a worker process, see init_worker()
+worker_reader = None
+worker_cache = None
+
+
+def init_worker(mysql_args, cache_folder, cache_bytes):
+    """
+    Sets up a worker process with its own DB connections and a view on the shared cache.
+    """
+    global worker_reader, worker_cache
+    worker_reader = MySQLReader(*mysql_args)
+    worker_cache = EvaluationCache(cache_folder, cache_bytes) if cache_folder else None
+    # the other workers are still running their macros, so only the process tree of each macro
+    # is killed. The leftovers are killed by BatchEvaluation.run when all workers are done, and
+    # only if no other program is running macros (see AcdMacro.kill_leftovers).
+    AcdMacro.kill_all = False
+
+
+def evaluate_sample(name, method, timeout):
+    """
+    Evaluates one sample in a worker process.
+    Returns (name, result), the result is None if the evaluation failed.
+    """
+    workdir = tempfile.mkdtemp(prefix="batch_")
+    try:
+        macro = AcdMacro(worker_reader, name, method, workdir, timeout, worker_cache, write_result=False)
+        if macro.macro():
+            return name, macro.result
+    except:
+        logging.exception("")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return name, None
+
+
+class BatchEvaluation:
+    """
+    Evaluates a selection of archived spectra in parallel.
+    """
+
+    def __init__(self, mysql_reader, workers=None, timeout=120, batch_size=50, use_cache=True):
+        """
+        Arguments:
+        mysql_reader -- a MySQLReader object
+        workers      -- number of worker processes, by default the number of CPUs
+        timeout      -- time in seconds for specman to finish one spectrum
+        batch_size   -- number of results which are written to the DB at once
+        use_cache    -- if True, the EvaluationCache of the EvaluationQueue is used and filled
+        """
+        self.mysql_reader = mysql_reader
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+
+    def select(self, method=None, sample_filter=None):
+        """
+        Returns the list of (name, method) of all samples which match the selection and
+        whose FID exists in the NMR folder.
+
+        Arguments:
+        method        -- only samples with this method ID
+        sample_filter -- only samples whose name matches this pattern (with * and ?)
+        """
+        config = self.mysql_reader.read_config()
+        nmr_folder = config["NMRFolder"]
+        if nmr_folder[-1] != "/" and nmr_folder[-1] != "\\":
+            nmr_folder += "/"
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            return []
+        if method is not None:
+            cur.execute("SELECT Name, Method FROM samples WHERE Method = %s ORDER BY ID", (method,))
+        else:
+            cur.execute("SELECT Name, Method FROM samples WHERE Method IS NOT NULL AND Method != 0 ORDER BY ID")
+        samples = cur.fetchall()
+        conn.close()
+        # folders of the archive which contain a FID
+        folders = set()
+        try:
+            for entry in os.scandir(nmr_folder):
+                if entry.is_dir() and os.path.isfile(os.path.join(entry.path, "nmr_fid.dx")):
+                    folders.add(entry.name)
+        except OSError:
+            logging.error("Can't read the NMR folder " + nmr_folder + ".")
+            return []
+        selection = []
+        seen = set()
+        for sample in samples:
+            name = sample["Name"]
+            if name in seen or name not in folders:
+                continue
+            if sample_filter is not None and not fnmatch.fnmatchcase(name, sample_filter):
+                continue
+            seen.add(name)
+            selection.append((name, sample["Method"]))
+        return selection
+
+    def run(self, method=None, sample_filter=None, progress=None):
+        """
+        Evaluates all selected samples (see select()), and writes the results to the DB.
+
+        Arguments:
+        method        -- only samples with this method ID
+        sample_filter -- only samples whose name matches this pattern (with * and ?)
+        progress      -- function which is called after every spectrum with the number of
+                         finished spectra, the total number, and the throughput in spectra
+                         per second; logs the progress by default
+
+        Returns a dictionary with the number of evaluated and failed spectra, the time and the
+        throughput.
+        """
+        if progress is None:
+            progress = self.log_progress
+        selection = self.select(method, sample_filter)
+        config = self.mysql_reader.read_config()
+        cache_folder = None
+        cache_bytes = 0
+        if self.use_cache:
+            cache_folder = config.get('EvaluationCacheFolder') or os.path.join(os.getcwd(), "evaluation_cache")
+            cache_bytes = (config.get('EvaluationCacheMB') or 1024) * 1024 * 1024
+        mysql_args = (self.mysql_reader.mysql_user, self.mysql_reader.mysql_pass, self.mysql_reader.mysql_host,
+                      self.mysql_reader.mysql_db, self.mysql_reader.xampp_location)
+        logging.info("Evaluating " + str(len(selection)) + " spectra with " + str(self.workers) + " workers.")
+
+        start = time.monotonic()
+        done = 0
+        failed = []
+        results = []
+        with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(mysql_args, cache_folder, cache_bytes)) as pool:
+            futures = [pool.submit(evaluate_sample, name, method_id, self.timeout) for name, method_id in selection]
+            for future in as_completed(futures):
+                name, result = future.result()
+                done += 1
+                if result is None:
+                    failed.append(name)
+                else:
+                    results.append((name, result))
+                if len(results) >= self.batch_size:
+                    self.mysql_reader.write_results(results)
+                    results = []
+                progress(done, len(selection), done / max(time.monotonic() - start, 1e-9))
+        if results:
+            self.mysql_reader.write_results(results)
+        if selection and config.get('ACDFolder'):
+            AcdMacro.kill_leftovers(config['ACDFolder'])
+        elapsed = time.monotonic() - start
+        return {"evaluated": done - len(failed), "failed": failed, "seconds": round(elapsed, 1),
+                "spectra_per_second": round(done / elapsed, 2) if elapsed > 0 else 0}
+
+    @staticmethod
+    def log_progress(done, total, rate):
+        logging.info("Evaluated " + str(done) + "/" + str(total) + " spectra ({:.2f} spectra/s).".format(rate))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluates archived spectra again.")
+    parser.add_argument("--method", type=int, help="only samples with this method ID")
+    parser.add_argument("--sample", help="only samples whose name matches this pattern (with * and ?)")
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    parser.add_argument("--timeout", type=int, default=120, help="timeout of specman per spectrum in seconds")
+    parser.add_argument("--no-cache", action="store_true", help="always run specman")
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-passwd", default="")
+    parser.add_argument("--mysql-host", default="localhost")
+    parser.add_argument("--mysql-db", default="autosampler")
+    args = parser.parse_args()
+    if args.method is None and args.sample is None:
+        parser.error("select the samples with --method and/or --sample")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    mysql_reader = MySQLReader(args.mysql_user, args.mysql_passwd, args.mysql_host, args.mysql_db, "")
+    batch = BatchEvaluation(mysql_reader, args.workers, args.timeout, use_cache=not args.no_cache)
+    summary = batch.run(args.method, args.sample)
+    logging.info("Done: " + str(summary["evaluated"]) + " evaluated, " + str(len(summary["failed"])) + " failed, " +
+                 str(summary["seconds"]) + " s, " + str(summary["spectra_per_second"]) + " spectra/s.")
+    if summary["failed"]:
+        logging.warning("Failed: " + ", ".join(summary["failed"]))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import threading
+import time
+import logging
+
+class ConfigService:
+    """
+    Holds a snapshot of the config table, so that reading the config costs no query.
+
+    The snapshot is read again from the DB when it is older than refresh_interval seconds,
+    or immediately when refresh() is called (e.g. after the config was changed by this
+    program). Known columns are converted to their types (see TYPES), so that e.g. NMRPort is
+    always an int.
+
+    Other components can subscribe to a column, and are called with its new value whenever it
+    changes. As soon as there is a subscriber, a watcher thread reads the config once per
+    refresh_interval, so that changes made in the web interface arrive without anyone asking
+    for the config.
+    """
+
+    TYPES = {"ASPort": str, "NMRIP": str, "NMRPort": int, "NMRFolder": str, "ACDFolder": str}
+
+    def __init__(self, mysql_reader, refresh_interval=5):
+        """
+        Arguments:
+        mysql_reader     -- a MySQLReader object
+        refresh_interval -- maximum age of the snapshot in seconds
+        """
+        self.mysql_reader = mysql_reader
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded = 0          # time.monotonic() of the last refresh
+        self._subscribers = {}    # column -> list of functions
+        self.watcher = None
+
+    def snapshot(self):
+        """
+        Returns the config as dictionary, or None if it was never read successfully.
+        The snapshot is refreshed first if it is too old; if that fails, the old snapshot is
+        returned.
+        """
+        if self._snapshot is None or time.monotonic() - self._loaded >= self.refresh_interval:
+            self.refresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return dict(snapshot)
+
+    def refresh(self):
+        """
+        Reads the config from the DB, and notifies the subscribers of changed columns.
+        Returns True if successful.
+        """
+        config = self._read()
+        if config is None:
+            if self._snapshot is not None:
+                # keep the old snapshot for another interval instead of retrying at every call
+                self._loaded = time.monotonic()
+            return False
+        with self._lock:
+            old = self._snapshot
+            self._snapshot = config
+            self._loaded = time.monotonic()
+            changed = [key for key in config if old is not None and old.get(key) != config[key]]
+            callbacks = [(key, callback) for key in changed for callback in self._subscribers.get(key, ())]
+        for key in changed:
+            if key in self.TYPES:
+                logging.info("Config " + key + " was changed to " + str(config[key]) + ".")
+        for key, callback in callbacks:
+            try:
+                callback(config[key])
+            except:
+                logging.exception("")
+        return True
+
+    def _read(self):
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            return None
+        try:
+            cur.execute("SELECT * from config")
+            rows = cur.fetchall()
+        except:
+            logging.exception("")
+            return None
+        finally:
+            conn.close()
+        if not rows:
+            return None
+        config = dict(rows[0])
+        for key, convert in self.TYPES.items():
+            if config.get(key) is not None:
+                try:
+                    config[key] = convert(config[key])
+                except ValueError:
+                    logging.error("Invalid value in config " + key + ": " + str(config[key]))
+        return config
+
+    def subscribe(self, key, callback):
+        """
+        Calls callback with the new value whenever the column key of the config changes.
+        Starts the watcher thread if necessary.
+        """
+        with self._lock:
+            self._subscribers.setdefault(key, []).append(callback)
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=self.watch, args=())
+                self.watcher.daemon = True
+                self.watcher.start()
+
+    def watch(self):
+        """
+        Background process which keeps the snapshot fresh while there are subscribers.
+        """
+        while True:
+            time.sleep(max(self._loaded + self.refresh_interval - time.monotonic(), 1))
+            if time.monotonic() - self._loaded >= self.refresh_interval:
+                self.refresh()
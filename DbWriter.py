@@ -0,0 +1,174 @@
+import itertools
+import threading
+import time
+import logging
+import MySQLdb
+from collections import OrderedDict
+
+class DbWriter:
+    """
+    Writes updates to the database in the background, in a thread of its own.
+
+    Producers hand over their statements with submit(), which never blocks. Every update has a
+    key which names what it writes (e.g. ("samples", 12, "Progress")); if an update with the
+    same key is still waiting, it is replaced by the new one, so that e.g. a progress which
+    changes several times per second is written only once. The waiting updates are written
+    in the order of their last submission, in transactions of up to batch_size statements.
+
+    If a batch fails because the MySQL server is not reachable (see TRANSIENT_ERRORS), it is
+    written again later, unless newer updates with the same keys have been submitted in the
+    meantime. If it fails for any other reason, its updates are written one by one, and an
+    update which fails again is logged and dropped, so that it does not hold up all later
+    updates.
+
+    The updates must not depend on each other's results, and nothing must read them back
+    right away: use the repositories directly for the changes of the sample status, which the
+    queue relies on.
+    """
+
+    # CR_CONN_HOST_ERROR, CR_SERVER_GONE_ERROR, CR_SERVER_LOST: the server was not reachable
+    TRANSIENT_ERRORS = (2003, 2006, 2013)
+
+    def __init__(self, mysql_reader, delay=0.2, batch_size=100):
+        """
+        Create a DbWriter. The writer thread is started with the first update.
+
+        Arguments:
+        mysql_reader -- a MySQLReader object
+        delay        -- time in seconds the writer waits after the first waiting update, so
+                        that repeated updates are coalesced
+        batch_size   -- maximum number of statements per transaction
+        """
+        self.mysql_reader = mysql_reader
+        self.delay = delay
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # key -> (statement, args)
+        self._busy = False              # True while a batch is written
+        self._unique = itertools.count()
+        self.writer = None
+        # counters, see stats()
+        self.submitted = 0
+        self.coalesced = 0    # updates which were replaced by a newer one before they were written
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0      # updates which failed for good, see write_singly
+
+    def submit(self, key, statement, args=None):
+        """
+        Queues an update and returns immediately.
+
+        Arguments:
+        key       -- hashable name of what the update writes; an update with the same key
+                     which is still waiting is replaced. None if the update must not be
+                     replaced.
+        statement -- the SQL statement, with %s for the parameters
+        args      -- the parameters of the statement
+        """
+        with self._cond:
+            if key is None:
+                key = ("unique", next(self._unique))
+            elif key in self._pending:
+                self.coalesced += 1
+                del self._pending[key]
+            self._pending[key] = (statement, args)
+            self.submitted += 1
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.run, args=(), name="DbWriter")
+                self.writer.daemon = True
+                self.writer.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until all updates which were submitted so far have been written.
+        Returns False if the timeout (in seconds) has passed before.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def run(self):
+        """
+        Background process which writes the updates.
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+            time.sleep(self.delay)
+            with self._cond:
+                batch = OrderedDict()
+                while self._pending and len(batch) < self.batch_size:
+                    key, update = self._pending.popitem(last=False)
+                    batch[key] = update
+                self._busy = True
+            try:
+                try:
+                    with self.mysql_reader.transaction() as cur:
+                        for statement, args in batch.values():
+                            cur.execute(statement, args)
+                    with self._cond:
+                        self.written += len(batch)
+                except Exception as e:
+                    if self.is_transient(e):
+                        raise
+                    logging.warning("Failed to write " + str(len(batch)) + " updates to the database, writing them one by one.")
+                    with self._cond:
+                        self.failures += 1
+                    self.write_singly(batch)
+                with self._cond:
+                    self.batches += 1
+            except:
+                logging.error("Failed to write " + str(len(batch)) + " updates to the database, trying again.")
+                logging.exception("")
+                with self._cond:
+                    self.failures += 1
+                    for key, update in reversed(list(batch.items())):
+                        if key not in self._pending:
+                            self._pending[key] = update
+                            self._pending.move_to_end(key, last=False)
+                time.sleep(1)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def write_singly(self, batch):
+        """
+        Writes the updates of a failed batch one by one. An update which fails is logged and
+        dropped. The written and dropped updates are removed from the batch; if the server is
+        not reachable anymore, the exception is raised, and the rest of the batch is left to be
+        written again.
+        """
+        while batch:
+            key, (statement, args) = next(iter(batch.items()))
+            try:
+                with self.mysql_reader.transaction() as cur:
+                    cur.execute(statement, args)
+                with self._cond:
+                    self.written += 1
+            except Exception as e:
+                if self.is_transient(e):
+                    raise
+                logging.error("Dropped the update " + str(key) + " (" + statement + "), which cannot be written.")
+                logging.exception("")
+                with self._cond:
+                    self.dropped += 1
+            del batch[key]
+
+    def is_transient(self, error):
+        """
+        Returns True if the update may succeed when it is written again later.
+        """
+        if isinstance(error, ConnectionError):
+            return True
+        return isinstance(error, MySQLdb.OperationalError) and bool(error.args) and error.args[0] in self.TRANSIENT_ERRORS
+
+    def stats(self):
+        """
+        Returns the counters of the writer as a dictionary.
+        """
+        with self._cond:
+            return {"submitted": self.submitted, "coalesced": self.coalesced, "written": self.written,
+                    "batches": self.batches, "failures": self.failures, "dropped": self.dropped,
+                    "pending": len(self._pending)}
@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import time
+import logging
+
+class EvaluationCache:
+    """
+    Content-addressed cache of the files exported by the ACD macro (jdx, pdf, esp).
+
+    The key of an entry is the hash of the FID file together with the hash of everything
+    which determines the output of the macro: the method, its peaks and the version of the
+    macro (AcdMacro.MACRO_VERSION). If a spectrum is evaluated again and neither the FID nor
+    the method was changed, the exported files are copied from the cache instead of running
+    specman again. Any change to the method or its peaks results in a new key, so outdated
+    entries are never used; they are evicted when the cache grows too large.
+
+    Every entry is a folder named by its key. The cache is bounded by the total size of the
+    entries, and the least recently used entries are removed first.
+    """
+
+    def __init__(self, folder, max_bytes=1024 * 1024 * 1024):
+        """
+        Arguments:
+        folder    -- folder in which the entries are stored, is created if necessary
+        max_bytes -- maximum total size of all entries
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> [size, time of last use]
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """
+        Reads the sizes and last use of the entries which are already on disk.
+        """
+        for entry in os.scandir(self.folder):
+            if ".tmp" in entry.name:
+                # left over from an interrupted store()
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.is_dir():
+                files = [f for f in os.scandir(entry.path) if f.is_file()]
+                size = sum(f.stat().st_size for f in files)
+                last_use = max([f.stat().st_mtime for f in files], default=0)
+                self._entries[entry.name] = [size, last_use]
+
+    @staticmethod
+    def file_hash(filename):
+        """
+        Returns the sha256 hash of a file as hex string.
+        """
+        digest = hashlib.sha256()
+        with open(filename, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def method_hash(method, peaks, version):
+        """
+        Returns a hash of a method (row of the methods table), its peaks (rows of the peaks
+        table) and the version of the macro.
+        """
+        peaks = sorted(peaks, key=lambda peak: peak["ID"])
+        text = json.dumps([version, method, peaks], sort_keys=True, default=str)
+        return hashlib.sha256(text.encode("UTF-8")).hexdigest()
+
+    def key(self, fid_file, method, peaks, version):
+        """
+        Returns the key of an evaluation.
+        """
+        return self.file_hash(fid_file)[:32] + self.method_hash(method, peaks, version)[:32]
+
+    def restore(self, key, files):
+        """
+        Copies the files of an entry to their destinations.
+
+        Arguments:
+        key   -- key of the entry
+        files -- dictionary of the names of the files in the entry (e.g. "spectrum.jdx") and
+                 their destination paths
+
+        Returns True if the entry exists and all files were copied, and False otherwise.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries[key][1] = time.time()
+        entry = os.path.join(self.folder, key)
+        try:
+            for name, destination in files.items():
+                shutil.copyfile(os.path.join(entry, name), destination)
+            os.utime(os.path.join(entry, next(iter(files))))
+        except OSError:
+            logging.warning("Evaluation cache entry " + key + " is incomplete, removing it.")
+            self._remove(key)
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, files):
+        """
+        Stores files as an entry of the cache, and evicts old entries if necessary.
+
+        Arguments:
+        key   -- key of the entry
+        files -- dictionary of the names of the files in the entry and their source paths
+        """
+        entry = os.path.join(self.folder, key)
+        # the files are first copied to a temporary folder, so that an entry is never seen
+        # incomplete by another thread.
+        temporary = entry + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+        try:
+            os.makedirs(temporary, exist_ok=True)
+            size = 0
+            for name, source in files.items():
+                shutil.copyfile(source, os.path.join(temporary, name))
+                size += os.path.getsize(source)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(temporary, entry)
+        except OSError:
+            logging.warning("Could not store the evaluation in the cache.")
+            logging.exception("")
+            shutil.rmtree(temporary, ignore_errors=True)
+            return False
+        with self._lock:
+            self._entries[key] = [size, time.time()]
+        self.evict()
+        return True
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits into max_bytes.
+        """
+        with self._lock:
+            total = sum(size for size, last_use in self._entries.values())
+            victims = []
+            for key, (size, last_use) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                victims.append(key)
+                total -= size
+        for key in victims:
+            self._remove(key)
+
+    def _remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        shutil.rmtree(os.path.join(self.folder, key), ignore_errors=True)
+
+    def stats(self):
+        """
+        Returns the counters of the cache as dictionary (hits, misses, entries, size).
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "size": sum(size for size, last_use in self._entries.values())}
@@ -0,0 +1,212 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import logging
+from AcdMacro import AcdMacro
+from EvaluationCache import EvaluationCache
+from Migrations import Migrations
+
+class EvaluationQueue:
+    """
+    Runs the automatic evaluation of measured spectra (AcdMacro) in the background, decoupled
+    from the measurement queue.
+
+    Jobs are stored in the evaluation_jobs table, so that jobs which were queued or running
+    when the program was closed are picked up again on the next start. A number of worker
+    threads (ACDWorkers in the config table, 1 by default) take the jobs in the order in which
+    they were submitted. Every job runs in its own temporary working directory, so that the
+    macro files of parallel jobs do not overwrite each other.
+
+    A failed job is queued again after retry_delay seconds (multiplied by the number of
+    attempts so far), until max_attempts is reached; then it is marked as Failed.
+
+    Job status (Status column):
+    Queued   -- waiting for a worker (or for the next attempt, see NextAttempt)
+    Running  -- a worker is evaluating the spectrum
+    Finished -- the evaluation was successful
+    Failed   -- all attempts failed, the last error is stored in the Error column
+    """
+
+    def __init__(self, mysql_reader, workers=None, max_attempts=3, timeout=60, retry_delay=30, poll_interval=5):
+        """
+        Create an EvaluationQueue and start its workers.
+
+        Arguments:
+        mysql_reader  -- a MySQLReader object
+        workers       -- number of evaluations which may run at the same time, by default
+                         ACDWorkers from the config table, or 1
+        max_attempts  -- number of times a job is tried before it is marked as Failed
+        timeout       -- time in seconds for the ACD NMR Processor to finish one evaluation
+        retry_delay   -- time in seconds before a failed job is tried again
+        poll_interval -- time in seconds after which idle workers check the table for jobs
+                         which were not submitted by this program, or are due for a retry
+        """
+        self.mysql_reader = mysql_reader
+        config = self.mysql_reader.read_config() or {}
+        if workers is None:
+            workers = config.get('ACDWorkers') or 1
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        # serializes the claiming of jobs between the workers of this program
+        self._claim_lock = threading.Lock()
+        # exported files of earlier evaluations, see EvaluationCache. the folder and its size
+        # (in MB) can be configured in the config table.
+        self.cache = EvaluationCache(config.get('EvaluationCacheFolder') or os.path.join(os.getcwd(), "evaluation_cache"),
+                                     (config.get('EvaluationCacheMB') or 1024) * 1024 * 1024)
+
+        self.setup_table()
+
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.work, args=(), name="EvaluationWorker-" + str(i + 1))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def setup_table(self):
+        """
+        Creates the evaluation_jobs table if it does not exist (see Migrations), and queues the
+        jobs again which were interrupted while running.
+        """
+        if Migrations(self.mysql_reader).migrate() is None:
+            return False
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            return False
+        try:
+            cur.execute("UPDATE evaluation_jobs SET Status = 'Queued', Updated = %s WHERE Status = 'Running'", (int(time.time()),))
+        finally:
+            conn.close()
+        return True
+
+    def submit(self, fname, method):
+        """
+        Queues the evaluation of a measured sample and returns immediately.
+        Returns the ID of the job, or None if it could not be stored.
+
+        Arguments:
+        fname  -- Folder name of the NMR spectrum
+        method -- The method ID in the mysql DB
+        """
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            logging.error("Could not queue the evaluation of sample " + fname + ".")
+            return None
+        try:
+            now = int(time.time())
+            cur.execute("INSERT INTO evaluation_jobs (SampleName, Method, Status, Created, Updated) VALUES (%s, %s, 'Queued', %s, %s)",
+                        (fname, method, now, now))
+            job_id = cur.lastrowid
+        finally:
+            conn.close()
+        logging.debug("Queued evaluation of sample " + fname + " (job " + str(job_id) + ").")
+        with self._cond:
+            self._cond.notify()
+        return job_id
+
+    def work(self):
+        """
+        Worker thread, which evaluates one job after the other.
+        """
+        while True:
+            try:
+                job = self.claim()
+            except:
+                logging.exception("")
+                job = None
+            if job is None:
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def claim(self):
+        """
+        Marks the oldest due job as Running and returns it, or returns None if there is none.
+        """
+        with self._claim_lock:
+            conn, cur = self.mysql_reader.connect_db()
+            if conn is None:
+                return None
+            try:
+                now = int(time.time())
+                cur.execute("SELECT * FROM evaluation_jobs WHERE Status = 'Queued' AND NextAttempt <= %s ORDER BY ID LIMIT 1", (now,))
+                job = cur.fetchone()
+                if job is None:
+                    return None
+                # the condition on Status makes sure that no other program took the job meanwhile
+                cur.execute("UPDATE evaluation_jobs SET Status = 'Running', Attempts = Attempts + 1, Updated = %s WHERE ID = %s AND Status = 'Queued'",
+                            (now, job["ID"]))
+                if cur.rowcount != 1:
+                    return None
+                job["Attempts"] += 1
+                return job
+            finally:
+                conn.close()
+
+    def run_job(self, job):
+        """
+        Evaluates the spectrum of a claimed job in a fresh working directory, and stores the
+        outcome.
+        """
+        fname = job["SampleName"]
+        logging.info("Evaluating sample " + fname + " (job " + str(job["ID"]) + ", attempt " + str(job["Attempts"]) + ").")
+        # time in the evaluation queue, since the job was submitted or was due for a retry
+        timeline = self.mysql_reader.timeline
+        timeline.record(None, fname, "evaluation_wait", max(job["Created"], job["NextAttempt"]), time.time(), "attempt " + str(job["Attempts"]))
+        workdir = tempfile.mkdtemp(prefix="evaluation_" + str(job["ID"]) + "_")
+        error = None
+        macro = None
+        try:
+            macro = AcdMacro(self.mysql_reader, fname, job["Method"], workdir, self.timeout, self.cache)
+            if not macro.macro():
+                error = "The ACD macro was not successful."
+        except Exception as e:
+            logging.exception("")
+            error = repr(e)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            if macro is not None:
+                timeline.record_phases(None, fname, macro.phases)
+        if error is None:
+            self.finish(job, "Finished")
+        elif job["Attempts"] < self.max_attempts:
+            logging.warning("Error while evaluating sample " + fname + ", trying again later: " + error)
+            self.finish(job, "Queued", error, int(time.time()) + self.retry_delay * job["Attempts"])
+        else:
+            logging.error("Error while evaluating sample " + fname + ", giving up: " + error)
+            self.finish(job, "Failed", error)
+
+    def count_by_status(self):
+        """
+        Returns the number of jobs of each status as dictionary {status: count}, or None if the
+        database is not available.
+        """
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            return None
+        try:
+            cur.execute("SELECT Status, COUNT(*) AS Count FROM evaluation_jobs GROUP BY Status")
+            return {row["Status"]: row["Count"] for row in cur.fetchall()}
+        finally:
+            conn.close()
+
+    def finish(self, job, status, error=None, next_attempt=0):
+        """
+        Writes the outcome of an attempt to the evaluation_jobs table.
+        """
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            # the job stays Running, and is queued again on the next start
+            logging.error("Could not store the outcome of job " + str(job["ID"]) + ".")
+            return
+        try:
+            cur.execute("UPDATE evaluation_jobs SET Status = %s, Error = %s, NextAttempt = %s, Updated = %s WHERE ID = %s",
+                        (status, error, next_attempt, int(time.time()), job["ID"]))
+        finally:
+            conn.close()
@@ -24,7 +24,6 @@ class Gui:
         self.spinsolve = queue.spinsolve
         self.mysql_reader = queue.mysql_reader
         self.queue = queue
-        self.heavy_counter = 9999
         self.xampp_location = xampp_location
     
         self.window = uic.loadUi("autosampler.ui")
@@ -32,10 +31,30 @@ class Gui:
         
         self.setup()
         
-        # start a daemon for polling data and refreshing the content of the window
-        self.gui_daemon = threading.Thread(target=self.loop, args=())
-        self.gui_daemon.daemon = True
-        self.gui_daemon.start()
+        # the labels are refreshed by signals whenever the state of a component changes. The
+        # signals may be emitted from any thread, the slots always run in the GUI thread.
+        self.signals = GuiSignals()
+        self.signals.autosampler_changed.connect(self.refresh_autosampler)
+        self.signals.spinsolve_changed.connect(self.refresh_spinsolve)
+        self.signals.webserver_changed.connect(self.refresh_webserver_status)
+        self.autosampler.add_listener(self.signals.autosampler_changed.emit)
+        self.spinsolve.add_listener(self.signals.spinsolve_changed.emit)
+        # the address of the spectrometer is only read again when it was changed in the config
+        config_service = self.mysql_reader.config_service
+        config_service.subscribe("NMRIP", lambda value: self.signals.spinsolve_changed.emit())
+        config_service.subscribe("NMRPort", lambda value: self.signals.spinsolve_changed.emit())
+        self.refresh_autosampler()
+        self.refresh_spinsolve()
+        
+        # the "seconds ago" of the last contact with the autosampler
+        self.clock = QtCore.QTimer()
+        self.clock.timeout.connect(self.refresh_last_contact)
+        self.clock.start(1000)
+        
+        # checking for apache and mysql takes some time, so it is done in the background
+        self.webserver_daemon = threading.Thread(target=self.watch_webserver, args=())
+        self.webserver_daemon.daemon = True
+        self.webserver_daemon.start()
         
         self.window.show()
         self.splash.finish(self.window)
@@ -95,6 +114,8 @@ class Gui:
         self.window.btn_Spinsolve_Connect.clicked.connect(self.spinsolve.connect)
         # Spinsolve disconnect
         self.window.btn_Spinsolve_Disconnect.clicked.connect(self.spinsolve.disconnect)
+        # Abort queue
+        self.window.btn_AbortQueue.clicked.connect(self.queue.abort_queue)
         # open xampp-control.exe
         self.window.btn_open_xampp_control.clicked.connect(self.mysql_reader.open_xampp_control)
         
@@ -118,55 +139,55 @@ class Gui:
         # maximize window
         self.window.showMaximized()
     
-    def loop(self):
+    def refresh_autosampler(self):
+        """
+        Refreshes the labels of the autosampler: port, connection, status and last contact.
+        """
+        self.refresh_label(self.window.label_AS_COMPort, self.autosampler.port)
+        self.refresh_connection_label(self.window.label_AS_Connection, self.autosampler.is_connected())
+        self.refresh_errorcode()
+        self.refresh_last_contact()
+    
+    def refresh_last_contact(self):
+        """
+        Refreshes the label with the time of the last contact with the autosampler.
+        """
+        last_contact = self.autosampler.last_contact
+        if last_contact == 0:
+            lastcontactstring = "Unknown"
+        else:
+            lastcontactdatetime = datetime.fromtimestamp(last_contact)
+            lastcontactstring = lastcontactdatetime.strftime("%d.%m.%Y %H:%M:%S")
+            lastcontactstring += " (" + str(int(time.time() - last_contact)) + " seconds ago)"
+        self.refresh_label(self.window.label_AS_LastContact, lastcontactstring)
+    
+    def refresh_spinsolve(self):
+        """
+        Refreshes the labels of the spectrometer: NMRIP & Port and connection.
+        """
+        config = self.mysql_reader.read_config()
+        if config is not None:
+            self.refresh_label(self.window.label_Spinsolve_NMRIP, config["NMRIP"] + ":" + str(config['NMRPort']))
+        self.refresh_connection_label(self.window.label_Spinsolve_Connection, self.spinsolve.is_connected())
+    
+    def watch_webserver(self):
         """
-        Always running in background and checking the status of the components
+        Always running in background and checking whether apache and mysql are running.
+        Emits webserver_changed when one of them was started or stopped.
         """
-        run = True
-        while run:
+        status = None
+        while True:
             try:
-                config = self.mysql_reader.read_config()
-                
-                # work ourselves through the labels
-                # autosampler com port
-                if self.autosampler.port != config["ASPort"]:
-                    # oh look the port was changed in the meantime
-                    self.autosampler.port = config["ASPort"]
-                self.refresh_label(self.window.label_AS_COMPort, self.autosampler.port)
-                
-                # autosampler connection status
-                self.refresh_connection_label(self.window.label_AS_Connection, self.autosampler.is_connected())
-                
-                # autosampler error code
-                self.refresh_errorcode()
-                
-                # autosampler last contact
-                last_contact = self.autosampler.last_contact
-                if last_contact == 0:
-                    lastcontactstring = "Unknown"
-                else:
-                    lastcontactdatetime = datetime.fromtimestamp(last_contact)
-                    lastcontactstring = lastcontactdatetime.strftime("%d.%m.%Y %H:%M:%S")
-                    lastcontactstring += " (" + str(int(time.time() - last_contact)) + " seconds ago)"
-                self.refresh_label(self.window.label_AS_LastContact, lastcontactstring)
-                
-                # spinsolve NMRIP & Port
-                self.refresh_label(self.window.label_Spinsolve_NMRIP, config["NMRIP"] + ":" + str(config['NMRPort']))
-                
-                # spinsolve connection status
-                self.refresh_connection_label(self.window.label_Spinsolve_Connection, self.spinsolve.is_connected())
-                
-                # run the "heavy" functions once per second only to save computational power
-                if self.heavy_counter > 60:
-                    self.heavy_counter = 0
-                    # check for apache and mysql
-                    self.refresh_webserver_status()
-                
-                # wait for 16 ms (=60 FPS)
-                self.heavy_counter += 1
-                time.sleep(0.016)
+                new_status = (self.mysql_reader.is_apache_running(), self.mysql_reader.is_mysqld_running())
+                if new_status != status:
+                    status = new_status
+                    self.signals.webserver_changed.emit(*status)
             except RuntimeError:
-                run = False
+                # the window was closed
+                return
+            except:
+                logging.exception("")
+            time.sleep(1)
     
     def refresh_errorcode(self):
         """
@@ -212,12 +233,12 @@ class Gui:
             label.setText(text)
             label.setStyleSheet("background-color: " + bgcolor + ";")
         
-    def refresh_webserver_status(self):
+    def refresh_webserver_status(self, apache_running, mysqld_running):
         """
         Refreshes the apache and mysql status
         """
         label = self.window.label_Apache
-        if self.mysql_reader.is_apache_running():
+        if apache_running:
             text = "\u2713 Running"
             bgcolor = "lightgreen"
         else:
@@ -227,7 +248,7 @@ class Gui:
             label.setStyleSheet("background-color: " + bgcolor + ";")
             label.setText(text)
         label = self.window.label_MySQL
-        if self.mysql_reader.is_mysqld_running():
+        if mysqld_running:
             text = "\u2713 Running"
             bgcolor = "lightgreen"
         else:
@@ -292,6 +313,15 @@ class QTextEditLogger(logging.Handler, QtCore.QObject):
         msg = self.format(record)
         self.appendPlainText.emit(msg)
         
+class GuiSignals(QtCore.QObject):
+    """
+    Signals which tell the GUI that the state of a component has changed.
+    """
+    autosampler_changed = QtCore.pyqtSignal()
+    spinsolve_changed = QtCore.pyqtSignal()
+    webserver_changed = QtCore.pyqtSignal(bool, bool)
+    
+        
 class QWebEngineViewFiltered(QtWebEngineWidgets.QWebEngineView):
     """
     a modified QWebEngineView which disallows any request outside of localhost
@@ -0,0 +1,463 @@
+import re
+import logging
+import numpy as np
+
+class Jcamp:
+    """
+    Reader and writer for JCAMP-DX files, like the spectra exported by the ACD NMR Processor
+    (.jdx) and the FIDs written by the Spinsolve software (nmr_fid.dx).
+
+    Data blocks (##XYDATA and the ##DATA TABLE pages of ##NTUPLES) are decoded into numpy
+    arrays in bulk, in AFFN as well as in ASDF (SQZ/DIF/DUP) form. Tables of tuples, e.g. the
+    ##$INTEGRALS=ACDTABLE(X1,X2,LogValue) table of ACD or a ##PEAK TABLE=(XY..XY), are parsed
+    into numpy record arrays.
+
+    Attributes:
+    labels -- dictionary of all labelled data records, with normalized labels as keys (upper
+              case, without spaces, hyphens, slashes and underscores, see normalize()), and the
+              value of their first occurrence
+    x      -- numpy array of the abscissa of the data, or None
+    data   -- dictionary of the decoded data as numpy arrays, with the symbol of the ordinate as
+              key (Y for XYDATA, e.g. R and I for the real and imaginary pages of an NTUPLES FID)
+    tables -- dictionary of the parsed tables as numpy record arrays, with normalized labels
+              as keys; the field names are the lower case column names
+    """
+
+    # labels which describe the data, which are written by write() itself
+    DATA_LABELS = {"XYDATA", "DATATABLE", "NTUPLES", "ENDNTUPLES", "PAGE", "END", "FIRSTX", "LASTX",
+                   "DELTAX", "XFACTOR", "YFACTOR", "FIRSTY", "NPOINTS", "MINY", "MAXY", "VARNAME",
+                   "SYMBOL", "VARTYPE", "VARFORM", "VARDIM", "UNITS", "FIRST", "LAST", "MIN", "MAX",
+                   "FACTOR"}
+
+    _COMMENT = re.compile(r"\$\$[^\n]*")
+    _XY_HEADER = re.compile(r"\(\s*(\w+)\s*\+\+\s*\(\s*(\w+)\s*\.\.\s*\w+\s*\)\s*\)")
+    _TUPLE_HEADER = re.compile(r"^\s*\(\s*(\w+)\s*\.\.\s*\w+\s*\)")
+    _ACD_HEADER = re.compile(r"^\s*ACDTABLE\s*\(([^)]*)\)", re.I)
+
+    def __init__(self):
+        self.labels = {}
+        self.x = None
+        self.data = {}
+        self.tables = {}
+        self._ldrs = []            # all records as (label as written, value), in order
+        self._table_headers = {}   # label and first line of the value of each table, for write()
+
+    @staticmethod
+    def normalize(label):
+        """
+        Returns the label in the form which is used as key, e.g. "DATA TYPE" -> "DATATYPE".
+        """
+        return re.sub(r"[\s\-/_]", "", label).upper()
+
+    @classmethod
+    def read(cls, filename):
+        """
+        Reads a JCAMP-DX file and returns a Jcamp object.
+        """
+        with open(filename, "r", encoding="latin-1") as jdx_file:
+            return cls.parse(jdx_file.read())
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parses the content of a JCAMP-DX file and returns a Jcamp object.
+        Only the first block of a multi-block file is read.
+        """
+        jcamp = cls()
+        ntuples = {}    # variables of an NTUPLES block, by symbol
+        # every labelled data record starts with "##" at the beginning of a line
+        for record in ("\n" + text).split("\n##")[1:]:
+            label, _, value = record.partition("=")
+            label = label.strip()
+            key = cls.normalize(label)
+            if "$$" in value:
+                value = cls._COMMENT.sub("", value)
+            value = value.strip()
+            jcamp._ldrs.append((label, value))
+            if key == "END":
+                break
+            if key not in jcamp.labels:
+                jcamp.labels[key] = value
+            if key in ("SYMBOL", "FACTOR", "FIRST", "LAST", "VARDIM"):
+                ntuples[key] = [item.strip() for item in value.split(",")]
+            elif key in ("XYDATA", "DATATABLE"):
+                jcamp._parse_xydata(value, ntuples)
+            elif cls._TUPLE_HEADER.match(value) or cls._ACD_HEADER.match(value):
+                jcamp._parse_table(label, key, value)
+        return jcamp
+
+    def _number(self, key, default=None):
+        value = self.labels.get(key)
+        if value is None or value == "":
+            return default
+        return float(value)
+
+    def _parse_xydata(self, value, ntuples):
+        header, _, body = value.partition("\n")
+        match = self._XY_HEADER.search(header)
+        if match is None:
+            logging.warning("Unsupported JCAMP data table: " + header)
+            return
+        x_symbol, y_symbol = match.group(1).upper(), match.group(2).upper()
+        if ntuples:
+            # NTUPLES: the parameters are lists, one entry per symbol
+            symbols = [symbol.upper() for symbol in ntuples.get("SYMBOL", [])]
+            def variable(key, symbol, default=None):
+                values = ntuples.get(key, [])
+                if symbol in symbols and symbols.index(symbol) < len(values) and values[symbols.index(symbol)] != "":
+                    return float(values[symbols.index(symbol)])
+                return default
+            yfactor = variable("FACTOR", y_symbol, 1.0)
+            npoints = variable("VARDIM", y_symbol)
+            firstx = variable("FIRST", x_symbol)
+            lastx = variable("LAST", x_symbol)
+        else:
+            yfactor = self._number("YFACTOR", 1.0)
+            npoints = self._number("NPOINTS")
+            firstx = self._number("FIRSTX")
+            lastx = self._number("LASTX")
+        y = decode_xydata(body) * yfactor
+        if npoints is not None and len(y) != int(npoints):
+            logging.warning("JCAMP data table " + y_symbol + " has " + str(len(y)) + " points instead of " + str(int(npoints)) + ".")
+        self.data[y_symbol] = y
+        if self.x is None and firstx is not None and lastx is not None:
+            self.x = np.linspace(firstx, lastx, len(y))
+
+    def _parse_table(self, label, key, value):
+        header, _, body = value.partition("\n")
+        acd = self._ACD_HEADER.match(header)
+        if acd is not None:
+            names = [name.strip().lower() for name in acd.group(1).split(",")]
+        else:
+            names = list(self._TUPLE_HEADER.match(header).group(1).lower())
+        self._table_headers[key] = label, header.strip()
+        self.tables[key] = decode_table(body, names)
+
+    @property
+    def y(self):
+        """
+        The first decoded data array, or None.
+        """
+        for y in self.data.values():
+            return y
+        return None
+
+    @property
+    def integrals(self):
+        """
+        The integrals exported by ACD (##$INTEGRALS) as record array, or None.
+        """
+        return self.tables.get("$INTEGRALS")
+
+    def match_integrals(self, begin, end, tolerance=1e-3):
+        """
+        Looks up the integrals of a list of intervals.
+
+        Arguments:
+        begin     -- sequence of the beginnings of the intervals (ppm), compared to X1
+        end       -- sequence of the ends of the intervals (ppm), compared to X2
+        tolerance -- maximum deviation of the borders (ppm)
+
+        Returns a numpy array with the integral of each interval, NaN where there is no
+        integral within the tolerance.
+        """
+        return match_intervals(self.integrals, begin, end, tolerance)
+
+    def write(self, filename, mode="DIFDUP", points_per_line=10):
+        """
+        Writes the document as a JCAMP-DX file: the descriptive records, the first data array
+        as ##XYDATA=(X++(Y..Y)), and the tables.
+
+        Arguments:
+        filename        -- name of the file
+        mode            -- "DIFDUP" for compressed ASDF data, or "AFFN" for plain numbers
+        points_per_line -- number of data points per line
+        """
+        with open(filename, "w", encoding="latin-1", newline="\r\n") as jdx_file:
+            jdx_file.write(self.to_string(mode, points_per_line))
+
+    def to_string(self, mode="DIFDUP", points_per_line=10):
+        """
+        Returns the document in JCAMP-DX format, see write().
+        """
+        lines = []
+        for label, value in self._ldrs:
+            key = self.normalize(label)
+            if key in self.DATA_LABELS or key in self.tables:
+                continue
+            lines.append("##" + label + "=" + value)
+        if not self._ldrs:
+            lines.append("##TITLE=")
+            lines.append("##JCAMP-DX=5.01")
+        y = self.y
+        if y is not None:
+            x = self.x if self.x is not None else np.arange(len(y), dtype=float)
+            lines.extend(encode_xydata(x, y, mode, points_per_line))
+        for key, table in self.tables.items():
+            symbols = "".join(table.dtype.names).upper()
+            label, header = self._table_headers.get(key, (key, "(" + symbols + ".." + symbols + ")"))
+            lines.append("##" + label + "=" + header)
+            for row in table:
+                lines.append("(" + ",".join(_format_number(value) for value in row) + ")")
+        lines.append("##END=")
+        return "\n".join(lines) + "\n"
+
+
+# lookup tables for the characters of data lines, indexed by byte value.
+# kinds: 0 separator, 1 digit, 2 SQZ, 3 DIF, 4 DUP, 5 sign, 6 decimal point, 7 unsupported
+_SEPARATOR, _DIGIT, _SQZ, _DIF, _DUP, _SIGN, _POINT, _UNSUPPORTED = range(8)
+_KIND = np.full(256, _UNSUPPORTED, dtype=np.int8)
+_MAGNITUDE = np.zeros(256, dtype=np.int64)
+_NEGATIVE = np.zeros(256, dtype=bool)
+for _char in " \t\r\n,;":
+    _KIND[ord(_char)] = _SEPARATOR
+for _digit, _char in enumerate("0123456789"):
+    _KIND[ord(_char)], _MAGNITUDE[ord(_char)] = _DIGIT, _digit
+for _kind, _positive, _negative in ((_SQZ, "@ABCDEFGHI", "@abcdefghi"), (_DIF, "%JKLMNOPQR", "%jklmnopqr")):
+    for _digit in range(10):
+        _KIND[ord(_positive[_digit])], _MAGNITUDE[ord(_positive[_digit])] = _kind, _digit
+        if _digit > 0:
+            _KIND[ord(_negative[_digit])], _MAGNITUDE[ord(_negative[_digit])] = _kind, _digit
+            _NEGATIVE[ord(_negative[_digit])] = True
+for _digit, _char in enumerate("STUVWXYZs"):
+    _KIND[ord(_char)], _MAGNITUDE[ord(_char)] = _DUP, _digit + 1
+_KIND[ord("+")] = _KIND[ord("-")] = _SIGN
+_NEGATIVE[ord("-")] = True
+_KIND[ord(".")] = _POINT
+_POWERS = 10.0 ** np.arange(20)
+
+_ASDF_CHARACTERS = re.compile(r"[@%A-DF-Za-df-z]")
+_PAC_SIGN = re.compile(r"(?<=[\d.])(?=[+-])")
+_ABSCISSA = re.compile(r"[ \t]*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]\d+)?")
+
+_SQZ_CHARACTERS = ("@ABCDEFGHI", "@abcdefghi")
+_DIF_CHARACTERS = ("%JKLMNOPQR", "%jklmnopqr")
+_DUP_CHARACTERS = "STUVWXYZs"
+
+
+def decode_xydata(body):
+    """
+    Decodes the lines of an (X++(Y..Y)) data table and returns the ordinates as numpy array.
+    The abscissa at the beginning of every line is skipped, and so are the ordinates which are
+    repeated at the beginning of a line as check value for the DIF form.
+    """
+    if _ASDF_CHARACTERS.search(body):
+        return decode_asdf(body)
+    return decode_affn(body)
+
+
+def _first_of_line(chars, starts):
+    """
+    Returns a boolean array which marks the tokens (given by the positions of their first
+    characters) which are the first of their line, and the line number of every token.
+    """
+    newlines = np.flatnonzero(chars == 10)
+    # number of tokens per line, the tokens are already sorted by position
+    counts = np.diff(np.searchsorted(starts, newlines), prepend=0, append=len(starts))
+    line = np.repeat(np.arange(len(counts)), counts)
+    return np.concatenate(([True], line[1:] != line[:-1])), line
+
+
+def decode_affn(body):
+    """
+    Decodes the lines of a data table in AFFN (or PAC) form. The numbers are converted by
+    numpy in one go, the abscissae are found by the position of the tokens.
+    """
+    body = body.replace("?", " nan ")
+    chars = np.frombuffer(body.encode("latin-1"), dtype=np.uint8)
+    kind = _KIND[chars]
+    previous = np.concatenate(([_SEPARATOR], kind[:-1]))
+    if ((kind == _SIGN) & ((previous == _DIGIT) | (previous == _POINT))).any():
+        # PAC: the sign also separates the numbers
+        body = _PAC_SIGN.sub(" ", body)
+        chars = np.frombuffer(body.encode("latin-1"), dtype=np.uint8)
+        kind = _KIND[chars]
+        previous = np.concatenate(([_SEPARATOR], kind[:-1]))
+    starts = np.flatnonzero((kind != _SEPARATOR) & (previous == _SEPARATOR))
+    values = np.array(body.replace(",", " ").replace(";", " ").split(), dtype=float)
+    if len(values) != len(starts):
+        raise ValueError("Malformed AFFN data")
+    abscissa, line = _first_of_line(chars, starts)
+    return values[~abscissa]
+
+
+def decode_asdf(body):
+    """
+    Decodes the lines of a data table in ASDF form (SQZ, DIF and DUP, mixed with AFFN
+    integers). All characters are classified at once using lookup tables, and the tokens are
+    converted together, so no python code runs per data point.
+
+    The abscissa at the beginning of every line is an AFFN number, which may have an exponent
+    (e.g. 1.5E+03, the sign is required to tell it from a SQZ "E"). It is removed before the
+    ordinates are decoded.
+    """
+    lines = body.split("\n")
+    for number, text in enumerate(lines):
+        if not text.strip():
+            continue
+        match = _ABSCISSA.match(text)
+        if match is None:
+            raise ValueError("ASDF data line does not start with an abscissa: " + repr(text))
+        lines[number] = text[match.end():]
+    body = "\n".join(lines)
+    chars = np.frombuffer(body.encode("latin-1"), dtype=np.uint8)
+    size = len(chars)
+    kind = np.take(_KIND, chars)
+    if (kind == _UNSUPPORTED).any():
+        position = int(np.flatnonzero(kind == _UNSUPPORTED)[0])
+        raise ValueError("Unsupported character in ASDF data: " + repr(body[position]))
+    # a token starts with a pseudo-digit or a sign, or with any other character after a separator
+    separator = kind == _SEPARATOR
+    start = (kind >= _SQZ) & (kind <= _SIGN)
+    start[0] = not separator[0]
+    start[1:] |= ~separator[1:] & separator[:-1]
+    starts = np.flatnonzero(start)
+    if len(starts) == 0:
+        return np.zeros(0)
+    # a token ends where the next one starts, or at a separator
+    boundaries = np.append(np.flatnonzero(start | separator), size)
+    ends = boundaries[np.flatnonzero(start[boundaries[:-1]]) + 1]
+    # only the abscissae, which were removed above, may be decimal numbers
+    if (kind == _POINT).any():
+        raise ValueError("Decimal number in ASDF data")
+    first, line = _first_of_line(chars, starts)
+    token_kind = np.take(kind, starts)
+
+    # every character of a token is one decimal digit, the pseudo-digit is the leading one
+    # (a sign counts as a leading zero)
+    length = ends - starts
+    magnitude = np.zeros(len(starts), dtype=np.int64)
+    for k in range(int(length.max())):
+        digit = np.take(_MAGNITUDE, np.take(chars, np.minimum(starts + k, size - 1)))
+        magnitude = np.where(k < length, magnitude * 10 + digit, magnitude)
+    value = np.where(np.take(_NEGATIVE, np.take(chars, starts)), -magnitude, magnitude)
+
+    # expand DUP: the token in front of it is repeated count times in total
+    dup = token_kind == _DUP
+    if dup[0]:
+        raise ValueError("ASDF data starts with a DUP character")
+    repeat = np.where(np.concatenate((dup[1:], [False])), np.concatenate((value[1:], [1])), 1)[~dup]
+    value = np.repeat(value[~dup], repeat)
+    dif = np.repeat(token_kind[~dup] == _DIF, repeat)
+    line = np.repeat(line[~dup], repeat)
+    if dif[0]:
+        raise ValueError("ASDF data starts with a DIF character")
+
+    # every DIF adds to the last absolute value
+    absolute = ~dif
+    group = np.cumsum(absolute) - 1
+    total = np.cumsum(np.where(dif, value, 0))
+    y = value[absolute][group] + total - total[absolute][group]
+
+    # drop the check values: the first ordinate of a line, if the previous line ended in DIF form
+    line_start = np.flatnonzero(np.concatenate(([False], line[1:] != line[:-1])))
+    check = line_start[dif[line_start - 1]]
+    mismatch = y[check] != y[check - 1]
+    if mismatch.any():
+        logging.warning("JCAMP Y check failed in " + str(int(mismatch.sum())) + " lines.")
+    return np.delete(y, check).astype(float)
+
+
+def decode_table(body, names):
+    """
+    Decodes a table of tuples like "(1.0,2.0,3.0)" or "1.0,2.0 3.0,4.0" into a record array
+    with the given field names.
+    """
+    text = body.translate(str.maketrans("();", "   ")).replace(",", " ").replace("?", " nan ")
+    values = np.array(text.split(), dtype=float)
+    if len(values) % len(names) != 0:
+        logging.warning("Incomplete JCAMP table, " + str(len(values) % len(names)) + " values are ignored.")
+        values = values[:len(values) - len(values) % len(names)]
+    return np.rec.fromarrays(values.reshape(-1, len(names)).T, names=names)
+
+
+def match_intervals(table, begin, end, tolerance=1e-3):
+    """
+    Looks up intervals in a table of integrals (record array with the fields x1, x2 and one
+    value field). The table is sorted by x1 once, the candidates for every interval are found
+    by binary search.
+
+    Returns a numpy array with the value of each interval, NaN where no row of the table
+    matches both borders within the tolerance. If several rows match, the closest is taken.
+    """
+    begin = np.asarray(begin, dtype=float)
+    end = np.asarray(end, dtype=float)
+    result = np.full(len(begin), np.nan)
+    if table is None or len(table) == 0:
+        return result
+    x1 = table.field(0)
+    x2 = table.field(1)
+    values = table.field(len(table.dtype.names) - 1)
+    order = np.argsort(x1, kind="stable")
+    sorted_x1 = x1[order]
+    lower = np.searchsorted(sorted_x1, begin - tolerance, side="left")
+    upper = np.searchsorted(sorted_x1, begin + tolerance, side="right")
+    for i in np.flatnonzero(upper > lower):
+        candidates = order[lower[i]:upper[i]]
+        deviation = np.abs(x1[candidates] - begin[i]) + np.abs(x2[candidates] - end[i])
+        deviation[np.abs(x2[candidates] - end[i]) > tolerance] = np.inf
+        best = np.argmin(deviation)
+        if np.isfinite(deviation[best]):
+            result[i] = values[candidates[best]]
+    return result
+
+
+def encode_xydata(x, y, mode="DIFDUP", points_per_line=10):
+    """
+    Returns the lines of an ##XYDATA=(X++(Y..Y)) record with its parameters, see Jcamp.write().
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if mode == "DIFDUP":
+        # DIFDUP encodes integers, scale the data to 9 significant digits unless it already is integral
+        peak = np.max(np.abs(y)) if len(y) else 0
+        if np.all(y == np.rint(y)) or peak == 0:
+            yfactor = 1.0
+        else:
+            yfactor = peak / 1e9
+        ints = np.rint(y / yfactor).astype(np.int64)
+    else:
+        yfactor = 1.0
+    lines = ["##FIRSTX=" + _format_number(x[0] if len(x) else 0),
+             "##LASTX=" + _format_number(x[-1] if len(x) else 0),
+             "##DELTAX=" + _format_number((x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 0),
+             "##XFACTOR=1",
+             "##YFACTOR=" + _format_number(yfactor),
+             "##FIRSTY=" + _format_number(y[0] if len(y) else 0),
+             "##NPOINTS=" + str(len(y)),
+             "##XYDATA=(X++(Y..Y))"]
+    if mode == "DIFDUP":
+        # every line ends in DIF form, so the next line starts with the last ordinate as check
+        if len(ints) == 1:
+            lines.append(_format_number(x[0]) + _encode_difdup(ints))
+        for start in range(0, len(ints) - 1, points_per_line):
+            stop = min(start + points_per_line, len(ints) - 1)
+            lines.append(_format_number(x[start]) + _encode_difdup(ints[start:stop + 1]))
+    else:
+        for start in range(0, len(y), points_per_line):
+            lines.append(_format_number(x[start]) + " " + " ".join(_format_number(value) for value in y[start:start + points_per_line]))
+    return lines
+
+
+def _encode_difdup(values):
+    tokens = [_pseudo_digits(int(values[0]), _SQZ_CHARACTERS)]
+    differences = np.diff(values)
+    if len(differences):
+        # runs of equal differences are written as one DIF and a DUP count
+        run_start = np.flatnonzero(np.concatenate(([True], differences[1:] != differences[:-1])))
+        run_length = np.diff(np.concatenate((run_start, [len(differences)])))
+        for difference, length in zip(differences[run_start], run_length):
+            tokens.append(_pseudo_digits(int(difference), _DIF_CHARACTERS))
+            if length > 1:
+                digits = str(int(length))
+                tokens.append(_DUP_CHARACTERS[int(digits[0]) - 1] + digits[1:])
+    return "".join(tokens)
+
+
+def _pseudo_digits(value, characters):
+    digits = str(abs(value))
+    return characters[0 if value >= 0 else 1][int(digits[0])] + digits[1:]
+
+
+def _format_number(value):
+    return np.format_float_positional(float(value), trim="-")
@@ -0,0 +1,261 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Histogram:
+    """
+    Thread-safe histogram with fixed buckets, in the style of the Prometheus client libraries.
+    """
+
+    def __init__(self, buckets):
+        """
+        Arguments:
+        buckets -- sorted upper bounds of the buckets; +Inf is added implicitly
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        Returns the cumulative counts as list of (upper bound, count), the sum and the count.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative, total, running
+
+
+class Metrics:
+    """
+    Serves metrics about the queue, the hardware and the database in the Prometheus text
+    format on http://localhost:<port>/metrics.
+
+    The metrics are collected when they are requested: the counters of the Queue, Autosampler,
+    Spinsolve, MySQLReader and EvaluationQueue are read (see their stats() methods), and the
+    number of samples and of evaluation jobs by status are counted with one query each. The
+    durations of the phases are taken from the spans of the Timeline. So nothing is done in
+    the queue or in the listeners of the hardware, apart from counting.
+
+    The server only listens on localhost. If the port is already in use, the metrics are
+    disabled and an error is logged.
+    """
+
+    PREFIX = "nmr_"
+    # upper bounds of the buckets of the phase durations in seconds, from the bookkeeping
+    # (milliseconds) to long acquisitions (half an hour and more)
+    PHASE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+    def __init__(self, queue, port=9105, host="127.0.0.1"):
+        """
+        Create a Metrics object and start its HTTP server.
+
+        Arguments:
+        queue -- the Queue object, which holds the Autosampler, Spinsolve, MySQLReader and
+                 EvaluationQueue
+        port  -- TCP port of the HTTP server
+        host  -- address on which the HTTP server listens
+        """
+        self.queue = queue
+        self.mysql_reader = queue.mysql_reader
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.phases = {}   # {phase: Histogram}, see observe_span
+        self.mysql_reader.timeline.add_listener(self.observe_span)
+
+        self.server = None
+        try:
+            self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        except OSError:
+            logging.error("Could not serve the metrics on port " + str(port) + ".")
+            logging.exception("")
+            return
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(), name="Metrics")
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info("Serving metrics on http://" + host + ":" + str(port) + "/metrics")
+
+    def handler_class(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                try:
+                    body = metrics.collect().encode()
+                except:
+                    logging.exception("")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Metrics request: " + format % args)
+
+        return Handler
+
+    def observe_span(self, span):
+        """
+        Listener of the Timeline, which adds the duration of a span to the histogram of its
+        phase.
+        """
+        histogram = self.phases.get(span["Phase"])
+        if histogram is None:
+            with self._lock:
+                histogram = self.phases.setdefault(span["Phase"], Histogram(self.PHASE_BUCKETS))
+        histogram.observe(max(span["End"] - span["Start"], 0))
+
+    def collect(self):
+        """
+        Returns all metrics in the Prometheus text format.
+        """
+        lines = []
+        now = time.time()
+        self.family(lines, "uptime_seconds", "gauge", "Time since the program was started.", [("", {}, now - self.started)])
+        self.collect_queue(lines)
+        self.collect_autosampler(lines, now)
+        self.collect_spinsolve(lines, now)
+        self.collect_database(lines)
+        self.collect_evaluation(lines)
+        return "\n".join(lines) + "\n"
+
+    def collect_queue(self, lines):
+        stats = self.queue.stats()
+        self.family(lines, "queue_state", "gauge", "State of the QueueEngine (1 for the current state).",
+                    [("", {"state": state}, int(stats["state"] == state)) for state in self.queue.engine.handlers])
+        self.family(lines, "queue_measurements_total", "counter", "Measurements by outcome since the start.",
+                    [("", {"outcome": outcome}, count) for outcome, count in sorted(stats["outcomes"].items())])
+        self.family(lines, "queue_pending_bookkeeping", "gauge", "Deferred database writes of the last sample.",
+                    [("", {}, stats["pending"])])
+        try:
+            depth = self.queue.samples.count_by_status()
+        except Exception:
+            depth = None
+        if depth is not None:
+            self.family(lines, "queue_samples", "gauge", "Samples in the samples table by status.",
+                        [("", {"status": status}, count) for status, count in sorted(depth.items())])
+        with self._lock:
+            phases = sorted(self.phases.items())
+        samples = []
+        for phase, histogram in phases:
+            buckets, total, count = histogram.snapshot()
+            for bound, cumulative in buckets:
+                samples.append(("_bucket", {"phase": phase, "le": self.number(bound)}, cumulative))
+            samples.append(("_sum", {"phase": phase}, total))
+            samples.append(("_count", {"phase": phase}, count))
+        self.family(lines, "phase_duration_seconds", "histogram",
+                    "Durations of the phases of the samples since the start, see Timeline.", samples)
+
+    def collect_autosampler(self, lines, now):
+        stats = self.queue.autosampler.stats()
+        self.family(lines, "autosampler_errorcode", "gauge", "Current status (error code) of the Autosampler.",
+                    [("", {}, stats["errorcode"])])
+        self.family(lines, "autosampler_connected", "gauge", "1 if the serial port is open.",
+                    [("", {}, int(stats["connected"]))])
+        if stats["last_contact"]:
+            self.family(lines, "autosampler_last_contact_age_seconds", "gauge", "Time since the last status of the Autosampler.",
+                        [("", {}, now - stats["last_contact"])])
+        self.family(lines, "autosampler_statuses_total", "counter", "Status frames received from the Autosampler.",
+                    [("", {}, stats["statuses"])])
+        self.family(lines, "autosampler_transitions_total", "counter", "Changes of the status of the Autosampler.",
+                    [("", {"from": str(old), "to": str(new)}, count) for (old, new), count in sorted(stats["transitions"].items())])
+
+    def collect_spinsolve(self, lines, now):
+        stats = self.queue.spinsolve.stats()
+        self.family(lines, "spinsolve_connected", "gauge", "1 if the remote control interface is connected.",
+                    [("", {}, int(stats["connected"]))])
+        if stats["last_status"]:
+            self.family(lines, "spinsolve_last_status_age_seconds", "gauge", "Time since the last message of the Spinsolve.",
+                        [("", {}, now - stats["last_status"])])
+        self.family(lines, "spinsolve_notifications_total", "counter", "Status notifications received from the Spinsolve.",
+                    [("", {}, stats["notifications"])])
+        self.family(lines, "spinsolve_notification_latency_seconds", "summary",
+                    "Time from sending a command until the first notification of the Spinsolve.",
+                    [("_sum", {}, stats["latency_sum"]), ("_count", {}, stats["latency_count"])])
+
+    def collect_database(self, lines):
+        pool = self.mysql_reader.pool_stats()
+        self.family(lines, "db_queries_total", "counter", "Statements run on the MySQL connections (use rate() for queries per second).",
+                    [("", {}, pool["queries"])])
+        self.family(lines, "db_connections", "gauge", "Open MySQL connections by state.",
+                    [("", {"state": "idle"}, pool["idle"]), ("", {"state": "in_use"}, pool["size"] - pool["idle"])])
+        self.family(lines, "db_checkouts_total", "counter", "Checkouts of connections from the pool by result.",
+                    [("", {"result": result}, pool[result]) for result in ("hits", "misses", "waits")])
+        self.family(lines, "db_reconnects_total", "counter", "MySQL connections which were replaced.",
+                    [("", {}, pool["reconnects"])])
+        writer = self.mysql_reader.writer.stats()
+        self.family(lines, "db_writer_pending", "gauge", "Updates waiting in the DbWriter.", [("", {}, writer["pending"])])
+        self.family(lines, "db_writer_updates_total", "counter", "Updates handed to the DbWriter by result.",
+                    [("", {"result": result}, writer[result]) for result in ("submitted", "coalesced", "written")])
+        self.family(lines, "db_writer_failures_total", "counter", "Batches of the DbWriter which failed.",
+                    [("", {}, writer["failures"])])
+        self.family(lines, "db_writer_dropped_total", "counter", "Updates which the DbWriter could not write and dropped.",
+                    [("", {}, writer["dropped"])])
+
+    def collect_evaluation(self, lines):
+        evaluation_queue = self.queue.evaluation_queue
+        try:
+            jobs = evaluation_queue.count_by_status()
+        except Exception:
+            jobs = None
+        if jobs is not None:
+            self.family(lines, "evaluation_jobs", "gauge", "Jobs in the evaluation_jobs table by status (Queued is the ACD backlog).",
+                        [("", {"status": status}, count) for status, count in sorted(jobs.items())])
+        self.family(lines, "evaluation_workers", "gauge", "Worker threads of the EvaluationQueue.",
+                    [("", {}, len(evaluation_queue.workers))])
+        cache = evaluation_queue.cache.stats()
+        self.family(lines, "evaluation_cache_lookups_total", "counter", "Lookups in the EvaluationCache by result.",
+                    [("", {"result": "hit"}, cache["hits"]), ("", {"result": "miss"}, cache["misses"])])
+        self.family(lines, "evaluation_cache_bytes", "gauge", "Size of the EvaluationCache.", [("", {}, cache["size"])])
+
+    def family(self, lines, name, kind, help_text, samples):
+        """
+        Appends a metric family in the text format to lines.
+
+        Arguments:
+        name      -- name of the metric, without the prefix
+        kind      -- counter, gauge, histogram or summary
+        help_text -- description of the metric
+        samples   -- list of (suffix, labels as dictionary, value)
+        """
+        name = self.PREFIX + name
+        lines.append("# HELP " + name + " " + help_text)
+        lines.append("# TYPE " + name + " " + kind)
+        for suffix, labels, value in samples:
+            label_text = ""
+            if labels:
+                label_text = "{" + ",".join(key + '="' + self.escape(str(label)) + '"' for key, label in labels.items()) + "}"
+            lines.append(name + suffix + label_text + " " + self.number(value))
+
+    @staticmethod
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    @staticmethod
+    def number(value):
+        if value == float("inf"):
+            return "+Inf"
+        if isinstance(value, float):
+            return repr(value)
+        return str(value)
@@ -0,0 +1,132 @@
+import time
+import logging
+import MySQLdb
+
+# error codes of MySQL which are handled by the migrations
+ER_DUP_KEYNAME = 1061
+ER_BLOB_KEY_WITHOUT_LENGTH = 1170
+
+
+def create_evaluation_jobs(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS evaluation_jobs ("
+                "ID INT NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+                "SampleName VARCHAR(255) NOT NULL, "
+                "Method INT NULL, "
+                "Status VARCHAR(16) NOT NULL DEFAULT 'Queued', "
+                "Attempts INT NOT NULL DEFAULT 0, "
+                "NextAttempt INT NOT NULL DEFAULT 0, "
+                "Created INT NOT NULL, "
+                "Updated INT NOT NULL, "
+                "Error TEXT NULL, "
+                "INDEX (Status, NextAttempt, ID))")
+
+
+def index_samples_status(cur):
+    # Queued samples ordered by StartDate and ID (QueueEngine), the Running sample (progress)
+    add_index(cur, "samples", "idx_samples_status", "Status, StartDate, ID")
+
+
+def index_samples_name(cur):
+    # write_result(s) look up the samples by Name
+    try:
+        add_index(cur, "samples", "idx_samples_name", "Name")
+    except MySQLdb.Error as e:
+        if e.args[0] != ER_BLOB_KEY_WITHOUT_LENGTH:
+            raise
+        # Name is a TEXT column, which can only be indexed by a prefix
+        add_index(cur, "samples", "idx_samples_name", "Name(255)")
+
+
+def index_sample_properties(cur):
+    # read_sample_properties looks up the properties of one sample
+    add_index(cur, "sample_properties", "idx_sample_properties_sampleid", "sampleid")
+
+
+def create_sample_timings(cur):
+    # spans of the phases of every sample, see Timeline
+    cur.execute("CREATE TABLE IF NOT EXISTS sample_timings ("
+                "ID INT NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+                "SampleID INT NULL, "
+                "SampleName VARCHAR(255) NOT NULL, "
+                "Phase VARCHAR(32) NOT NULL, "
+                "Detail VARCHAR(255) NULL, "
+                "Start DOUBLE NOT NULL, "
+                "End DOUBLE NOT NULL, "
+                "INDEX (Start), "
+                "INDEX (SampleID))")
+
+
+def add_index(cur, table, name, columns):
+    """
+    Creates an index, unless an index of this name exists already.
+    """
+    try:
+        cur.execute("CREATE INDEX " + name + " ON " + table + " (" + columns + ")")
+    except MySQLdb.Error as e:
+        if e.args[0] != ER_DUP_KEYNAME:
+            raise
+
+
+class Migrations:
+    """
+    Brings the schema of the database up to date.
+
+    The tables of the webinterface are created by its setup, but the tables and indexes which
+    only this program needs are added here. Every migration has a version number and is applied
+    once, in the order of the versions; the applied versions are stored in the
+    schema_migrations table. New migrations are appended to MIGRATIONS, existing ones must
+    never be changed.
+    """
+
+    MIGRATIONS = [
+        (1, "Create the evaluation_jobs table", create_evaluation_jobs),
+        (2, "Index samples by Status, StartDate and ID", index_samples_status),
+        (3, "Index samples by Name", index_samples_name),
+        (4, "Index sample_properties by sampleid", index_sample_properties),
+        (5, "Create the sample_timings table", create_sample_timings),
+    ]
+
+    CREATE_TABLE = ("CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "Version INT NOT NULL PRIMARY KEY, "
+                    "Description VARCHAR(255) NOT NULL, "
+                    "Applied INT NOT NULL)")
+
+    def __init__(self, mysql_reader):
+        """
+        Arguments:
+        mysql_reader -- a MySQLReader object
+        """
+        self.mysql_reader = mysql_reader
+
+    def applied(self, cur):
+        """
+        Returns the set of the versions which were already applied.
+        """
+        cur.execute(self.CREATE_TABLE)
+        cur.execute("SELECT Version FROM schema_migrations")
+        return set(row["Version"] for row in cur.fetchall())
+
+    def migrate(self):
+        """
+        Applies all migrations which were not yet applied.
+        Returns the list of the versions which were applied now, or None if the database is
+        not available.
+        """
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            return None
+        done = []
+        try:
+            applied = self.applied(cur)
+            for version, description, migration in self.MIGRATIONS:
+                if version in applied:
+                    continue
+                logging.info("Migrating the database to version " + str(version) + ": " + description + ".")
+                migration(cur)
+                # INSERT IGNORE, in case another instance of the program was faster
+                cur.execute("INSERT IGNORE INTO schema_migrations (Version, Description, Applied) VALUES (%s, %s, %s)",
+                            (version, description, int(time.time())))
+                done.append(version)
+        finally:
+            conn.close()
+        return done
@@ -1,7 +1,417 @@
 import MySQLdb    # using a python3-compatible fork called mysqlclient, see https://www.lfd.uci.edu/~gohlke/pythonlibs/
 import MySQLdb.cursors
+import contextlib
 import logging
 import subprocess
+import threading
+import time
+from collections import namedtuple
+from ConfigService import ConfigService
+from DbWriter import DbWriter
+from ProcessProbe import ProcessProbe
+from Timeline import Timeline
+from Repositories import SampleRepository
+
+class ConnectionPool:
+    """
+    A thread-safe pool of MySQL connections.
+    
+    Connections are checked out per thread: repeated calls to checkout() from the same thread
+    return the same connection until every checkout has been released again, so that nested
+    helpers (e.g. read_protocol called with a connection the queue daemon already holds) never
+    need a second connection. Released connections are kept open for the next caller instead
+    of being closed.
+    
+    Idle connections which have not been used for health_check_interval seconds are pinged
+    before they are handed out, and replaced if the server has gone away in the meantime.
+    """
+    
+    def __init__(self, connect_kwargs, max_size=10, wait_timeout=10, health_check_interval=30):
+        """
+        Arguments:
+        connect_kwargs        -- keyword arguments for MySQLdb.connect
+        max_size              -- maximum number of connections which may be open at the same time
+        wait_timeout          -- time in seconds a thread waits for a free connection when the 
+                                 pool is exhausted
+        health_check_interval -- idle time in seconds after which a connection is pinged before
+                                 it is reused
+        """
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+        
+        self._lock = threading.Condition()
+        self._idle = []       # list of [connection, time of release], most recently used last
+        self._size = 0        # number of open connections (idle and checked out)
+        self._local = threading.local()
+        
+        # counters, see stats()
+        self.hits = 0         # checkouts served by an idle connection
+        self.misses = 0       # checkouts which had to open a new connection
+        self.waits = 0        # checkouts which had to wait for a connection to be released
+        self.reconnects = 0   # connections replaced after a failed health check or query
+        self.queries = 0      # statements run on the connections of the pool
+    
+    def stats(self):
+        """
+        Returns the pool counters as a dictionary.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "waits": self.waits,
+                    "reconnects": self.reconnects, "queries": self.queries,
+                    "size": self._size, "idle": len(self._idle)}
+    
+    def count_query(self):
+        """
+        Counts a statement. Called by PooledCursor for every query.
+        """
+        with self._lock:
+            self.queries += 1
+    
+    def checkout(self):
+        """
+        Returns a PooledConnection for the calling thread, or None if no connection to the MySQL
+        server could be established.
+        The connection must be handed back using its close() method.
+        """
+        lease = getattr(self._local, "lease", None)
+        if lease is not None:
+            lease.refcount += 1
+            with self._lock:
+                self.hits += 1
+            return lease
+        raw = self._acquire()
+        if raw is None:
+            return None
+        lease = PooledConnection(self, raw)
+        self._local.lease = lease
+        return lease
+    
+    def release(self, lease):
+        """
+        Hands a connection back to the pool. Called by PooledConnection.close().
+        """
+        if lease.refcount <= 0:
+            return
+        lease.refcount -= 1
+        if lease.refcount > 0:
+            return
+        if getattr(self._local, "lease", None) is lease:
+            self._local.lease = None
+        with self._lock:
+            if lease.raw is None:
+                # the connection could not be re-established, free its slot
+                self._size -= 1
+            else:
+                self._idle.append([lease.raw, time.monotonic()])
+                lease.raw = None
+            self._lock.notify()
+    
+    def reconnect(self, lease):
+        """
+        Replaces the broken connection of a lease with a fresh one. The lease keeps its slot in
+        the pool, even if no new connection could be opened.
+        Returns True if successful.
+        """
+        self._close_quietly(lease.raw)
+        lease.raw = self._open()
+        lease.generation += 1
+        with self._lock:
+            self.reconnects += 1
+        return lease.raw is not None
+    
+    def _acquire(self):
+        deadline = time.monotonic() + self.wait_timeout
+        with self._lock:
+            waited = False
+            while True:
+                if self._idle:
+                    raw, released = self._idle.pop()
+                    self.hits += 1
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    self.misses += 1
+                    raw = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.error("No MySQL connection became available within " + str(self.wait_timeout) + " seconds!")
+                    return None
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                self._lock.wait(remaining)
+        if raw is not None:
+            # health check for connections which have been lying around for a while
+            if time.monotonic() - released < self.health_check_interval:
+                return raw
+            try:
+                raw.ping()
+                return raw
+            except MySQLdb.Error:
+                self._close_quietly(raw)
+                with self._lock:
+                    self.reconnects += 1
+        raw = self._open()
+        if raw is None:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+        return raw
+    
+    def _open(self):
+        try:
+            raw = MySQLdb.connect(**self.connect_kwargs)
+        except MySQLdb.OperationalError:
+            logging.error("Connection to the MySQL DB has failed!")
+            return None
+        raw.autocommit(True)
+        return raw
+    
+    @staticmethod
+    def _close_quietly(raw):
+        if raw is None:
+            return
+        try:
+            raw.close()
+        except MySQLdb.Error:
+            pass
+
+
+class PooledConnection:
+    """
+    A connection checked out from a ConnectionPool.
+    Behaves like a MySQLdb connection, except that close() hands the connection back to the
+    pool instead of closing it.
+    """
+    
+    def __init__(self, pool, raw):
+        self.pool = pool
+        self.raw = raw
+        self.refcount = 1
+        self.generation = 0   # incremented whenever the underlying connection is replaced
+        self.in_transaction = False   # see MySQLReader.transaction
+    
+    def cursor(self, cursorclass=None):
+        return PooledCursor(self, cursorclass)
+    
+    def close(self):
+        self.pool.release(self)
+    
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class PooledCursor:
+    """
+    A cursor on a PooledConnection. If the MySQL server has gone away since the last query,
+    the connection is re-established and the query is repeated once. Not inside a transaction
+    though: the statements before would have been rolled back with the old connection.
+    
+    A query is only repeated if it cannot have reached the server (CR_SERVER_GONE_ERROR), or
+    if it only reads (SELECT). A connection lost while a write was running may have applied
+    the write, so the error is raised instead of running the write twice.
+    A cursor must not be used after its connection was handed back to the pool.
+    """
+    
+    # CR_SERVER_GONE_ERROR: the query was not sent
+    RECONNECT_ERRORS = (2006,)
+    # CR_SERVER_LOST: the connection was lost during the query
+    READ_RECONNECT_ERRORS = (2006, 2013)
+    
+    def __init__(self, lease, cursorclass=None):
+        self.lease = lease
+        self.cursorclass = cursorclass    # None for the cursorclass of the connection
+        self._cursor = None
+        self._generation = -1
+    
+    def _raw_cursor(self):
+        if self.lease.refcount <= 0:
+            raise MySQLdb.ProgrammingError("The cursor was used after its connection was closed.")
+        if self.lease.raw is None and not self.lease.pool.reconnect(self.lease):
+            raise MySQLdb.OperationalError(2006, "MySQL server is not available")
+        if self._cursor is None or self._generation != self.lease.generation:
+            self._cursor = self.lease.raw.cursor(self.cursorclass)
+            self._generation = self.lease.generation
+        return self._cursor
+    
+    def _run(self, method, query, args):
+        self.lease.pool.count_query()
+        try:
+            return getattr(self._raw_cursor(), method)(query, args)
+        except MySQLdb.OperationalError as e:
+            retry_errors = self.READ_RECONNECT_ERRORS if self.is_read(query) else self.RECONNECT_ERRORS
+            if e.args[0] not in retry_errors or self.lease.in_transaction:
+                raise
+            logging.warning("Lost connection to the MySQL DB, reconnecting.")
+            if not self.lease.pool.reconnect(self.lease):
+                raise
+            return getattr(self._raw_cursor(), method)(query, args)
+    
+    @staticmethod
+    def is_read(query):
+        """
+        Returns True if the statement only reads, and may therefore be repeated.
+        """
+        return query.lstrip()[:6].upper() == "SELECT"
+    
+    def execute(self, query, args=None):
+        return self._run("execute", query, args)
+    
+    def executemany(self, query, args):
+        return self._run("executemany", query, args)
+    
+    def __getattr__(self, name):
+        return getattr(self._raw_cursor(), name)
+
+
+class SampleRow(namedtuple("SampleRow", ("ID", "Name", "Holder", "Status", "StartDate", "SampleType",
+                                          "Protocol", "Solvent", "Method", "Priority"))):
+    """
+    A row of the samples table with only the columns which the queue needs.
+    Can be used like the dictionaries of the DictCursor (row["Name"], row.get("Priority")), but
+    is a tuple, which is much cheaper to create.
+    """
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+class ReferenceCache:
+    """
+    In-memory copy of the reference tables, which are edited rarely (through the web
+    interface) but read for every sample: methods (joined with nuclei), peaks, protocols,
+    protocol_properties and fnmr_standards.
+
+    The tables are loaded all at once and kept as dictionaries indexed by the columns they are
+    looked up by, e.g. the peaks grouped by method and role. Before the cached data is used,
+    the checksums of the tables are compared with those of the loaded data (CHECKSUM TABLE,
+    at most once every probe_interval seconds), and the tables are loaded again if any of
+    them was changed.
+
+    The DB is not accessed while the lock is held: while one thread probes or loads the
+    tables, the other threads keep using the cached data, and only wait if there is none yet.
+    """
+
+    TABLES = ("methods", "nuclei", "peaks", "protocols", "protocol_properties", "fnmr_standards")
+
+    def __init__(self, mysql_reader, probe_interval=5):
+        """
+        Arguments:
+        mysql_reader   -- the MySQLReader object
+        probe_interval -- time in seconds during which the cached data is used without
+                          checking the checksums of the tables again
+        """
+        self.mysql_reader = mysql_reader
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        # held by the thread which probes or loads the tables, so that only one does at a time
+        self._load_lock = threading.Lock()
+        self._version = None    # checksums of the tables from which _data was loaded
+        self._data = None
+        self._probed = 0        # time of the last checksum probe
+        self._generation = 0    # incremented by invalidate()
+        # counters
+        self.loads = 0
+        self.probes = 0
+
+    def invalidate(self):
+        """
+        Forces a reload of the tables on the next access.
+        """
+        with self._lock:
+            self._version = None
+            self._data = None
+            self._generation += 1
+
+    def data(self):
+        """
+        Returns the cached tables as a dictionary, loading them first if necessary, or None if
+        they could not be read from the DB.
+        The returned rows are shared and must not be modified.
+        """
+        with self._lock:
+            if self._data is not None and time.monotonic() - self._probed < self.probe_interval:
+                return self._data
+            data = self._data
+        # another thread is probing the tables: use the cached data meanwhile, if there is any
+        if not self._load_lock.acquire(blocking=data is None):
+            return data
+        try:
+            with self._lock:
+                now = time.monotonic()
+                if self._data is not None and now - self._probed < self.probe_interval:
+                    # probed by the other thread in the meantime
+                    return self._data
+                data = self._data
+                version = self._version
+                generation = self._generation
+            conn, cur = self.mysql_reader.connect_db()
+            if conn is None:
+                # the old data is better than nothing
+                return data
+            try:
+                checksums = self._checksums(cur)
+                loaded = data is None or checksums != version
+                if loaded:
+                    data = self._load(cur)
+            except MySQLdb.Error:
+                logging.exception("")
+                return data
+            finally:
+                conn.close()
+            with self._lock:
+                self.probes += 1
+                if loaded:
+                    self.loads += 1
+                self._data = data
+                if self._generation == generation:
+                    self._version = checksums
+                    self._probed = now
+                else:
+                    # invalidated during the probe: the tables may have been changed after the
+                    # checksums were taken, so they are loaded again on the next access
+                    self._version = None
+                    self._probed = 0
+                return data
+        finally:
+            self._load_lock.release()
+
+    def _checksums(self, cur):
+        cur.execute("CHECKSUM TABLE " + ", ".join(self.TABLES))
+        return tuple((row["Table"], row["Checksum"]) for row in cur.fetchall())
+
+    def _load(self, cur):
+        cur.execute("SELECT * FROM methods INNER JOIN nuclei ON methods.Nucleus=nuclei.Mass")
+        methods = {method["ID"]: method for method in cur.fetchall()}
+        cur.execute("SELECT * FROM peaks ORDER BY ID")
+        peaks = {}
+        for peak in cur.fetchall():
+            peaks.setdefault((peak["method"], peak["role"]), []).append(peak)
+        cur.execute("SELECT * FROM protocols")
+        protocols = {protocol["protocolid"]: protocol for protocol in cur.fetchall()}
+        cur.execute("SELECT * FROM protocol_properties")
+        protocol_properties = {prop["propid"]: prop for prop in cur.fetchall()}
+        cur.execute("SELECT * from fnmr_standards")
+        fnmr_standards = list(cur.fetchall())
+        return {"methods": methods, "peaks": peaks, "protocols": protocols,
+                "protocol_properties": protocol_properties, "fnmr_standards": fnmr_standards}
+
+    def stats(self):
+        """
+        Returns the counters of the cache as a dictionary (loads, probes).
+        """
+        with self._lock:
+            return {"loads": self.loads, "probes": self.probes}
+
 
 class MySQLReader:
     """
@@ -14,8 +424,23 @@ class MySQLReader:
         self.mysql_pass = mysql_passwd
         self.mysql_host = mysql_host
         self.mysql_db   = mysql_db
+        # connections are reused across calls, see ConnectionPool
+        self.pool = ConnectionPool({"user": mysql_user, "passwd": mysql_passwd, "host": mysql_host,
+                                    "db": mysql_db, "cursorclass": MySQLdb.cursors.DictCursor})
         # xampp location in case a restart of apache or mysql is necessary
         self.xampp_location = xampp_location
+        # writes progress and status updates in the background, see DbWriter
+        self.writer = DbWriter(self)
+        # columns of the samples table, see read_samples_by_status
+        self._sample_projection = None
+        # checks whether apache and mysql are running
+        self.process_probe = ProcessProbe()
+        # methods, peaks, protocols etc., see ReferenceCache
+        self.reference = ReferenceCache(self)
+        # snapshot of the config table, see ConfigService
+        self.config_service = ConfigService(self)
+        # timings of the phases of every sample, see Timeline
+        self.timeline = Timeline(self)
     
     def open_xampp_control(self):
         xampp_location = self.xampp_location
@@ -43,64 +468,120 @@ class MySQLReader:
             subprocess.Popen([xampp_location + scriptname], shell=True)
     
     def is_apache_running(self):
-        return self.process_exists("httpd.exe")
+        """
+        Returns True if the apache process is running, or if a webserver answers on port 80.
+        """
+        return self.process_exists("httpd.exe") or self.process_probe.port_open("localhost", 80)
         
     def is_mysqld_running(self):
-        return self.process_exists("mysqld.exe")
+        """
+        Returns True if the mysql process is running, or if the MySQL server answers on its port.
+        """
+        return self.process_exists("mysqld.exe") or self.process_probe.port_open(self.mysql_host, 3306)
         
     def process_exists(self, process_name):
         """
-        https://stackoverflow.com/questions/7787120/python-check-if-a-process-is-running-or-not
+        Returns True if a process with this name is running, see ProcessProbe.
         """
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        call = 'TASKLIST', '/FI', 'imagename eq %s' % process_name
-        # use buildin check_output right away
-        output = subprocess.check_output(call, startupinfo=startupinfo).decode()
-        # check in last line for process name
-        last_line = output.strip().split('\r\n')[-1]
-        # because Fail message could be translated
-        return last_line.lower().startswith(process_name.lower())
+        return self.process_probe.process_exists(process_name)
     
     def connect_db(self):
         """
+        Checks out a connection from the pool for the calling thread.
         For reasons unknown, only one cursor per connection works properly
-        Please after using the DB, close the connection with conn.close
+        Please after using the DB, close the connection with conn.close, which hands it back to
+        the pool.
         """
-        try:
-            conn = MySQLdb.connect(user=self.mysql_user, passwd=self.mysql_pass, host=self.mysql_host, db=self.mysql_db, cursorclass=MySQLdb.cursors.DictCursor)
-        except MySQLdb._exceptions.OperationalError:
-            logging.error("Connection to the MySQL DB has failed!")
+        conn = self.pool.checkout()
+        if conn is None:
             return None, None
-        conn.autocommit(True)
         cur = conn.cursor()
         return conn, cur
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Runs the statements of a with block in one transaction, on one connection:
         
-    def read_config(self):
+            with mysql_reader.transaction() as cur:
+                cur.execute(...)
+        
+        The transaction is committed at the end of the block, and rolled back if an exception
+        is raised. A transaction inside a transaction of the same thread joins the outer one.
+        Raises ConnectionError if no connection could be established.
+        """
         conn, cur = self.connect_db()
-        if conn is None:
-            return None
-        cur.execute("SELECT * from config")
-        config = cur.fetchall()
-        conn.close()
-        return config[0]
+        if conn is None or cur is None:
+            raise ConnectionError("No connection to the MySQL DB.")
+        if conn.in_transaction:
+            try:
+                yield cur
+            finally:
+                conn.close()
+            return
+        conn.in_transaction = True
+        try:
+            cur.execute("START TRANSACTION")
+            yield cur
+            cur.execute("COMMIT")
+        except:
+            try:
+                cur.execute("ROLLBACK")
+            except MySQLdb.Error:
+                pass
+            raise
+        finally:
+            conn.in_transaction = False
+            conn.close()
+    
+    def pool_stats(self):
+        """
+        Returns the counters of the connection pool (hits, misses, waits, reconnects, queries, size,
+        idle).
+        """
+        return self.pool.stats()
+        
+    def read_config(self):
+        """
+        Returns the config as dictionary, or None. Served from the snapshot of the 
+        ConfigService, which is at most a few seconds old.
+        """
+        return self.config_service.snapshot()
         
     def read_fnmr_standards(self):
         """
         Format: Dict of lists, lists contain element 0: chemical shift (delta), and element 1: number of 
                     F atoms in the standard.
         """
-        conn, cur = self.connect_db()
-        if conn is None:
+        reference = self.reference.data()
+        if reference is None:
             return None
-        cur.execute("SELECT * from fnmr_standards")
-        fnmr_standards = cur.fetchall()
-        conn.close()
         standard_shift = {}
-        for fnmr_standard in fnmr_standards:
+        for fnmr_standard in reference["fnmr_standards"]:
             standard_shift[fnmr_standard['name']] = [str(fnmr_standard['shift']), fnmr_standard['fluorine_atoms']]
         return standard_shift
         
+    def read_method(self, method_id):
+        """
+        Returns the method (joined with its nucleus) as dictionary, or None if it does not exist.
+        Served from the ReferenceCache, the row must not be modified.
+        """
+        reference = self.reference.data()
+        if reference is None:
+            return None
+        return reference["methods"].get(method_id)
+        
+    def read_peaks(self, method_id, role):
+        """
+        Returns the list of peaks of a method with the given role (0 = standard, 
+        1 = starting material, 2 = product), ordered by ID.
+        Served from the ReferenceCache, the rows must not be modified.
+        """
+        reference = self.reference.data()
+        if reference is None:
+            return []
+        return list(reference["peaks"].get((method_id, role), ()))
+        
     def read_samples(self, conn=None, cur=None):
         """
         Reads samples table.
@@ -119,6 +600,36 @@ class MySQLReader:
             conn.close()
         return samples
         
+    def read_samples_by_status(self, status, order_by=("StartDate", "ID"), limit=None, conn=None, cur=None):
+        """
+        Reads the samples with the given status as a list of SampleRow, by default ordered by
+        StartDate and ID (samples without StartDate first).
+        Only the columns of SampleRow are read, and the query uses the index on 
+        (Status, StartDate, ID), see Migrations. Columns which do not exist in the samples 
+        table (e.g. the optional Priority) are None.
+        Optional args: conn and cur from MySQLdb. Can be supplied for performance reasons.
+        """
+        new_conn = False
+        if conn is None or cur is None:
+            conn, cur = self.connect_db()
+            if conn is None:
+                return None
+            new_conn = True
+        try:
+            if self._sample_projection is None:
+                cur.execute("SHOW COLUMNS FROM samples")
+                columns = set(row["Field"] for row in cur.fetchall())
+                self._sample_projection = ", ".join(field if field in columns else "NULL AS " + field for field in SampleRow._fields)
+            query = "SELECT " + self._sample_projection + " FROM samples WHERE Status = %s ORDER BY " + ", ".join(column + " ASC" for column in order_by)
+            if limit is not None:
+                query += " LIMIT " + str(int(limit))
+            tuple_cur = conn.cursor(MySQLdb.cursors.Cursor)
+            tuple_cur.execute(query, (status,))
+            return [SampleRow._make(row) for row in tuple_cur.fetchall()]
+        finally:
+            if new_conn:
+                conn.close()
+        
     def read_shimming(self, conn=None, cur=None):
         """
         Reads shimming table.
@@ -169,42 +680,58 @@ class MySQLReader:
         return queueabort
 
     def read_sample_properties(self, sampleid, conn=None, cur=None):
+        reference = self.reference.data()
+        if reference is None:
+            return None
         new_conn = False
         if conn is None or cur is None:
             conn, cur = self.connect_db()
             if conn is None:
                 return None
             new_conn = True
-        cur.execute("SELECT sample_properties.samplepropid, sample_properties.propid, protocol_properties.friendlyName,"
-                    "protocol_properties.xmlKey, sample_properties.strvalue FROM sample_properties INNER JOIN "
-                    "protocol_properties ON sample_properties.propid=protocol_properties.propid WHERE "
-                    "sample_properties.sampleid = %s",
-                    (sampleid,))
-        props = cur.fetchall()
+        cur.execute("SELECT samplepropid, propid, strvalue FROM sample_properties WHERE sampleid = %s", (sampleid,))
+        rows = cur.fetchall()
         if new_conn:
             conn.close()
+        # the names of the properties are joined from the cached protocol_properties
+        protocol_properties = reference["protocol_properties"]
+        if any(row["propid"] not in protocol_properties for row in rows):
+            # the property may have been added since the last probe of the cache
+            self.reference.invalidate()
+            reference = self.reference.data() or reference
+            protocol_properties = reference["protocol_properties"]
+        props = []
+        for row in rows:
+            prop = protocol_properties.get(row["propid"])
+            if prop is None:
+                logging.warning("Unknown property " + str(row["propid"]) + " of sample " + str(sampleid) + " is left out of the measurement options.")
+                continue
+            props.append({"samplepropid": row["samplepropid"], "propid": row["propid"], "friendlyName": prop["friendlyName"],
+                          "xmlKey": prop["xmlKey"], "strvalue": row["strvalue"]})
         return props
 
     def read_protocol(self, protocolid, conn=None, cur=None):
-        new_conn = False
-        if conn is None or cur is None:
-            conn, cur = self.connect_db()
-            if conn is None:
-                return None
-            new_conn = True
-        cur.execute("SELECT * FROM protocols WHERE protocolid = %s", (protocolid,))
-        protocol = cur.fetchone()
-        if new_conn:
-            conn.close()
-        return protocol
+        """
+        Returns the protocol as dictionary, or None. Served from the ReferenceCache, the 
+        arguments conn and cur are only kept for compatibility.
+        """
+        reference = self.reference.data()
+        if reference is None:
+            return None
+        return reference["protocols"].get(protocolid)
         
     def write_result(self, sample_name, result):
-        conn, cur = self.connect_db()
-        if conn is None:
-            return None
-        cur.execute("SELECT ID FROM samples WHERE Name = %s LIMIT 1", (sample_name,))
-        sample = cur.fetchall()
-        sample = sample[0]
-        cur.execute("UPDATE samples SET result = %s WHERE ID = %s", (result, sample["ID"]))
-        conn.close()
-        return True
+        """
+        Writes the result of the evaluation of a sample. Nothing is written if there is no
+        sample with this name.
+        """
+        SampleRepository(self).set_result(sample_name, result)
+    
+    def write_results(self, results):
+        """
+        Writes the results of many samples at once, in one transaction.
+        
+        Arguments:
+        results -- list of (sample_name, result) tuples
+        """
+        SampleRepository(self).set_results(results)
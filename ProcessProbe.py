@@ -0,0 +1,132 @@
+import ctypes
+import os
+import socket
+import sys
+import threading
+import time
+import logging
+
+class ProcessEntry(ctypes.Structure):
+    """
+    PROCESSENTRY32W of the Windows Tool Help API.
+    """
+    _fields_ = [("dwSize", ctypes.c_uint32),
+                ("cntUsage", ctypes.c_uint32),
+                ("th32ProcessID", ctypes.c_uint32),
+                ("th32DefaultHeapID", ctypes.c_void_p),
+                ("th32ModuleID", ctypes.c_uint32),
+                ("cntThreads", ctypes.c_uint32),
+                ("th32ParentProcessID", ctypes.c_uint32),
+                ("pcPriClassBase", ctypes.c_long),
+                ("dwFlags", ctypes.c_uint32),
+                ("szExeFile", ctypes.c_wchar * 260)]
+
+
+class ProcessProbe:
+    """
+    Checks whether processes are running, without starting a subprocess (like TASKLIST).
+
+    The names of all running processes are read natively, from /proc on Linux and with the
+    Tool Help API (CreateToolhelp32Snapshot) on Windows. The list is cached for ttl seconds,
+    so that checking several processes at once costs only one enumeration.
+
+    In addition, port_open() checks whether a server accepts TCP connections on a port. This
+    also works for servers which run under a different process name or on another host.
+    """
+
+    def __init__(self, ttl=2):
+        """
+        Arguments:
+        ttl -- time in seconds for which the list of processes is reused
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._names = None
+        self._listed = 0     # time.monotonic() of the last enumeration
+        if sys.platform == "win32":
+            self._list = self._list_toolhelp
+        elif os.path.isdir("/proc"):
+            self._list = self._list_proc
+        else:
+            self._list = None
+            logging.warning("Listing processes is not supported on " + sys.platform + ".")
+
+    def process_names(self):
+        """
+        Returns the set of the names of all running processes, in lower case.
+        """
+        with self._lock:
+            if self._names is None or time.monotonic() - self._listed >= self.ttl:
+                names = set()
+                if self._list is not None:
+                    try:
+                        names = self._list()
+                    except OSError:
+                        logging.exception("")
+                self._names = names
+                self._listed = time.monotonic()
+            return self._names
+
+    def process_exists(self, process_name):
+        """
+        Returns True if a process with this name (e.g. "httpd.exe") is running. On Linux, the
+        name is also found without the extension .exe.
+        """
+        process_name = process_name.lower()
+        names = self.process_names()
+        if process_name in names:
+            return True
+        if self._list == self._list_proc:
+            # /proc/<pid>/comm is cut off after 15 characters
+            base = process_name[:-4] if process_name.endswith(".exe") else process_name
+            return base[:15] in names or process_name[:15] in names
+        return False
+
+    @staticmethod
+    def port_open(host, port, timeout=0.5):
+        """
+        Returns True if a server accepts TCP connections on host:port.
+        """
+        try:
+            with socket.create_connection((host, port), timeout):
+                return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _list_proc():
+        names = set()
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open("/proc/" + pid + "/comm", "r") as comm:
+                    names.add(comm.read().strip().lower())
+            except OSError:
+                # the process has ended in the meantime
+                pass
+        return names
+
+    @staticmethod
+    def _list_toolhelp():
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.CreateToolhelp32Snapshot.restype = ctypes.c_void_p
+        kernel32.CreateToolhelp32Snapshot.argtypes = (ctypes.c_uint32, ctypes.c_uint32)
+        kernel32.Process32FirstW.argtypes = (ctypes.c_void_p, ctypes.POINTER(ProcessEntry))
+        kernel32.Process32NextW.argtypes = (ctypes.c_void_p, ctypes.POINTER(ProcessEntry))
+        kernel32.CloseHandle.argtypes = (ctypes.c_void_p,)
+        TH32CS_SNAPPROCESS = 0x2
+        snapshot = kernel32.CreateToolhelp32Snapshot(TH32CS_SNAPPROCESS, 0)
+        if snapshot is None or snapshot == ctypes.c_void_p(-1).value:
+            raise ctypes.WinError(ctypes.get_last_error())
+        names = set()
+        try:
+            entry = ProcessEntry()
+            entry.dwSize = ctypes.sizeof(ProcessEntry)
+            found = kernel32.Process32FirstW(snapshot, ctypes.byref(entry))
+            while found:
+                names.add(entry.szExeFile.lower())
+                found = kernel32.Process32NextW(snapshot, ctypes.byref(entry))
+        finally:
+            kernel32.CloseHandle(snapshot)
+        return names
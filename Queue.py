@@ -1,11 +1,8 @@
-import time
-import os
-import subprocess
 import threading
-import traceback
-import copy
-import logging
-from AcdMacro import AcdMacro
+from EvaluationQueue import EvaluationQueue
+from QueueEngine import QueueEngine, SHIM_TYPES
+from Scheduler import create_scheduler
+from Repositories import SampleRepository, ShimmingRepository, QueueAbortRepository
 
 class Queue:
     """
@@ -13,7 +10,7 @@ class Queue:
     It controls both the Autosampler and the Spectrometer.
     """
     
-    def __init__(self, autosampler, spinsolve, mysql_reader):
+    def __init__(self, autosampler, spinsolve, mysql_reader, abort_signal, scheduler=None, evaluation_queue=None):
         """
         Create a Queue object.
         Requires an existing Autosampler and Spinsolve object, which have to be passed to this
@@ -22,6 +19,12 @@ class Queue:
         Arguments:
         autosampler  -- the Autosampler object which should be used for the queue
         spinsolve    -- the Spinsolve object
+        mysql_reader -- a MySQLReader object
+        abort_signal -- the AbortSignal which mirrors the QueueStat flag
+        scheduler    -- the Scheduler which picks the next sample, by default the one which is
+                        configured in the config table (see create_scheduler), FIFO otherwise
+        evaluation_queue -- the EvaluationQueue which evaluates the measured spectra, by default
+                            a new one
         mysql_user   -- the mysql username for the queue db
         mysql_passwd -- mysql password
         mysql_host   -- hostname of the mysql server
@@ -29,27 +32,34 @@ class Queue:
         """
         self.autosampler = autosampler
         self.spinsolve = spinsolve
-        self.acd_macro_running = False
+        self.abort_signal = abort_signal
         
         # connect to mysql database
         self.mysql_reader = mysql_reader
-        conn, cur = self.mysql_reader.connect_db()
+        if scheduler is None:
+            scheduler = create_scheduler(self.mysql_reader.read_config())
+        self.scheduler = scheduler
+        self.samples = SampleRepository(self.mysql_reader)
+        self.shimming = ShimmingRepository(self.mysql_reader)
+        self.queueabort = QueueAbortRepository(self.mysql_reader)
         
         # set queue and shimming to not running, when the queue is initialized.
-        cur.execute("UPDATE QueueAbort SET QueueStat = 0")
-        cur.execute("UPDATE shimming SET Shimming = 0")
+        self.abort_signal.trigger()
+        self.shimming.set_flag(0)
         
-        # start queue daemon
-        self.qd = threading.Thread(target=self.queue_daemon, args=())
+        # workers for the automatic evaluation of the spectra
+        if evaluation_queue is None:
+            evaluation_queue = EvaluationQueue(self.mysql_reader)
+        self.evaluation_queue = evaluation_queue
+        
+        # start queue daemon, which runs the QueueEngine on its own event loop
+        self.engine = QueueEngine(self)
+        self.qd = threading.Thread(target=self.engine.run, args=())
         self.qd.daemon = True
         self.qd.start()
         
-        # start progress daemon
-        self.pd = threading.Thread(target=self.progress_daemon, args=())
-        self.pd.daemon = True
-        self.pd.start()
-        
-        conn.close()
+        # the progress is written whenever the Spinsolve reports a new one
+        self.spinsolve.add_progress_listener(self.write_progress)
     
     def connect_db(self):
         """
@@ -58,350 +68,48 @@ class Queue:
         """
         return self.mysql_reader.connect_db()
     
-    def read_db(self):
+    def evaluate(self, fname, method):
         """
-        Reads data from autosampler db.
-        
-        returns :
-        samples -- sample table in nested tuple / dictionary format
-        shimming -- shimming table (one row) as dictionary
-        queueabort -- queueabort table, a.k.a. the abort flag as dictionary
-        
-        short reference on the meaning of these flags:
-        shimming['Shimming']:  0 = shimming ok
-                               1 = someone gave the order for shimming, we are performing checkshim now
-                               2 = we are performing quickshim now
-                               3 and 4 = the other quickshims failed and we are performing more quickshims
-                               5 = 3x quickshim failed, we are aborting now
-        queueabort['QueueStat']: 0 = queue is either not running, or was aborted.
-                                 1 = someone gave the order to start the queue.
-                                 
-                               
+        Queues the automatic evaluation of a measured sample using ACD specman.
+        Returns immediately, the evaluation is run by the EvaluationQueue.
         
+        Arguments:
+        fname    -- Folder name of the NMR spectrum
+        method   -- The method ID in the mysql DB
         """
-        conn, cur = self.connect_db()
-        if conn == None or cur == None:
-            return None, None, None
-        samples = self.mysql_reader.read_samples(conn, cur)
-        shimming = self.mysql_reader.read_shimming(conn, cur)
-        queueabort = self.mysql_reader.read_queueabort(conn, cur)
-        conn.close()
-        return samples, shimming, queueabort
+        self.evaluation_queue.submit(fname, method)
     
-    def queue_daemon(self):
+    def write_progress(self, progress):
         """
-        Queue daemon always runs in the background and continually reads the database.
-        Any event should be handled through this daemon, which is supposed to spring into action
-        as soon as it detects changes in the database.
-        The daemon is blocking, which means that, during a measurement, it will wait for the 
-        functions it calls to finish.
-        Only one queue daemon is allowed to run at the same time, otherwise it could be possible 
-        that multiphle daemons conflict with each other.
+        Writes the progress of the measurement (reported by the Spinsolve) into the database.
+        The updates are written in the background by the DbWriter, repeated updates are 
+        coalesced.
         """
-        first_sample = True  # only True if the current sample is the first one of the queue
-                             # (in this case: this is only allowed to reset when there has been
-                             # a phase of not measuring any samples)
-        previous_sample = 32  # if first_sample is false, then this is used to determine if the 
-                              # sample must be inserted again or if it is still inside
-        same_sample = False # if the same sample should be measured multiple times, this 
-                            # flag will be set to True. Then it knows that it can skip 
-                            # inserting
-        while True:
-            try:
-                # check if connected to autosampler, spectrometer, and if autosampler is ready
-                # if the same sample is measured multiple times the errorcode will be 3 instead of 0
-                if self.autosampler.ser != False and self.spinsolve.socket != False and (self.autosampler.errorcode == 0 or (same_sample and self.autosampler.errorcode == 3)):
-                    # read database
-                    samples, shimming, queueabort = self.read_db()
-                    # start measuring samples.
-                    SinceShim = time.time() - shimming['LastShim']
-                    # queuestat is 1 --> we are going to run the queue.
-                    if queueabort['QueueStat'] == 1:
-                        conn, cur = self.connect_db()
-                        if conn is not None and cur is not None:
-                            # if possible, there should be no Running samples, but if there are, they are probably due to a prior crash, so lets restart them.
-                            # we get a list of all Running samples sorted by ID...
-                            cur.execute("SELECT * FROM samples WHERE Status = 'Running' ORDER BY ID ASC")
-                            running_samples = cur.fetchall()
-                            if running_samples:
-                                sample = running_samples[0]
-                            else:
-                                # this is the normal case where no Running samples were found.
-                                # we get a list of all Queued samples sorted by StartDate, then ID, and set "sample" as the next queued sample.
-                                # MySQL will put those samples without StartDate (=NULL) first, for other sql implementations this should probably be changed.
-                                cur.execute("SELECT * FROM samples WHERE Status = 'Queued' ORDER BY StartDate ASC, ID ASC")
-                                queued_samples = cur.fetchall()
-                                if queued_samples:
-                                    sample = queued_samples[0]
-                                else:
-                                    sample = None
-                            # now we measure the first one of those
-                            # since we are running a daemon, the next one will be automatically measured later
-                            # on, as long as QueueStat stays at 1.
-                            if sample == None:
-                                # if no sample is queued, the QueueStat will be reset to 0, which will unhide
-                                # the buttons in the Table.
-                                cur.execute("UPDATE QueueAbort SET QueueStat = 0")
-                            elif sample["StartDate"] == None or sample["StartDate"] <= time.time():
-                                # Check if the StartDate is set, and if it is, whether it has already passed.
-                                cur.execute("UPDATE samples SET Status = 'Running' WHERE ID = " + str(sample['ID']))
-                                logging.info("Measuring sample " + sample['Name'] + " with ID = " + str(sample['ID']) + ".")
-                                as_status = int(self.autosampler.errorcode)
-                                should_insert = False
-                                inserted = False
-                                if not first_sample:
-                                    if same_sample:
-                                        # the same_sample flag is set after a measurement if the next sample has the same holder.
-                                        # this is checked to prevent the autosampler from removing the sample unnecessarily.
-                                        # in this case, the sample is still in the spectrometer, no need to re-insert it.
-                                        if previous_sample != sample["Holder"]:
-                                            # this block should be triggered if the sample number has changed over the course of a waiting time,
-                                            # for example: two measurments of holder 2 are scheduled by time, but someone adds another sample for holder 3
-                                            # in between - in this case we need to remove the sample for holder 2 before we try to add the sample for
-                                            # holder 3.
-                                            logging.info("Removing waiting sample for Holder " + str(previous_sample) + ".")
-                                            returned = self.autosampler.return_sample(previous_sample)
-                                            time.sleep(2)
-                                            if not returned:
-                                                logging.error("Error while removing sample.")
-                                                break
-                                            else:
-                                                should_insert = True
-                                        else:
-                                            # as expected, the sample is already inside, just continue without inserting the sample.
-                                            inserted = True
-                                            # reset the same_sample flag here, now it's "used" and the correct sample is in. the program
-                                            # can run as if a new sample was actually inserted now.
-                                            same_sample = False
-                                    else:
-                                        # most common case, we just want to measure the next sample in the queue
-                                        should_insert = True
-                                else:
-                                    # first sample of a queue always needs to be inserted
-                                    should_insert = True
-                                if should_insert:
-                                    inserted = self.autosampler.insert_sample(sample['Holder'], not first_sample)
-                                # ok if insertion was successful, we can start measuring.
-                                if inserted:
-                                    # find out what type of measurement it is
-                                    if sample['SampleType'] == "CheckShim" or sample['SampleType'] == "QuickShim" or sample['SampleType'] == "PowerShim":
-                                        # Shimming sample
-                                        logging.info("Begin shimming of type " + sample['SampleType'] + ".")
-                                        cur.execute("UPDATE shimming SET Shimming = 1")
-                                        conn.close()  # close connection to mysql in preparation of lengthy operation
-                                        success, aborted = self.spinsolve.shim(sample['SampleType'])
-                                        if not aborted:
-                                            conn, cur = self.mysql_reader.connect_db()
-                                            if sample['SampleType'] == "CheckShim":
-                                                # Shim as required: Checkshim, then up to 3x Quickshim.
-                                                if success:
-                                                    t = int(time.time())
-                                                    cur.execute("UPDATE shimming SET Shimming = 0, LastShim = " + str(t))
-                                                    logging.info("CheckShim successful.")
-                                                    shimming['Shimming'] = 0
-                                                    shimming['LastShim'] = t
-                                                else:
-                                                    # if checkshim failed, we need to do quickshims now.
-                                                    cur.execute("UPDATE shimming SET Shimming = 2")
-                                                    shimming['Shimming'] = 2
-                                                    while shimming['Shimming'] >= 2 and shimming['Shimming'] < 5:
-                                                        # if one quickshim fails, do up to 2 more quickshims before giving up.
-                                                        logging.info("Performing QuickShim...")
-                                                        success, aborted = self.spinsolve.shim('QuickShim')
-                                                        if aborted:
-                                                            break
-                                                        if success:
-                                                            t = int(time.time())
-                                                            cur.execute("UPDATE shimming SET Shimming = 0, LastShim = " + str(t))
-                                                            logging.info("QuickShim successful.")
-                                                            shimming['Shimming'] = 0
-                                                            shimming['LastShim'] = t
-                                                        else:
-                                                            shimming['Shimming'] += 1
-                                                            cur.execute("UPDATE shimming SET Shimming = " + str(shimming['Shimming']))
-                                                            if shimming['Shimming'] > 4:
-                                                                logging.info("QuickShim failed three times. Check if shimming sample (10% D<sub>2</sub>O + 90% H<sub>2</sub>O) is inserted correctly and try again.")
-                                                                cur.execute("UPDATE shimming SET Shimming = 0, LastShim = 0")
-                                            elif sample['SampleType'] == "QuickShim" or sample['SampleType'] == "PowerShim":
-                                                cur.execute("UPDATE shimming SET Shimming = 0")
-                                                if success:
-                                                    t = int(time.time())
-                                                    cur.execute("UPDATE shimming SET LastShim = " + str(t))
-                                                    logging.info(sample['SampleType'] + " successful.")
-                                                    shimming['Shimming'] = 0
-                                                    shimming['LastShim'] = t
-                                            conn.close()
-                                    else:
-                                        # Real sample
-                                        # get protocol from db
-                                        protocol = self.mysql_reader.read_protocol(sample['Protocol'], conn, cur)
-                                        # filter the different options depending on the protocol
-                                        options = {}
-                                        # get options from property table
-                                        props = self.mysql_reader.read_sample_properties(sample['ID'], conn, cur)
-                                        for prop in props:
-                                            options[prop['xmlKey']] = prop['strvalue']
-                                        conn.close()  # close connection to mysql in preparation of lengthy operation
-                                        success, aborted = self.spinsolve.measure_sample(sample['Name'], protocol['xmlKey'], options, sample['Solvent'])
-                                    
-                                    # reconnect to DB
-                                    conn, cur = self.mysql_reader.connect_db()
-                                    if aborted:
-                                        # Sample aborted
-                                        cur.execute("UPDATE samples SET Status = 'Failed' WHERE ID = " + str(sample['ID']))
-                                        cur.execute("UPDATE shimming SET Shimming = 0")
-                                        logging.info("Measurement aborted.")
-                                    elif success:
-                                        # successfully measured
-                                        logging.debug("Measurement done.")
-                                        cur.execute("UPDATE samples SET Status = 'Finished', Progress = 100 WHERE ID = " + str(sample['ID']))
-                                        # start the automatic evaluation using ACD specman
-                                        MacroSuccess = False
-                                        while self.acd_macro_running == True:
-                                            # wait for the last macro to finish before running the next one.
-                                            time.sleep(0.5)
-                                        try:
-                                            MacroSuccess = self.fnmr_macro(sample['Name'], sample['Method'])
-                                        except:
-                                            logging.error("Error while evaluating sample " + sample["Name"] + ".")
-                                            self.acd_macro_running = False
-                                        logging.info("Sample " + sample['Name'] + " was measured successfully.")
-                                    else:
-                                        # error when measuring sample
-                                        cur.execute("UPDATE samples SET Status = 'Failed' WHERE ID = " + str(sample['ID']))
-                                        logging.info("Error when measuring the sample.")
-                                    previous_sample = sample["Holder"]
-                                else:
-                                    # raise an error to the Autosampler, if it doesn't know the error itself
-                                    timeout = 5 # seconds
-                                    while timeout > 0:
-                                        timeout = timeout - 1
-                                        if self.autosampler.is_error():
-                                            # error has been caught
-                                            break
-                                        elif timeout <= 0:
-                                            # error has not been caught after timeout
-                                            self.autosampler.raise_error()
-                                            logging.warning("Raising error to Autosampler: Failed to insert sample while errorcode is not known!")
-                                        time.sleep(1)
-                                    # Special case: errorcode 6 (sample was detected in spectrometer). In this case, do not set status to failed, but interrupt the queue.
-                                    if self.autosampler.errorcode == 6:
-                                        cur.execute("UPDATE samples SET Status = 'Queued' WHERE ID = " + str(sample['ID']))
-                                    # interrupt the queue if an error in the autosampler occured (inserted != True)
-                                    else: 
-                                        cur.execute("UPDATE samples SET Status = 'Failed' WHERE ID = " + str(sample['ID']))
-                                # return the sample to the holder in the Autosampler.
-                                logging.info("Returning sample.")
-                                as_status = int(self.autosampler.errorcode)
-                                returned = False
-                                if as_status == 3:
-                                    # Check for any modifications which may have occured during the measurement
-                                    cur.execute("SELECT * FROM samples WHERE Status = 'Queued' ORDER BY ID ASC")
-                                    queued_samples = cur.fetchall()
-                                    if len(queued_samples) >= 1 and queued_samples[0]['Holder'] == sample['Holder']:
-                                        # next sample is the same holder as the current one, so don't remove
-                                        # it from the spectrometer
-                                        returned = True
-                                        # set the same_sample flag
-                                        same_sample = True
-                                    else:
-                                        returned = self.autosampler.return_sample(sample['Holder'])
-                                    first_sample = False
-                                    last_sample = sample['Holder']
-                                # if the sample was not returned from the autosampler, halt the queue and raise
-                                # an error to the autosampler, if it doesn't know the error itself.
-                                if not returned:
-                                    timeout = 5 # seconds
-                                    while timeout > 0:
-                                        timeout = timeout - 1
-                                        if self.autosampler.is_error():
-                                            # error has been caught
-                                            break
-                                        elif timeout <= 0:
-                                            # error has not been caught after timeout
-                                            self.autosampler.raise_error()
-                                            logging.warning("Raising error to Autosampler: Failed to return sample while errorcode is not known!")
-                                        time.sleep(1)
-                                    logging.info("Sample " + sample['Name'] + "could not be returned.")
-                            conn.close()
-                    
-                    # if both queue and shimming are not running, the first_sample flag will be reset.
-                    if queueabort['QueueStat'] == 0 and shimming['Shimming'] == 0:
-                        first_sample = True
-                    
-                    # if the autosampler encounters an error, we want to cancel the queue.
-                    if self.autosampler.is_error():
-                        conn, cur = self.connect_db()
-                        if conn is not None and cur is not None:
-                            cur.execute("UPDATE QueueAbort SET QueueStat = 0")
-                            conn.close()
-            except Exception as e:
-                logging.error("OMG Something TERRIBLE happened to the queue daemon!!!!! :-(")
-                logging.exception("")
-            time.sleep(1)
-
+        sample = self.engine.sample
+        if sample is None:
+            return
+        if sample['SampleType'] in SHIM_TYPES:
+            self.shimming.submit_progress(progress)
+        if not self.abort_signal.is_set():
+            self.samples.submit_progress(sample['ID'], progress)
     
-    def fnmr_macro(self, fname, method):
+    def stats(self):
         """
-        Automatically evaluate NMR spectrum using ACD NMR Processor.
-        
-        Arguments:
-        fname    -- Folder name of the NMR spectrum
-        method   -- The method ID in the mysql DB
+        Returns the state of the QueueEngine and the number of measurements since the start 
+        (Finished, Failed, Aborted) as a dictionary.
         """
-        macro = AcdMacro(self.mysql_reader, fname, method)
-        macro.run_macro()
-        # wait till macro thread is running
-        for i in range(10):
-            time.sleep(0.1)
-            if macro.running == True:
-                self.acd_macro_running = True
-                break
-        # run a "resetter" as a thread to reset self.acd_macro_running.
-        def fnmr_macro_resetter(self, macro):
-            while macro.running == True:
-                time.sleep(0.5)
-            self.acd_macro_running = False
-        macro_resetter = threading.Thread(target=fnmr_macro_resetter, args=(self, macro))
-        macro_resetter.daemon = True
-        macro_resetter.start()
-        
+        engine = self.engine
+        return {"state": engine.state, "outcomes": dict(engine.outcomes), "pending": len(engine.pending)}
     
-    def progress_daemon(self):
+    def start_queue(self):
         """
-        Reads the progress from the NMR, and writes it into the database.
+        starts the queue for debug purposes.
         """
-        last_progress = 0
-        progress = 0
-        while True:
-            try:
-                if self.spinsolve.progress:
-                    last_progress = copy.deepcopy(progress)
-                    progress = self.spinsolve.progress
-                    samples, shimming, queueabort = self.read_db()
-                    if samples is not None:
-                        if last_progress != progress:
-                            conn, cur = self.connect_db()
-                            if shimming['Shimming'] > 0:
-                                cur.execute("UPDATE shimming SET ShimProgress = " + str(progress))
-                            if queueabort['QueueStat'] == 1:
-                                cur.execute("SELECT * FROM samples WHERE Status = 'Running' ORDER BY ID ASC")
-                                samples = cur.fetchall()
-                                if samples:
-                                    sample = samples[0]
-                                    cur.execute("UPDATE samples SET Progress = " + str(progress) + " WHERE ID = " + str(sample['ID']))
-                            conn.close()
-            except:
-                logging.error("Something TERRIBLE happened to the progress daemon!!! :-(")
-                logging.exception("")
-            time.sleep(1)
+        self.abort_signal.release()
     
-    def start_queue(self):
+    def abort_queue(self):
         """
-        starts the queue for debug purposes.
+        Aborts the queue, including the measurement which is currently running.
         """
-        conn, cur = self.connect_db()
-        if conn is not None and cur is not None:
-            cur.execute("UPDATE QueueAbort SET QueueStat = 1")
-            conn.close()
+        self.abort_signal.trigger("Abort requested by user.")
         
\ No newline at end of file
@@ -0,0 +1,417 @@
+import asyncio
+import time
+import logging
+from Scheduler import SchedulerContext, SHIM_TYPES
+from Repositories import SampleRepository, ShimmingRepository
+
+class QueueEngine:
+    """
+    Runs the queue as a state machine on an asyncio event loop.
+
+    The states are:
+    Idle    -- waiting until Autosampler and Spinsolve are connected, the Autosampler is ready,
+               and the queue was started.
+    Select  -- pick the next sample (Running samples left over from a crash first, then the Queued
+               sample chosen by the scheduler) and mark it as Running.
+    Insert  -- get the sample into the spectrometer, or keep it there if it is still inside from
+               a previous measurement of the same holder.
+    Measure -- run the measurement or the shimming, and store the result.
+    Return  -- put the sample back into its holder, unless the next sample uses the same holder.
+
+    While the engine waits for the StartDate of the next sample, the carousel is pre-positioned
+    at its holder, so that the rotation does not delay the insertion. This is the only case in
+    which the rotation is hidden: it cannot overlap with the acquisition, because the tube in the
+    spectrometer sticks out of the magnet into the carousel and has to be returned into its own
+    holder first. Rotating right after the return does not pay off either, the Insert command
+    rotates the carousel itself, and the extra command takes longer than the bookkeeping it
+    would overlap with. So in a queue without StartDates, the rotation is not pre-positioned.
+
+    All calls to the Autosampler, the Spinsolve and the database block, so they are run in
+    worker threads and awaited. This allows the engine to overlap the database bookkeeping of one
+    step with the hardware movement of the next one (e.g. the status of a finished sample is
+    written while the sample is returned).
+
+    The meaning of the sample statuses (Running/Queued/Failed/Finished) is the same as before. For
+    the meaning of the Shimming and QueueStat flags, see ShimmingRepository and
+    QueueAbortRepository.
+    """
+
+    IDLE = "Idle"
+    SELECT = "Select"
+    INSERT = "Insert"
+    MEASURE = "Measure"
+    RETURN = "Return"
+    # states whose duration is recorded in the Timeline, and the names of their phases
+    PHASES = {INSERT: "insert", RETURN: "return"}
+
+    def __init__(self, queue, poll_interval=1):
+        """
+        Arguments:
+        queue         -- the Queue object, which holds the Autosampler, Spinsolve, MySQLReader,
+                         AbortSignal and Scheduler
+        poll_interval -- time in seconds between two checks while the engine is idle
+        """
+        self.queue = queue
+        self.autosampler = queue.autosampler
+        self.spinsolve = queue.spinsolve
+        self.mysql_reader = queue.mysql_reader
+        self.abort_signal = queue.abort_signal
+        self.scheduler = queue.scheduler
+        self.timeline = self.mysql_reader.timeline
+        self.samples = SampleRepository(self.mysql_reader)
+        self.shimming = ShimmingRepository(self.mysql_reader)
+        self.poll_interval = poll_interval
+
+        self.state = self.IDLE
+        self.sample = None          # the sample which is currently processed
+        self.last_sample = None     # the sample which was measured last
+        self.first_sample = True    # only True if the current sample is the first one of the queue
+                                    # (in this case: this is only allowed to reset when there has been
+                                    # a phase of not measuring any samples)
+        self.previous_sample = 32   # if first_sample is false, then this is used to determine if the
+                                    # sample must be inserted again or if it is still inside
+        self.same_sample = False    # if the same sample should be measured multiple times, this
+                                    # flag will be set to True. Then it knows that it can skip
+                                    # inserting
+        self.pending = []           # bookkeeping tasks which must be done before the next sample
+        self.position = None        # holder at which the carousel was last positioned, if known
+        self.outcomes = {"Finished": 0, "Failed": 0, "Aborted": 0}   # measurements since the start
+
+        self.loop = None
+        self.wakeup = None
+        self.handlers = {
+            self.IDLE: self.idle,
+            self.SELECT: self.select,
+            self.INSERT: self.insert,
+            self.MEASURE: self.measure,
+            self.RETURN: self.return_sample,
+        }
+
+    def run(self):
+        """
+        Runs the engine forever. Should be the target of a daemon thread.
+        """
+        asyncio.run(self.main())
+
+    def wake(self):
+        """
+        Wakes up the engine if it is idle. Can be called from any thread.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        # start right away when the queue is started, or when the Autosampler becomes ready.
+        self.abort_signal.add_listener(lambda aborted: self.wake())
+        self.autosampler.subscribe(lambda errorcode: self.wake())
+        while True:
+            try:
+                state, sample, started = self.state, self.sample, time.time()
+                self.state = await self.handlers[state]()
+                if state in self.PHASES and sample is not None:
+                    self.timeline.record(sample['ID'], sample['Name'], self.PHASES[state], started, time.time())
+            except Exception:
+                logging.error("OMG Something TERRIBLE happened to the queue daemon!!!!! :-(")
+                logging.exception("")
+                self.state = self.IDLE
+                await self.sleep()
+
+    async def sleep(self):
+        """
+        Waits for poll_interval seconds, or until the engine is woken up.
+        """
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    def call(self, function, *args):
+        """
+        Runs a blocking function in a worker thread. Returns an awaitable for its result.
+        """
+        return self.loop.run_in_executor(None, function, *args)
+
+    def transaction(self, *steps):
+        """
+        Runs several repository calls in one transaction in a worker thread, e.g. 
+        transaction((self.samples.set_status, sample_id, "Failed"), (self.shimming.set_flag, 0)).
+        Returns an awaitable.
+        """
+        return self.call(self.transaction_sync, steps)
+
+    def transaction_sync(self, steps):
+        with self.mysql_reader.transaction() as cur:
+            for function, *args in steps:
+                function(*args, cur=cur)
+
+    def defer(self, awaitable):
+        """
+        Schedules bookkeeping which may run in parallel to the next hardware step, but must be
+        finished before the next sample is selected. Its duration is recorded in the Timeline
+        for the current sample.
+        """
+        self.pending.append(asyncio.ensure_future(self.timed(self.sample, "bookkeeping", awaitable)))
+
+    async def timed(self, sample, phase, awaitable):
+        started = time.time()
+        try:
+            return await awaitable
+        finally:
+            self.timeline.record(sample['ID'], sample['Name'], phase, started, time.time())
+
+    async def settle(self):
+        """
+        Waits for all deferred bookkeeping.
+        """
+        pending, self.pending = self.pending, []
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error("Error in the queue bookkeeping: " + repr(result))
+
+    def is_ready(self):
+        """
+        check if connected to autosampler, spectrometer, and if autosampler is ready
+        if the same sample is measured multiple times the errorcode will be 3 instead of 0
+        """
+        return (self.autosampler.ser != False and self.spinsolve.socket != False
+                and (self.autosampler.errorcode == 0 or (self.same_sample and self.autosampler.errorcode == 3)))
+
+    async def escalate_error(self, action):
+        """
+        Raise an error to the Autosampler, if it doesn't know the error itself.
+        """
+        if not await self.call(self.autosampler.wait_for, self.autosampler.is_error, 4):
+            # error has not been caught after timeout
+            self.autosampler.raise_error()
+            logging.warning("Raising error to Autosampler: Failed to " + action + " sample while errorcode is not known!")
+
+    async def idle(self):
+        await self.settle()
+        # if the autosampler encounters an error, we want to cancel the queue.
+        if self.autosampler.is_error() and not self.abort_signal.is_set():
+            await self.call(self.abort_signal.trigger, "Autosampler reports an error.")
+        if self.is_ready():
+            if not self.abort_signal.is_set():
+                # queuestat is 1 --> we are going to run the queue.
+                return self.SELECT
+            # if both queue and shimming are not running, the first_sample flag will be reset.
+            shimming = await self.call(self.shimming.read)
+            if shimming.Shimming == 0:
+                self.first_sample = True
+        await self.sleep()
+        return self.IDLE
+
+    def next_sample_sync(self):
+        """
+        Returns the sample which should be measured next, or None if there is none.
+        """
+        # if possible, there should be no Running samples, but if there are, they are probably due to a prior crash, so lets restart them.
+        running_samples = self.samples.by_status("Running", ("ID",), 1)
+        if running_samples:
+            return running_samples[0]
+        # this is the normal case where no Running samples were found.
+        loaded = self.previous_sample if self.same_sample else None
+        return self.next_queued_sample_sync(SchedulerContext(self.position, loaded, self.last_sample))
+    
+    def next_queued_sample_sync(self, context):
+        """
+        Returns the Queued sample which will be measured next according to the scheduler, or 
+        None if there is none. If no sample is due yet, the one with the earliest StartDate is
+        returned.
+        """
+        queued_samples = self.samples.by_status("Queued")
+        return self.scheduler.next_sample(queued_samples, context)
+
+    @staticmethod
+    def is_due(sample):
+        """
+        Returns True if the StartDate of the sample is not set or has already passed.
+        """
+        return sample["StartDate"] is None or sample["StartDate"] <= time.time()
+
+    async def preposition(self, holder):
+        """
+        Rotates the carousel to a holder, so that the next insertion does not need to wait for
+        the rotation.
+        Must only be called while no tube is in the spectrometer (errorcode 0): the tube would
+        stick out of the magnet into the carousel, and the sample which is inside has to be
+        returned into its own holder anyway.
+        """
+        if self.first_sample or self.position == holder or self.autosampler.errorcode != 0:
+            # the first sample of a queue is inserted with a homing, which moves the carousel anyway.
+            return
+        logging.debug("Pre-positioning carousel at Holder " + str(holder) + ".")
+        self.position = holder
+        # wait until the Autosampler has acknowledged the command, so that the Idle state does
+        # not mistake the old status for the end of the movement.
+        await self.call(self.autosampler.move_to_pos, holder, 1)
+
+    async def select(self):
+        sample = await self.call(self.next_sample_sync)
+        if sample is None:
+            # if no sample is queued, the QueueStat will be reset to 0, which will unhide
+            # the buttons in the Table.
+            await self.call(self.abort_signal.trigger)
+            return self.IDLE
+        if not self.is_due(sample):
+            # the StartDate has not yet passed. use the time to move to the sample.
+            if not self.same_sample:
+                await self.preposition(sample["Holder"])
+            await self.sleep()
+            return self.IDLE
+        self.sample = sample
+        await self.call(self.samples.set_status, sample['ID'], "Running")
+        logging.info("Measuring sample " + sample['Name'] + " with ID = " + str(sample['ID']) + ".")
+        return self.INSERT
+
+    async def insert(self):
+        sample = self.sample
+        should_insert = True
+        inserted = False
+        if not self.first_sample and self.same_sample:
+            # the same_sample flag is set after a measurement if the next sample has the same holder.
+            # this is checked to prevent the autosampler from removing the sample unnecessarily.
+            # in this case, the sample is still in the spectrometer, no need to re-insert it.
+            self.same_sample = False
+            if self.previous_sample != sample["Holder"]:
+                # this block should be triggered if the sample number has changed over the course of a waiting time,
+                # for example: two measurments of holder 2 are scheduled by time, but someone adds another sample for holder 3
+                # in between - in this case we need to remove the sample for holder 2 before we try to add the sample for
+                # holder 3.
+                logging.info("Removing waiting sample for Holder " + str(self.previous_sample) + ".")
+                if not await self.call(self.autosampler.return_sample, self.previous_sample):
+                    logging.error("Error while removing sample.")
+                    await self.escalate_error("remove")
+                    await self.call(self.samples.set_status, sample['ID'], "Queued")
+                    return self.IDLE
+            else:
+                # as expected, the sample is already inside, just continue without inserting the sample.
+                should_insert = False
+                inserted = True
+        if should_insert:
+            # the first sample of a queue is inserted with homing and ejection of stuck samples.
+            inserted = await self.call(self.autosampler.insert_sample, sample['Holder'], not self.first_sample)
+            self.position = sample['Holder']
+        if inserted:
+            # ok if insertion was successful, we can start measuring.
+            return self.MEASURE
+        await self.escalate_error("insert")
+        # Special case: errorcode 6 (sample was detected in spectrometer). In this case, do not set status to failed, but interrupt the queue.
+        if self.autosampler.errorcode == 6:
+            await self.call(self.samples.set_status, sample['ID'], "Queued")
+        # interrupt the queue if an error in the autosampler occured (inserted != True)
+        else:
+            await self.call(self.samples.set_status, sample['ID'], "Failed")
+        return self.IDLE
+
+    async def measure(self):
+        sample = self.sample
+        # find out what type of measurement it is
+        if sample['SampleType'] in SHIM_TYPES:
+            success, aborted = await self.shim(sample['SampleType'])
+        else:
+            # Real sample: get protocol and options from db
+            protocol, props = await asyncio.gather(self.call(self.mysql_reader.read_protocol, sample['Protocol']),
+                                                   self.call(self.mysql_reader.read_sample_properties, sample['ID']))
+            options = {}
+            for prop in props:
+                options[prop['xmlKey']] = prop['strvalue']
+            success, aborted = await self.call(self.spinsolve.measure_sample, sample['Name'], protocol['xmlKey'], options, sample['Solvent'])
+            self.timeline.record_phases(sample['ID'], sample['Name'], self.spinsolve.phases)
+
+        # the result is stored while the sample is returned.
+        if aborted:
+            # Sample aborted
+            self.defer(self.transaction((self.samples.set_status, sample['ID'], "Failed"), (self.shimming.set_flag, 0)))
+            self.outcomes["Aborted"] += 1
+            logging.info("Measurement aborted.")
+        elif success:
+            # successfully measured
+            logging.debug("Measurement done.")
+            self.defer(self.call(self.samples.finish, sample['ID']))
+            # start the automatic evaluation using ACD specman
+            self.defer(self.call(self.queue.evaluate, sample['Name'], sample['Method']))
+            self.outcomes["Finished"] += 1
+            logging.info("Sample " + sample['Name'] + " was measured successfully.")
+        else:
+            # error when measuring sample
+            self.defer(self.call(self.samples.set_status, sample['ID'], "Failed"))
+            self.outcomes["Failed"] += 1
+            logging.info("Error when measuring the sample.")
+        self.previous_sample = sample["Holder"]
+        self.last_sample = sample
+        return self.RETURN
+
+    async def shim(self, shimtype):
+        """
+        Performs a shimming sample. A failed CheckShim is followed by up to three QuickShims.
+        Returns success and aborted like Spinsolve.shim.
+        """
+        logging.info("Begin shimming of type " + shimtype + ".")
+        await self.call(self.shimming.set_flag, 1)
+        success, aborted = await self.call(self.spinsolve.shim, shimtype)
+        self.timeline.record_phases(self.sample['ID'], self.sample['Name'], self.spinsolve.phases)
+        if aborted:
+            return success, aborted
+        if shimtype == "CheckShim":
+            # Shim as required: Checkshim, then up to 3x Quickshim.
+            if success:
+                await self.call(self.shimming.finish, int(time.time()))
+                logging.info("CheckShim successful.")
+            else:
+                # if checkshim failed, we need to do quickshims now.
+                shimming = 2
+                await self.call(self.shimming.set_flag, shimming)
+                while shimming >= 2 and shimming < 5:
+                    # if one quickshim fails, do up to 2 more quickshims before giving up.
+                    logging.info("Performing QuickShim...")
+                    success, aborted = await self.call(self.spinsolve.shim, 'QuickShim')
+                    self.timeline.record_phases(self.sample['ID'], self.sample['Name'], self.spinsolve.phases)
+                    if aborted:
+                        break
+                    if success:
+                        shimming = 0
+                        await self.call(self.shimming.finish, int(time.time()))
+                        logging.info("QuickShim successful.")
+                    else:
+                        shimming += 1
+                        await self.call(self.shimming.set_flag, shimming)
+                        if shimming > 4:
+                            logging.info("QuickShim failed three times. Check if shimming sample (10% D<sub>2</sub>O + 90% H<sub>2</sub>O) is inserted correctly and try again.")
+                            await self.call(self.shimming.finish, 0)
+        else:
+            if success:
+                await self.call(self.shimming.finish, int(time.time()))
+                logging.info(shimtype + " successful.")
+            else:
+                await self.call(self.shimming.set_flag, 0)
+        return success, aborted
+
+    async def return_sample(self):
+        sample = self.sample
+        # return the sample to the holder in the Autosampler.
+        logging.info("Returning sample.")
+        returned = False
+        if self.autosampler.errorcode == 3:
+            # Check for any modifications which may have occured during the measurement
+            upcoming = await self.call(self.next_queued_sample_sync, SchedulerContext(self.position, sample['Holder'], sample))
+            if upcoming is not None and upcoming['Holder'] == sample['Holder']:
+                # next sample is the same holder as the current one, so don't remove
+                # it from the spectrometer
+                returned = True
+                # set the same_sample flag
+                self.same_sample = True
+            else:
+                returned = await self.call(self.autosampler.return_sample, sample['Holder'])
+                self.position = sample['Holder']
+            self.first_sample = False
+        # if the sample was not returned from the autosampler, halt the queue and raise
+        # an error to the autosampler, if it doesn't know the error itself.
+        if not returned:
+            await self.escalate_error("return")
+            logging.info("Sample " + sample['Name'] + " could not be returned.")
+        self.sample = None
+        return self.IDLE
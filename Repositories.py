@@ -0,0 +1,214 @@
+from collections import namedtuple
+
+ShimmingRow = namedtuple("ShimmingRow", ("Shimming", "LastShim", "ShimProgress"))
+
+
+class Repository:
+    """
+    Base class of the repositories, which keep the SQL statements of one table in one place.
+
+    The statements are constants with parameters (%s), the values are always passed separately
+    and escaped by MySQLdb, never concatenated into the statement.
+
+    Every method takes an optional cursor. Without it, the statement runs on a connection of
+    its own; with it, the statement becomes part of whatever the cursor belongs to, e.g. a
+    transaction (see MySQLReader.transaction):
+
+        with mysql_reader.transaction() as cur:
+            samples.set_status(sample_id, "Failed", cur)
+            shimming.set_flag(0, cur)
+    """
+
+    def __init__(self, mysql_reader):
+        """
+        Arguments:
+        mysql_reader -- a MySQLReader object
+        """
+        self.mysql_reader = mysql_reader
+
+    def execute(self, statement, args=None, cur=None):
+        """
+        Runs a statement, and returns the number of affected rows.
+        """
+        if cur is not None:
+            cur.execute(statement, args)
+            return cur.rowcount
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None or cur is None:
+            raise ConnectionError("No connection to the MySQL DB.")
+        try:
+            cur.execute(statement, args)
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def fetchall(self, statement, args=None, cur=None):
+        """
+        Runs a query, and returns its rows as dictionaries.
+        """
+        if cur is not None:
+            cur.execute(statement, args)
+            return cur.fetchall()
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None or cur is None:
+            raise ConnectionError("No connection to the MySQL DB.")
+        try:
+            cur.execute(statement, args)
+            return cur.fetchall()
+        finally:
+            conn.close()
+
+
+class SampleRepository(Repository):
+    """
+    The samples table.
+    """
+
+    SET_STATUS = "UPDATE samples SET Status = %s WHERE ID = %s"
+    FINISH = "UPDATE samples SET Status = 'Finished', Progress = 100 WHERE ID = %s"
+    # only while the sample is Running, so that a late progress never overwrites the 100 % of
+    # a finished sample
+    SET_PROGRESS = "UPDATE samples SET Progress = %s WHERE ID = %s AND Status = 'Running'"
+    SET_RESULT = "UPDATE samples SET result = %s WHERE Name = %s ORDER BY ID ASC LIMIT 1"
+    COUNT_BY_STATUS = "SELECT Status, COUNT(*) AS Count FROM samples GROUP BY Status"
+
+    def by_status(self, status, order_by=("StartDate", "ID"), limit=None):
+        """
+        Returns the samples with the given status as list of SampleRow, see
+        MySQLReader.read_samples_by_status.
+        """
+        return self.mysql_reader.read_samples_by_status(status, order_by, limit)
+
+    def count_by_status(self, cur=None):
+        """
+        Returns the number of samples of each status as dictionary {status: count}.
+        """
+        return {row["Status"]: row["Count"] for row in self.fetchall(self.COUNT_BY_STATUS, None, cur)}
+
+    def set_status(self, sample_id, status, cur=None):
+        self.execute(self.SET_STATUS, (status, sample_id), cur)
+
+    def finish(self, sample_id, cur=None):
+        """
+        Marks a sample as Finished, with a progress of 100 %.
+        """
+        self.execute(self.FINISH, (sample_id,), cur)
+
+    def set_progress(self, sample_id, progress, cur=None):
+        """
+        Sets the progress of a Running sample.
+        """
+        self.execute(self.SET_PROGRESS, (progress, sample_id), cur)
+
+    def submit_progress(self, sample_id, progress):
+        """
+        Sets the progress of a Running sample in the background, see DbWriter.
+        """
+        self.mysql_reader.writer.submit(("samples", sample_id, "Progress"), self.SET_PROGRESS, (progress, sample_id))
+
+    def set_result(self, sample_name, result, cur=None):
+        """
+        Sets the result of the evaluation of a sample (the first sample with this name).
+        Nothing is written if there is no sample with this name.
+        """
+        self.execute(self.SET_RESULT, (result, sample_name), cur)
+
+    def set_results(self, results, cur=None):
+        """
+        Sets the results of many samples at once.
+
+        Arguments:
+        results -- list of (sample_name, result) tuples
+        """
+        args = [(result, sample_name) for sample_name, result in results]
+        if cur is not None:
+            cur.executemany(self.SET_RESULT, args)
+            return
+        with self.mysql_reader.transaction() as cur:
+            cur.executemany(self.SET_RESULT, args)
+
+
+class ShimmingRepository(Repository):
+    """
+    The shimming table (one row). The meaning of the Shimming flag:
+    0 = shimming ok
+    1 = someone gave the order for shimming, we are performing checkshim now
+    2 = we are performing quickshim now
+    3 and 4 = the other quickshims failed and we are performing more quickshims
+    5 = 3x quickshim failed, we are aborting now
+    """
+
+    SELECT = "SELECT Shimming, LastShim, ShimProgress FROM shimming LIMIT 1"
+    SET_FLAG = "UPDATE shimming SET Shimming = %s"
+    FINISH = "UPDATE shimming SET Shimming = 0, LastShim = %s"
+    # only while a shimming is running
+    SET_PROGRESS = "UPDATE shimming SET ShimProgress = %s WHERE Shimming > 0"
+
+    def read(self, cur=None):
+        """
+        Returns the shimming table as ShimmingRow.
+        """
+        return ShimmingRow(**self.fetchall(self.SELECT, None, cur)[0])
+
+    def set_flag(self, shimming, cur=None):
+        self.execute(self.SET_FLAG, (shimming,), cur)
+
+    def finish(self, last_shim, cur=None):
+        """
+        Resets the Shimming flag and stores the time of the last successful shimming (0 if the
+        shimming has failed).
+        """
+        self.execute(self.FINISH, (last_shim,), cur)
+
+    def set_progress(self, progress, cur=None):
+        self.execute(self.SET_PROGRESS, (progress,), cur)
+
+    def submit_progress(self, progress):
+        """
+        Sets the progress of the running shimming in the background, see DbWriter.
+        """
+        self.mysql_reader.writer.submit(("shimming", "ShimProgress"), self.SET_PROGRESS, (progress,))
+
+
+class QueueAbortRepository(Repository):
+    """
+    The queueabort table (one row). The meaning of the QueueStat flag:
+    0 = queue is either not running, or was aborted
+    1 = someone gave the order to start the queue
+    """
+
+    SELECT = "SELECT QueueStat FROM queueabort LIMIT 1"
+    SET = "UPDATE queueabort SET QueueStat = %s"
+
+    def read(self, cur=None):
+        """
+        Returns QueueStat as int.
+        """
+        return int(self.fetchall(self.SELECT, None, cur)[0]["QueueStat"])
+
+    def set(self, queue_stat, cur=None):
+        self.execute(self.SET, (queue_stat,), cur)
+
+
+class MethodRepository(Repository):
+    """
+    The methods of the automatic evaluation and their peaks. These are reference data, so they
+    are served from the ReferenceCache of the MySQLReader.
+    """
+
+    STANDARD = 0
+    STARTING_MATERIAL = 1
+    PRODUCT = 2
+
+    def method(self, method_id):
+        """
+        Returns the method (joined with its nucleus) as dictionary, or None.
+        """
+        return self.mysql_reader.read_method(method_id)
+
+    def peaks(self, method_id, role):
+        """
+        Returns the list of the peaks of a method with the given role (STANDARD,
+        STARTING_MATERIAL or PRODUCT).
+        """
+        return self.mysql_reader.read_peaks(method_id, role)
@@ -0,0 +1,188 @@
+import time
+
+# sample types of the shimming samples
+SHIM_TYPES = ("CheckShim", "QuickShim", "PowerShim")
+
+class Scheduler:
+    """
+    Decides which of the Queued samples is measured next.
+
+    Subclasses implement choose(). The engine calls it with the Queued samples whose StartDate
+    has passed, and a SchedulerContext describing the current state of the hardware.
+    """
+
+    def choose(self, samples, context):
+        """
+        Returns the sample (one of the dictionaries in samples) which should be measured next.
+
+        Arguments:
+        samples -- list of Queued samples (dictionaries) which are due, never empty
+        context -- a SchedulerContext
+        """
+        raise NotImplementedError
+
+    def next_sample(self, samples, context, now=None):
+        """
+        Returns the sample which should be measured next out of all Queued samples, or None.
+        If no sample is due yet, the sample with the earliest StartDate is returned, so that the
+        caller can wait for it.
+
+        Arguments:
+        samples -- list of all Queued samples (dictionaries)
+        context -- a SchedulerContext
+        now     -- the current timestamp, defaults to time.time()
+        """
+        if not samples:
+            return None
+        if now is None:
+            now = time.time()
+        due = [sample for sample in samples if sample["StartDate"] is None or sample["StartDate"] <= now]
+        if not due:
+            return min(samples, key=lambda sample: (sample["StartDate"], sample["ID"]))
+        return self.choose(due, context)
+
+
+class SchedulerContext:
+    """
+    State of the hardware which is relevant for the choice of the next sample.
+
+    position -- holder at which the carousel is positioned, or None if unknown
+    loaded   -- holder of the sample which is still inside the spectrometer, or None
+    previous -- the sample (dictionary) which was measured last, or None
+    now      -- the current timestamp
+    """
+
+    def __init__(self, position=None, loaded=None, previous=None, now=None):
+        self.position = position
+        self.loaded = loaded
+        self.previous = previous
+        self.now = time.time() if now is None else now
+
+
+class FifoScheduler(Scheduler):
+    """
+    Measures the samples in the order of their StartDate, then ID, like the queue always did.
+    Samples without StartDate come first.
+    """
+
+    def choose(self, samples, context):
+        return min(samples, key=fifo_key)
+
+
+class CostModelScheduler(Scheduler):
+    """
+    Measures the sample next which causes the least overhead, estimated in seconds:
+
+    - rotation of the carousel from its current position to the holder of the sample,
+    - returning the sample which is inside the spectrometer and inserting the next one, which
+      is saved if the next sample uses the same holder,
+    - changes of protocol or solvent compared to the previous sample.
+
+    Samples with a higher Priority (optional column in the samples table, higher first) always
+    come first. Every sample gets a bonus for every second it has been waiting (since its
+    StartDate, or since the scheduler first saw it if it has none), so that it is not pushed
+    back indefinitely by cheaper samples. Ties are broken by StartDate and ID, as in the
+    FifoScheduler.
+
+    Shimming samples are barriers: the samples in front of a shimming (in the order of the
+    FifoScheduler) are measured before it, and the samples behind it after it, so that a
+    shimming still takes effect for exactly the samples which were queued after it.
+
+    The queue uses the FifoScheduler unless Scheduler is set to "CostModel" in the config
+    table, see create_scheduler().
+    """
+
+    def __init__(self, holders=32, seconds_per_holder=1.0, handover=30.0, protocol_change=5.0,
+                 solvent_change=5.0, lateness_weight=1.0, circular=True):
+        """
+        Arguments:
+        holders            -- number of holders on the carousel
+        seconds_per_holder -- time the carousel needs to rotate by one holder
+        handover           -- time to return a sample and insert the next one, without rotation
+        protocol_change    -- extra time when the protocol differs from the previous sample
+        solvent_change     -- extra time when the solvent differs from the previous sample
+        lateness_weight    -- seconds of overhead which are forgiven per second a timed sample
+                              is overdue
+        circular           -- True if the carousel can rotate past the last holder to the first
+        """
+        self.holders = holders
+        self.seconds_per_holder = seconds_per_holder
+        self.handover = handover
+        self.protocol_change = protocol_change
+        self.solvent_change = solvent_change
+        self.lateness_weight = lateness_weight
+        self.circular = circular
+        # time at which the samples without StartDate were first seen, {ID: timestamp}
+        self.first_seen = {}
+
+    def distance(self, a, b):
+        """
+        Number of holders the carousel has to rotate to get from holder a to holder b.
+        """
+        if a is None or b is None:
+            return self.holders / 2
+        steps = abs(a - b)
+        if self.circular:
+            steps = min(steps, self.holders - steps)
+        return steps
+
+    def cost(self, sample, context):
+        """
+        Returns the estimated overhead in seconds before the measurement of sample can start.
+        """
+        if context.loaded is not None and sample["Holder"] == context.loaded:
+            # the sample is still inside, no need to move anything.
+            cost = 0.0
+        else:
+            if context.loaded is not None:
+                # the sample inside is returned first, which moves the carousel to its holder.
+                position = context.loaded
+            else:
+                position = context.position
+            cost = self.handover + self.distance(position, sample["Holder"]) * self.seconds_per_holder
+        previous = context.previous
+        if previous is not None:
+            if sample.get("Protocol") != previous.get("Protocol") or sample.get("SampleType") != previous.get("SampleType"):
+                cost += self.protocol_change
+            if sample.get("Solvent") != previous.get("Solvent"):
+                cost += self.solvent_change
+        waiting_since = sample["StartDate"]
+        if waiting_since is None:
+            waiting_since = self.first_seen.get(sample["ID"], context.now)
+        cost -= self.lateness_weight * max(0, context.now - waiting_since)
+        return cost
+
+    def choose(self, samples, context):
+        # samples without StartDate age from the moment they were first seen
+        first_seen = {}
+        for sample in samples:
+            if sample["StartDate"] is None:
+                first_seen[sample["ID"]] = self.first_seen.get(sample["ID"], context.now)
+        self.first_seen = first_seen
+        # no sample may pass a shimming, and a shimming may not pass any sample
+        ordered = sorted(samples, key=fifo_key)
+        if ordered[0].get("SampleType") in SHIM_TYPES:
+            return ordered[0]
+        candidates = []
+        for sample in ordered:
+            if sample.get("SampleType") in SHIM_TYPES:
+                break
+            candidates.append(sample)
+        return min(candidates, key=lambda sample: (-(sample.get("Priority") or 0), self.cost(sample, context)) + fifo_key(sample))
+
+
+def fifo_key(sample):
+    """
+    Sort key of the FifoScheduler: StartDate (samples without StartDate first), then ID.
+    """
+    return (sample["StartDate"] is not None, sample["StartDate"] or 0, sample["ID"])
+
+
+def create_scheduler(config):
+    """
+    Returns the scheduler which is configured in the config table (Scheduler): a
+    CostModelScheduler for "CostModel", otherwise the FifoScheduler.
+    """
+    if (config or {}).get('Scheduler') == "CostModel":
+        return CostModelScheduler()
+    return FifoScheduler()
@@ -2,37 +2,42 @@ import socket
 import time
 import os
 import threading
-import xml.etree.ElementTree as ET
-import traceback
 import logging
 from datetime import datetime
 from MySQLReader import *
+from XmlStreamFramer import XmlStreamFramer
+from SpinsolveDataset import SpinsolveDataset
 
 class Spinsolve:
     """
     Python Magritek Spinsolve control class
     """
     
-    def __init__(self, mysql_reader):
+    def __init__(self, mysql_reader, abort_signal):
         """
         Create a Spinsolve object which will handle the communication between the spectrometer 
         and the python program.
         
         Arguments:
         mysql_reader -- a MySQLReader object with access to the config
+        abort_signal -- the AbortSignal which tells running measurements to abort
         """
         self.mysql_reader = mysql_reader
+        self.abort_signal = abort_signal
         config = self.mysql_reader.read_config()
         
-        self.NMRFolder = config['NMRFolder']
-        if self.NMRFolder[-1] != "/" and self.NMRFolder[-1] != "\\":
-            self.NMRFolder += "/"
+        self.set_nmr_folder(config['NMRFolder'])
+        self.mysql_reader.config_service.subscribe('NMRFolder', self.set_nmr_folder)
         self.socket = False
         self.protocols = False
         self.options = False
         self.last_status = 0
         self.progress = 0
         self.seconds_remaining = 0
+        # time in seconds to wait for the "completed" notification after an abort
+        self.abort_timeout = 5
+        # phases of the last measurement or shimming as (phase, start, end, detail), see Timeline
+        self.phases = []
         
         self.mysql_reader = mysql_reader
         
@@ -40,12 +45,35 @@ class Spinsolve:
         self.completed = False
         self.completed2 = False
         self.successful = False
+        # wakes up the measurement functions when a notification arrives or the queue is aborted
+        self.wakeup = threading.Event()
+        self.abort_signal.add_listener(lambda aborted: self.wakeup.set())
+        # set while the socket is connected, the listener sleeps on it otherwise.
+        self.connected = threading.Event()
+        # functions which are called when the connection changes
+        self.listeners = []
+        # functions which are called with every new progress of a measurement
+        self.progress_listeners = []
+        # counters, see stats(). the latency is the time from sending a command (Start, Abort)
+        # until the first notification which follows it.
+        self.notifications = 0
+        self.command_sent = None   # time.monotonic() of the last unanswered command
+        self.latency_count = 0
+        self.latency_sum = 0
         
         # start listener daemon which reads the status of the NMR spectrometer.
         self.listener = threading.Thread(target=self.listen, args=())
         self.listener.daemon = True
         self.listener.start()
     
+    def set_nmr_folder(self, nmr_folder):
+        """
+        Sets the folder into which the spectra are written, from the next measurement on.
+        """
+        if nmr_folder[-1] != "/" and nmr_folder[-1] != "\\":
+            nmr_folder += "/"
+        self.NMRFolder = nmr_folder
+    
     def connect(self):
         """
         Connect with the Spinsolve spectrometer.
@@ -55,23 +83,57 @@ class Spinsolve:
         nmr_ip = config['NMRIP']
         port = config['NMRPort']
         
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.socket.connect((nmr_ip, port))
-            return True
+            sock.connect((nmr_ip, port))
         except:
             logging.error("Failed to connect to Spinsolve!")
+            sock.close()
             return False
+        self.socket = sock
+        self.connected.set()
+        self.notify_listeners()
+        return True
     
     def disconnect(self):
         """
         Close the connection to the Spinsolve NMR.
         """
+        self.connected.clear()
+        try:
+            # shutdown wakes up the listener, which may be blocked in recv
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
         try:
             self.socket.close()
         except:
             pass
         self.socket = False
+        self.notify_listeners()
+        
+    def add_listener(self, callback):
+        """
+        Registers a function which is called without arguments whenever the connection to the
+        spectrometer changes.
+        The callback runs in the thread which changed the state, so it should return quickly.
+        """
+        self.listeners.append(callback)
+    
+    def add_progress_listener(self, callback):
+        """
+        Registers a function which is called with the progress (percentage) whenever a status
+        notification of the spectrometer reports a new progress of the running measurement.
+        The callback runs in the listener thread, so it should return quickly.
+        """
+        self.progress_listeners.append(callback)
+    
+    def notify_listeners(self):
+        for callback in self.listeners:
+            try:
+                callback()
+            except:
+                logging.exception("")
         
     def is_connected(self):
         """
@@ -92,11 +154,24 @@ class Spinsolve:
             # Process a status notification
             SN = root.find("StatusNotification")
             if SN != None:
+                self.notifications += 1
+                command_sent = self.command_sent
+                if command_sent is not None:
+                    self.command_sent = None
+                    self.latency_count += 1
+                    self.latency_sum += time.monotonic() - command_sent
                 # refresh the progress attribute, if available
                 Progress = SN.find("Progress")
                 if Progress != None:
-                    self.progress = Progress.get("percentage")
+                    progress = Progress.get("percentage")
                     self.seconds_remaining = int(Progress.get("secondsRemaining"))
+                    if progress != self.progress:
+                        self.progress = progress
+                        for callback in self.progress_listeners:
+                            try:
+                                callback(progress)
+                            except:
+                                logging.exception("")
                 # set a flag that the measurement was completed/successful. this will be reset by 
                 # the function which is waiting for this flag to be set.
                 if SN.find("Completed") != None:
@@ -110,46 +185,40 @@ class Spinsolve:
                     if SN.find("Completed").get("successful") == "true":
                         self.successful = True
                         logging.debug(" -- 'Successful' is True")
+                    self.wakeup.set()
                         
         while True:
-            if self.socket != False:
-                try:
-                    message = self.socket.recv(4096)
-                    message = message.decode("UTF-8")
+            self.connected.wait()
+            sock = self.socket
+            if sock == False:
+                continue
+            # every connection starts with a fresh stream of XML documents
+            framer = XmlStreamFramer()
+            try:
+                while True:
+                    # block until data arrives. messages are processed as soon as the last
+                    # byte of each document was received.
+                    message = sock.recv(4096)
+                    if not message:
+                        raise ConnectionError("Connection closed by Spinsolve.")
                     # for debugging purposes, log all messages coming form the socket
                     #with open("socket_recv.log", "a") as f:
                     #    print(str(datetime.now()) + " > ", file=f)
                     #    print(str(message) + "\n", file=f)
-                    try:
-                        root = ET.fromstring(message)
-                        #logging.debug(message)
+                    for root in framer.feed(message):
                         process_status_notification(root)
-                    except ET.ParseError:
-                        # meh some bullshit happend in the xml which was received from the spectrometer
-                        # this happens sometimes when multiple xml messages are inside of the message
-                        messages = message.split("<?xml ")
-                        messages.pop(0) # remove first string which is empty
-                        for message in messages:
-                            message = "<?xml " + message
-                            try:
-                                root = ET.fromstring(message)
-                                process_status_notification(root)
-                            except:
-                                # now this is complete bullshit, no idea what happened here, just print 
-                                # the goddamn error
-                                logging.error("Problem occured with the following message: " + str(message))
-                                traceback.print_exc()
                     # Write down the date of the contact with the spectrometer.
                     self.last_status = int(time.time())
-                except:
-                    logging.warning("It appears that the Spinsolve software is not running, has crashed or was closed by the user. Aborting...")
-                    logging.exception("")
-                    self.disconnect()
-                    conn, cur = self.mysql_reader.connect_db()
-                    if conn is not None and cur is not None:
-                        cur.execute("UPDATE QueueAbort SET QueueStat = 0")
-                        conn.close()
-            time.sleep(0.2)
+            except:
+                if not self.connected.is_set() or sock is not self.socket:
+                    # the socket was closed on purpose (disconnect button, or reconnect).
+                    # disconnect() clears connected before it shuts the socket down, but
+                    # replaces self.socket only afterwards.
+                    continue
+                logging.warning("It appears that the Spinsolve software is not running, has crashed or was closed by the user. Aborting...")
+                logging.exception("")
+                self.disconnect()
+                self.abort_signal.trigger("Lost connection to Spinsolve.")
     
     def shim(self, shimtype):
         """
@@ -165,6 +234,7 @@ class Spinsolve:
         tstr = time.strftime("%Y-%m-%d_%H%M%S", t)
         retval = False
         aborted = False
+        self.phases = []
         message  = self.message_set("<Sample>Shim" + tstr + "</Sample>")
         message += self.message_set("<DataFolder><UserFolder>" + self.NMRFolder + "Shim" + tstr + "</UserFolder></DataFolder>", False)
         message += ("<Message>"
@@ -172,29 +242,17 @@ class Spinsolve:
                         "<Option name='Shim' value='" + shimtype + "' />"
                       "</Start>"
                     "</Message>")
-        self.socket.send(message.encode())
+        started = time.time()
+        self.send(message)
         # check if successful
-        timeouts = {"CheckShim": 1, "QuickShim": 6, "PowerShim": 60} # in minutes
-        timeout = timeouts[shimtype]*10*60 # in 100 ms
-        i = 0
-        while i < timeout:
-            i += 1
-            timeout = i + (self.seconds_remaining + 60) * 10
-            # did anyone press the abort button?
-            queueabort = self.mysql_reader.read_queueabort()
-            if queueabort['QueueStat'] == 0 and not aborted:
-                self.abort()
-                i = timeout - 10 # Give it one second to abort.
-                aborted = True
-            if self.completed:
-                self.completed = False
-                if self.successful:
-                    self.successful = False
-                    SuccessFile = self.NMRFolder + "Shim" + tstr + "/protocol.par"
-                    if os.path.isfile(SuccessFile):
-                        retval = True
-                break
-            time.sleep(0.1)
+        completed, aborted = self.wait_for_completion()
+        self.phases.append(("acquisition", started, time.time(), shimtype))
+        if completed:
+            if self.successful:
+                self.successful = False
+                SuccessFile = self.NMRFolder + "Shim" + tstr + "/protocol.par"
+                if os.path.isfile(SuccessFile):
+                    retval = True
         self.progress = 0    # reset progress
         self.seconds_remaining = 0
         return retval, aborted
@@ -220,6 +278,7 @@ class Spinsolve:
         aborted = False
         self.progress = 0
         self.seconds_remaining = 0
+        self.phases = []
         # add the general stuff, which is needed for every protocol.
         # Sample name
         message  = self.message_set("<Sample>" + name + "</Sample>")
@@ -236,44 +295,75 @@ class Spinsolve:
             message += "<Option name='" + option + "' value='" + str(options[option]) + "'/>"
         message +=   "</Start>"
         message += "</Message>"
-        self.socket.send(message.encode())
+        started = time.time()
+        self.send(message)
         # now wait for the measurement to finish...
-        timeout = 60*48 # in minutes
-        timeout = timeout*10*60 # in 100 ms
-        i = 0
-        while i < timeout:
-            i += 1
-            timeout = i + (self.seconds_remaining + 60) * 10
+        completed, aborted = self.wait_for_completion()
+        completed_at = time.time()
+        self.phases.append(("acquisition", started, completed_at, protocol))
+        if completed:
+            # sometimes there is a delay on slow computers here, need timeout here
+            for j in range(10): # 10x100 ms = 1 sec
+                if self.successful == True:
+                    break
+                time.sleep(0.1)
+            if self.successful:
+                self.successful = False
+                # wait for a few seconds, sometimes spinsolve is kind of slow when generating the files.
+                # the spectrum should also be written completely (file size matches its header).
+                # if the data type of the file is unknown, its size can not be checked (None).
+                dataset = SpinsolveDataset(self.NMRFolder + name)
+                for j in range(10): # 10 seconds maximum
+                    if dataset.is_complete("spectrum.1d") is not False:
+                        retval = True
+                        break
+                    time.sleep(1)
+                else:
+                    if os.path.isfile(dataset.path("spectrum.1d")):
+                        logging.warning("The size of spectrum.1d of " + name + " does not match its header.")
+                        retval = True
+            self.phases.append(("completion_files", completed_at, time.time(), None))
+        elif not aborted:
+            logging.error("Measurement failed due to timeout.")
+        self.progress = 0    # reset progress
+        self.seconds_remaining = 0
+        return retval, aborted
+    
+    def wait_for_completion(self):
+        """
+        Blocks until the spectrometer reports that the running measurement is completed.
+        If the abort signal is raised in the meantime, the measurement is aborted, and the 
+        function keeps waiting for the "completed" notification which follows the abort.
+        The measurement is considered as timed out if the spectrometer stays silent for longer 
+        than the remaining measurement time plus one minute, or, after an abort, if it does not
+        confirm the abort within abort_timeout seconds.
+        
+        Returns two booleans:
+            completed -- True if the measurement was completed, False if it timed out.
+            aborted -- True if the measurement was aborted by user, False otherwise.
+        """
+        aborted = False
+        started = time.time()
+        while True:
             # did anyone press the abort button?
-            queueabort = self.mysql_reader.read_queueabort()
-            if queueabort['QueueStat'] == 0 and not aborted:
+            if self.abort_signal.is_set() and not aborted:
                 logging.info("Detected abort signal!")
                 self.abort()
-                i = timeout - 10 # Give it one second to abort.
                 aborted = True
+                abort_deadline = time.time() + self.abort_timeout
             if self.completed:
                 self.completed = False
-                # sometimes there is a delay on slow computers here, need timeout here
-                for j in range(10): # 10x100 ms = 1 sec
-                    if self.successful == True:
-                        break
-                    time.sleep(0.1)
-                if self.successful:
-                    self.successful = False
-                    # wait for a few seconds, sometimes spinsolve is kind of slow when generating the files.
-                    SuccessFile = self.NMRFolder + name + "/spectrum.1d"
-                    for j in range(10): # 10 seconds maximum
-                        if os.path.isfile(SuccessFile):
-                            retval = True
-                            break
-                        time.sleep(1)
-                break
-            time.sleep(0.1)
-        else:
-            logging.error(f"Measurement failed due to timeout. i={i}, timeout={timeout}")
-        self.progress = 0    # reset progress
-        self.seconds_remaining = 0
-        return retval, aborted
+                return True, aborted
+            if aborted:
+                remaining = abort_deadline - time.time()
+            else:
+                remaining = max(started, self.last_status) + self.seconds_remaining + 60 - time.time()
+            if remaining <= 0:
+                if aborted:
+                    logging.warning("The Spinsolve did not confirm the abort within " + str(self.abort_timeout) + " seconds.")
+                return False, aborted
+            self.wakeup.wait(remaining)
+            self.wakeup.clear()
     
     def abort(self):
         """
@@ -286,10 +376,25 @@ class Spinsolve:
                        "<Message>"
                          "<Abort />"
                        "</Message>")
-            self.socket.send(message.encode())
+            self.send(message)
         except:
             pass
     
+    def send(self, message):
+        """
+        Sends a command (XML string) to the spectrometer.
+        """
+        self.command_sent = time.monotonic()
+        self.socket.send(message.encode())
+    
+    def stats(self):
+        """
+        Returns the counters of the communication with the spectrometer as a dictionary
+        (connected, last_status, notifications, latency_count, latency_sum in seconds).
+        """
+        return {"connected": self.is_connected(), "last_status": self.last_status, "notifications": self.notifications,
+                "latency_count": self.latency_count, "latency_sum": self.latency_sum}
+    
     def message_set(self, message, doctype=True):
         """
         Helper function which generates the following XML code (used many times to send stuff to
@@ -0,0 +1,222 @@
+import os
+import struct
+
+class SpinsolveDataset:
+    """
+    Read-only access to an output folder of the Spinsolve software.
+
+    The binary files (data.1d with the FID, spectrum.1d with the spectrum) are memory-mapped
+    when they are first accessed, and the FID, the spectrum and their axes are numpy views
+    into the mapping. Nothing is copied into memory, the operating system pages the data in
+    when it is read and can drop it again at any time, so that even thousands of datasets can
+    be processed in bounded memory. The parameter files (acqu.par, protocol.par) are parsed
+    on first access as well.
+
+    Format of the binary files (little endian):
+    32 bytes header -- 8 int32: owner, format, version, data type, xDim, yDim, zDim, qDim
+    axis            -- xDim float32 values (time in the FID, frequency/ppm in the spectrum),
+                       only for the XY data types
+    data            -- xDim * yDim * zDim * qDim values of the data type
+
+    Files with a data type which is not in DATA_TYPES are rejected: is_complete() returns
+    None for them, and reading their data raises a ValueError.
+
+    numpy is only imported when the data is read, so that the check of the files after a
+    measurement (is_complete, see Spinsolve.measure_sample) works without it.
+    """
+
+    HEADER = struct.Struct("<8i")
+    # data type of the header -> (dtype of the data, dtype of the axis or None)
+    DATA_TYPES = {
+        500: ("<f4", None),    # float
+        501: ("<c8", None),    # complex
+        502: ("<f8", None),    # double
+        503: ("<f4", "<f4"),   # XY, float
+        504: ("<c8", "<f4"),   # XY, complex
+    }
+    # size in bytes of the values of the dtypes in DATA_TYPES
+    ITEM_SIZES = {"<f4": 4, "<c8": 8, "<f8": 8}
+
+    def __init__(self, folder):
+        """
+        Arguments:
+        folder -- path of the output folder of a measurement
+        """
+        self.folder = folder
+        self.name = os.path.basename(os.path.normpath(folder))
+        self._maps = {}
+        self._parameters = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Drops the references to the memory maps and parsed parameters. The mappings are
+        released as soon as no view into them (e.g. a returned FID array) is left.
+        """
+        self._maps = {}
+        self._parameters = {}
+
+    @classmethod
+    def find(cls, nmr_folder):
+        """
+        Yields a SpinsolveDataset for every folder directly inside nmr_folder which contains
+        a spectrum.1d or data.1d, in alphabetical order.
+        """
+        try:
+            entries = sorted(os.scandir(nmr_folder), key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir() and (os.path.isfile(os.path.join(entry.path, "spectrum.1d")) or os.path.isfile(os.path.join(entry.path, "data.1d"))):
+                yield cls(entry.path)
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def header(self, filename="spectrum.1d"):
+        """
+        Returns the header of a binary file as dictionary, or None if the file is missing or
+        shorter than the header.
+        """
+        try:
+            with open(self.path(filename), "rb") as binary_file:
+                raw = binary_file.read(self.HEADER.size)
+        except OSError:
+            return None
+        if len(raw) < self.HEADER.size:
+            return None
+        values = self.HEADER.unpack(raw)
+        return dict(zip(("owner", "format", "version", "data_type", "x_dim", "y_dim", "z_dim", "q_dim"), values))
+
+    def _layout(self, header, size):
+        """
+        Returns the dtypes and numbers of points of the axis and of the data of a binary file
+        with the given header and file size, as (axis dtype, axis points, data dtype, data
+        points), or None if the size does not fit the header (e.g. the file is still being
+        written). Raises ValueError if the data type is unknown.
+        """
+        if header["data_type"] not in self.DATA_TYPES:
+            raise ValueError("Unknown data type " + str(header["data_type"]))
+        data_dtype, axis_dtype = self.DATA_TYPES[header["data_type"]]
+        points = header["x_dim"] * max(header["y_dim"], 1) * max(header["z_dim"], 1) * max(header["q_dim"], 1)
+        axis_points = header["x_dim"] if axis_dtype is not None else 0
+        expected = axis_points * self.ITEM_SIZES.get(axis_dtype, 0) + points * self.ITEM_SIZES[data_dtype]
+        if size - self.HEADER.size != expected:
+            return None
+        return axis_dtype, axis_points, data_dtype, points
+
+    def is_complete(self, filename="spectrum.1d"):
+        """
+        Returns True if the binary file exists and has the size announced in its header, False
+        if it is missing or incomplete, and None if its data type is unknown (then the size
+        can not be checked).
+        """
+        header = self.header(filename)
+        if header is None:
+            return False
+        try:
+            return self._layout(header, os.path.getsize(self.path(filename))) is not None
+        except ValueError:
+            return None
+
+    def _map(self, filename):
+        """
+        Returns (axis, data) of a binary file as views into its memory map.
+        """
+        if filename not in self._maps:
+            import numpy as np
+            header = self.header(filename)
+            if header is None:
+                raise FileNotFoundError("No valid " + filename + " in " + self.folder)
+            layout = self._layout(header, os.path.getsize(self.path(filename)))
+            if layout is None:
+                raise ValueError(filename + " in " + self.folder + " does not match its header")
+            axis_dtype, axis_points, data_dtype, points = layout
+            mapped = np.memmap(self.path(filename), dtype=np.uint8, mode="r")
+            offset = self.HEADER.size
+            axis = None
+            if axis_points:
+                axis_bytes = axis_points * self.ITEM_SIZES[axis_dtype]
+                axis = mapped[offset:offset + axis_bytes].view(axis_dtype)
+                offset += axis_bytes
+            data = mapped[offset:offset + points * self.ITEM_SIZES[data_dtype]].view(data_dtype)
+            shape = [n for n in (header["q_dim"], header["z_dim"], header["y_dim"]) if n > 1] + [header["x_dim"]]
+            self._maps[filename] = axis, data.reshape(shape)
+        return self._maps[filename]
+
+    @property
+    def fid(self):
+        """
+        The FID (data.1d) as read-only array (complex64 for complex data).
+        """
+        return self._map("data.1d")[1]
+
+    @property
+    def time_axis(self):
+        """
+        The time axis of the FID (data.1d) as read-only float32 array, or None.
+        """
+        return self._map("data.1d")[0]
+
+    @property
+    def spectrum(self):
+        """
+        The spectrum (spectrum.1d) as read-only array (complex64 for complex data).
+        """
+        return self._map("spectrum.1d")[1]
+
+    @property
+    def frequency_axis(self):
+        """
+        The axis of the spectrum (spectrum.1d) as read-only float32 array, or None.
+        """
+        return self._map("spectrum.1d")[0]
+
+    @property
+    def acqu(self):
+        """
+        The acquisition parameters (acqu.par) as dictionary.
+        """
+        return self.parameters("acqu.par")
+
+    @property
+    def protocol(self):
+        """
+        The protocol parameters (protocol.par) as dictionary.
+        """
+        return self.parameters("protocol.par")
+
+    def parameters(self, filename):
+        """
+        Parses a parameter file with lines of the form 'key = value' into a dictionary, and
+        caches it. Quoted values are returned as strings, numbers as int or float.
+        Returns an empty dictionary if the file does not exist.
+        """
+        if filename not in self._parameters:
+            parameters = {}
+            try:
+                with open(self.path(filename), "r", encoding="latin-1") as par_file:
+                    for line in par_file:
+                        key, separator, value = line.partition("=")
+                        if separator:
+                            parameters[key.strip()] = self._convert(value.strip())
+            except OSError:
+                pass
+            self._parameters[filename] = parameters
+        return self._parameters[filename]
+
+    @staticmethod
+    def _convert(value):
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            return value[1:-1]
+        for number in (int, float):
+            try:
+                return number(value)
+            except ValueError:
+                pass
+        return value
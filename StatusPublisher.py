@@ -0,0 +1,62 @@
+import threading
+import time
+
+class StatusPublisher:
+    """
+    Writes the status of the Autosampler into the as_status table, so that the webinterface
+    can read it.
+
+    The table is only written when the status changes, and otherwise once per heartbeat
+    interval to refresh last_contact. publish() only hands over the new status and returns
+    immediately, so the serial listener is never held up by a slow MySQL server. The writes
+    are handed to the DbWriter of the MySQLReader; if the status changes several times before
+    they are written, only the latest status is written.
+    """
+
+    STATEMENT = "UPDATE as_status SET as_status = %s, last_contact = %s"
+
+    def __init__(self, mysql_reader, heartbeat=5):
+        """
+        Create a StatusPublisher and start its thread.
+
+        Arguments:
+        mysql_reader -- a MySQLReader object
+        heartbeat    -- time in seconds after which last_contact is refreshed even if the
+                        status has not changed
+        """
+        self.mysql_reader = mysql_reader
+        self.heartbeat = heartbeat
+        self._cond = threading.Condition()
+        self._status = None    # latest status handed over by publish()
+        self._written = None   # status which was last handed to the DbWriter
+        self._last_write = 0   # time.monotonic() of the last write
+
+        self.writer = threading.Thread(target=self.run, args=())
+        self.writer.daemon = True
+        self.writer.start()
+
+    def publish(self, status):
+        """
+        Hands over the current status of the Autosampler. Never blocks.
+        """
+        with self._cond:
+            if status != self._status:
+                self._status = status
+                self._cond.notify()
+
+    def run(self):
+        """
+        Background process which hands the status to the DbWriter when it has changed, or
+        when the heartbeat is due.
+        """
+        while True:
+            with self._cond:
+                while True:
+                    due = self._last_write + self.heartbeat - time.monotonic()
+                    if self._status is not None and (self._status != self._written or due <= 0):
+                        break
+                    self._cond.wait(due if due > 0 else self.heartbeat)
+                status = self._status
+                self._written = status
+                self._last_write = time.monotonic()
+            self.mysql_reader.writer.submit(("as_status",), self.STATEMENT, (status, int(time.time())))
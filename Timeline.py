@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import json
+import logging
+import sys
+import time
+
+class Timeline:
+    """
+    Records how long every sample spends in each phase of the queue and of the automatic
+    evaluation, as spans in the sample_timings table (see Migrations).
+
+    Phases of the queue (QueueEngine): insert, acquisition, completion_files (waiting for the
+    spectrum files after the Spinsolve reported completion), bookkeeping (DB writes deferred
+    while the sample is returned) and return. Phases of the evaluation (EvaluationQueue and
+    AcdMacro): evaluation_wait (in the evaluation queue), specman, cache_restore and evaluate.
+
+    The spans are written in the background by the DbWriter, so recording one costs no query.
+    export() writes them in the Chrome trace format (chrome://tracing, Perfetto), with one row
+    per sample.
+    """
+
+    INSERT = ("INSERT INTO sample_timings (SampleID, SampleName, Phase, Detail, Start, End) "
+              "VALUES (%s, %s, %s, %s, %s, %s)")
+
+    def __init__(self, mysql_reader):
+        """
+        Arguments:
+        mysql_reader -- a MySQLReader object
+        """
+        self.mysql_reader = mysql_reader
+        # functions which are called with every recorded span
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """
+        Registers a function which is called with every recorded span as dictionary (SampleID,
+        SampleName, Phase, Detail, Start, End). The callback runs in the thread which recorded
+        the span, so it should return quickly.
+        """
+        self.listeners.append(callback)
+
+    def record(self, sample_id, sample_name, phase, start, end, detail=None):
+        """
+        Records a span.
+
+        Arguments:
+        sample_id   -- ID of the sample, or None if only the name is known (evaluation)
+        sample_name -- name of the sample
+        phase       -- name of the phase, see the class description
+        start, end  -- timestamps (time.time()) of the beginning and the end of the phase
+        detail      -- optional text, e.g. the type of a shimming
+        """
+        self.mysql_reader.writer.submit(None, self.INSERT, (sample_id, sample_name, phase, detail, start, end))
+        span = {"SampleID": sample_id, "SampleName": sample_name, "Phase": phase, "Detail": detail, "Start": start, "End": end}
+        for callback in self.listeners:
+            try:
+                callback(span)
+            except:
+                logging.exception("")
+
+    def record_phases(self, sample_id, sample_name, phases):
+        """
+        Records a list of (phase, start, end, detail) tuples, e.g. Spinsolve.phases.
+        """
+        for phase, start, end, detail in phases:
+            self.record(sample_id, sample_name, phase, start, end, detail)
+
+    @contextlib.contextmanager
+    def span(self, sample_id, sample_name, phase, detail=None):
+        """
+        Records the time spent in the with block as span. Works in coroutines as well.
+
+            with timeline.span(sample["ID"], sample["Name"], "insert"):
+                ...
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(sample_id, sample_name, phase, start, time.time(), detail)
+
+    def read(self, since=None, until=None, sample_ids=None):
+        """
+        Returns the spans which started within the given time (timestamps), optionally only of
+        some samples, as list of dictionaries ordered by their start.
+        """
+        conditions = []
+        args = []
+        if since is not None:
+            conditions.append("Start >= %s")
+            args.append(since)
+        if until is not None:
+            conditions.append("Start < %s")
+            args.append(until)
+        if sample_ids:
+            # the spans of the evaluation only have the name of the sample
+            placeholders = ", ".join(["%s"] * len(sample_ids))
+            conditions.append("(SampleID IN (" + placeholders + ") OR (SampleID IS NULL AND SampleName IN "
+                              "(SELECT Name FROM samples WHERE ID IN (" + placeholders + "))))")
+            args.extend(sample_ids)
+            args.extend(sample_ids)
+        query = "SELECT SampleID, SampleName, Phase, Detail, Start, End FROM sample_timings"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY Start ASC, ID ASC"
+        conn, cur = self.mysql_reader.connect_db()
+        if conn is None:
+            raise ConnectionError("No connection to the MySQL DB.")
+        try:
+            cur.execute(query, args)
+            return list(cur.fetchall())
+        finally:
+            conn.close()
+
+    @staticmethod
+    def chrome_trace(spans):
+        """
+        Converts spans into a Chrome trace (JSON object format): one complete event ("X") per
+        span, and one row (thread) per sample, named after the sample. The spans of the
+        evaluation, which only know the sample name, are shown in the row of that sample.
+        """
+        rows = {}
+        events = []
+        for span in spans:
+            name = span["SampleName"]
+            if name not in rows:
+                rows[name] = len(rows) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": rows[name],
+                               "args": {"name": name if span["SampleID"] is None else name + " (ID " + str(span["SampleID"]) + ")"}})
+            args = {"sample_id": span["SampleID"]}
+            if span["Detail"]:
+                args["detail"] = span["Detail"]
+            events.append({"name": span["Phase"], "cat": "evaluation" if span["SampleID"] is None else "queue", "ph": "X",
+                           "pid": 1, "tid": rows[name], "ts": int(span["Start"] * 1e6),
+                           "dur": max(int((span["End"] - span["Start"]) * 1e6), 0), "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, filename, since=None, until=None, sample_ids=None):
+        """
+        Writes the spans as Chrome trace into a JSON file, see chrome_trace().
+        Returns the number of spans.
+        """
+        spans = self.read(since, until, sample_ids)
+        with open(filename, "w") as trace_file:
+            json.dump(self.chrome_trace(spans), trace_file)
+        return len(spans)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports the timings of the samples as Chrome trace (chrome://tracing, Perfetto).")
+    parser.add_argument("output", help="name of the JSON file")
+    parser.add_argument("--hours", type=float, default=24, help="only the spans of the last hours (ignored with --sample)")
+    parser.add_argument("--sample", type=int, action="append", help="only the spans of this sample ID (repeatable)")
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-passwd", default="")
+    parser.add_argument("--mysql-host", default="localhost")
+    parser.add_argument("--mysql-db", default="autosampler")
+    args = parser.parse_args()
+
+    from MySQLReader import MySQLReader
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    mysql_reader = MySQLReader(args.mysql_user, args.mysql_passwd, args.mysql_host, args.mysql_db, "")
+    since = None if args.sample else time.time() - args.hours * 3600
+    count = Timeline(mysql_reader).export(args.output, since, None, args.sample)
+    logging.info("Exported " + str(count) + " spans to " + args.output + ".")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
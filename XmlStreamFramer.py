@@ -0,0 +1,102 @@
+import logging
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+class XmlStreamFramer:
+    """
+    Splits a stream of concatenated XML documents (as sent by the Spinsolve software) into
+    single documents.
+
+    The received bytes are fed into an incremental expat parser, which builds the element tree
+    while the data is arriving. As soon as the root element of a document is closed, the
+    document is returned, and the bytes which follow it are fed into a fresh parser. Documents
+    may therefore be split at any byte, including in the middle of a multi-byte character, or
+    several documents may arrive in the same chunk.
+    """
+
+    def __init__(self):
+        self._new_document()
+
+    def feed(self, data):
+        """
+        Feeds received bytes into the framer.
+
+        Arguments:
+        data -- bytes received from the socket
+
+        Returns a list of the root elements of all documents which were completed by this chunk,
+        in the order in which they were received.
+        """
+        documents = []
+        while data:
+            if not self._pending:
+                # no whitespace is allowed in front of the XML declaration
+                data = data.lstrip()
+                if not data:
+                    break
+            self._pending += data
+            try:
+                self._parser.Parse(data, False)
+            except expat.ExpatError as e:
+                if self._root is None:
+                    # the document is broken. skip to the beginning of the next one.
+                    logging.error("Problem occured with the following message: " + self._pending.decode("UTF-8", "replace"))
+                    logging.error(str(e))
+                    data = self._resync()
+                    continue
+                # otherwise the error was raised by the start of the next document, which
+                # expat considers as junk after the current one.
+            if self._root is None:
+                # document is not complete yet, wait for more data
+                break
+            documents.append(self._root)
+            # the end handler reports the position of the root's end tag, the next document
+            # starts behind its closing bracket. for an empty root element ("<Message/>"), expat
+            # reports the position behind the tag instead.
+            end = self._root_end
+            if self._pending.startswith(b"</", end):
+                end = self._pending.find(b">", end) + 1
+            data = self._pending[end:]
+            self._new_document()
+        return documents
+
+    def _new_document(self):
+        """
+        Sets up a fresh parser for the next document.
+        """
+        self._pending = b""     # all bytes which were fed into the current parser
+        self._builder = ET.TreeBuilder()
+        self._depth = 0
+        self._root = None
+        self._root_end = 0
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._builder.data
+
+    def _resync(self):
+        """
+        Drops the current (broken) document and returns the data from the beginning of the next
+        XML declaration on, or no data if there is none yet.
+        """
+        start = self._pending.find(b"<?xml", 1)
+        if start < 0:
+            # keep a possible beginning of "<?xml" at the end of the buffer
+            start = max(self._pending.rfind(b"<"), 1)
+            if not b"<?xml".startswith(self._pending[start:]):
+                start = len(self._pending)
+        data = self._pending[start:]
+        self._new_document()
+        return data
+
+    def _start(self, tag, attrib):
+        self._depth += 1
+        self._builder.start(tag, attrib)
+
+    def _end(self, tag):
+        self._depth -= 1
+        element = self._builder.end(tag)
+        if self._depth == 0:
+            self._root = element
+            self._root_end = self._parser.CurrentByteIndex
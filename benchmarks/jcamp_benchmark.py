@@ -0,0 +1,69 @@
+"""
+Benchmark of the JCAMP-DX reader on a synthetic 1D spectrum.
+
+Writes a spectrum with the given number of points in DIFDUP and in AFFN form, and reports the
+time needed to parse each of them, and to look up the integrals of a method.
+
+Usage:
+    python benchmarks/jcamp_benchmark.py [--points 131072] [--repeat 20] [--seed 1]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Jcamp import Jcamp
+
+
+def make_spectrum(rng, points):
+    """
+    Builds a Jcamp document with a noisy spectrum of a few lorentzian peaks, and an ACD
+    integral table of 50 intervals.
+    """
+    x = np.linspace(200.0, -200.0, points)
+    y = rng.normal(0, 50, points)
+    for center in rng.uniform(-180, 180, 12):
+        y += 1e6 / (1 + ((x - center) / 0.05) ** 2)
+    begin = np.round(rng.uniform(-190, 190, 50), 4)
+    table = "\n".join("({},{},{})".format(b, b - 0.5, v) for b, v in zip(begin, rng.uniform(1, 100, 50)))
+    jcamp = Jcamp.parse("##TITLE=benchmark\n##JCAMP-DX=5.01\n##$INTEGRALS=ACDTABLE(X1,X2,LogValue)\n" + table + "\n##END=\n")
+    jcamp.x = x
+    jcamp.data["Y"] = np.rint(y)
+    return jcamp, begin
+
+
+def best_of(repeat, function):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--points", type=int, default=131072)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    jcamp, begin = make_spectrum(rng, args.points)
+    result = {"points": args.points}
+    for mode in ("DIFDUP", "AFFN"):
+        text = jcamp.to_string(mode)
+        parsed = Jcamp.parse(text)
+        assert len(parsed.y) == args.points and np.allclose(parsed.y, jcamp.y)
+        result[mode] = {"file_size_kb": round(len(text) / 1024),
+                        "parse_ms": round(best_of(args.repeat, lambda: Jcamp.parse(text)) * 1000, 2)}
+    parsed = Jcamp.parse(jcamp.to_string())
+    result["match_integrals_ms"] = round(best_of(args.repeat, lambda: parsed.match_integrals(begin + 1e-4, begin - 0.5)) * 1000, 3)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
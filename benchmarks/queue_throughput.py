@@ -0,0 +1,337 @@
+"""
+End-to-end throughput benchmark of the queue, on simulated hardware.
+
+Runs the real Queue (QueueEngine, Autosampler, Spinsolve, AbortSignal, MySQLReader) against the
+virtual Autosampler and the fake Spinsolve of the simulator package, on a scratch database,
+with synthetic workloads:
+- mixed:    every sample in another holder,
+- repeated: groups of samples in the same holder, which stay in the spectrometer,
+- shim:     a CheckShim before every few samples; the shimmings fail with the given
+            probability, which escalates them to QuickShims,
+- acd:      like mixed, with an automatic evaluation of every sample. The ACD NMR Processor
+            is simulated by a process which keeps one CPU core busy for --acd-seconds.
+For every workload, the result contains the samples per hour and the overhead per sample
+beyond the acquisition time (overhead_s), and the part of it which is neither acquisition nor
+movement of the Autosampler (software_overhead_s). All times are wall-clock seconds of the
+simulation, i.e. the hardware times are multiplied by --time-scale.
+The abort latency is measured for an abort from the GUI (AbortSignal.trigger) and from the
+webinterface (QueueStat = 0 in the database): the time until the Spinsolve receives the abort,
+and the time until the sample is marked as Failed.
+
+The result is printed as JSON. If a baseline file exists (see --baseline), the result is
+compared with it; --save-baseline stores the result as new baseline instead. Only results with
+the same parameters are comparable.
+
+Requires Linux (pty), a MySQL server and the right to create databases.
+
+Usage:
+    python benchmarks/queue_throughput.py [--workloads mixed,repeated,shim,acd] [--samples 12] [--time-scale 0.02]
+    python benchmarks/queue_throughput.py --save-baseline
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import MySQLdb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from MySQLReader import MySQLReader
+from Migrations import Migrations
+from Autosampler import Autosampler
+from AbortSignal import AbortSignal
+from Spinsolve import Spinsolve
+from Queue import Queue
+from EvaluationQueue import EvaluationQueue
+from simulator import VirtualAutosampler, FakeSpinsolve
+from samples_benchmark import CREATE_SAMPLES
+
+SCHEMA = [
+    CREATE_SAMPLES,
+    "CREATE TABLE shimming (Shimming INT NOT NULL, LastShim INT NOT NULL, ShimProgress INT NOT NULL)",
+    "INSERT INTO shimming VALUES (0, 0, 0)",
+    "CREATE TABLE queueabort (QueueStat INT NOT NULL)",
+    "INSERT INTO queueabort VALUES (0)",
+    "CREATE TABLE as_status (as_status INT NOT NULL, last_contact INT NOT NULL)",
+    "INSERT INTO as_status VALUES (-1, 0)",
+    "CREATE TABLE config (ASPort VARCHAR(255), NMRIP VARCHAR(255), NMRPort INT, NMRFolder VARCHAR(255), "
+    "ACDFolder VARCHAR(255), ACDWorkers INT, EvaluationCacheFolder VARCHAR(255))",
+    "CREATE TABLE protocols (protocolid INT NOT NULL PRIMARY KEY, xmlKey VARCHAR(64))",
+    "INSERT INTO protocols VALUES (1, '1D PROTON')",
+    "CREATE TABLE protocol_properties (propid INT NOT NULL PRIMARY KEY, friendlyName VARCHAR(64), xmlKey VARCHAR(64))",
+    "INSERT INTO protocol_properties VALUES (1, 'Scan', 'Scan')",
+    "CREATE TABLE sample_properties (samplepropid INT NOT NULL AUTO_INCREMENT PRIMARY KEY, sampleid INT, propid INT, strvalue VARCHAR(64))",
+    "CREATE TABLE nuclei (Mass INT NOT NULL PRIMARY KEY, Name VARCHAR(8))",
+    "INSERT INTO nuclei VALUES (1, '1H')",
+    "CREATE TABLE methods (ID INT NOT NULL PRIMARY KEY, Name VARCHAR(64), Nucleus INT)",
+    "INSERT INTO methods VALUES (1, 'Benchmark', 1)",
+    "CREATE TABLE peaks (ID INT NOT NULL AUTO_INCREMENT PRIMARY KEY, method INT, role INT, begin_ppm DOUBLE, end_ppm DOUBLE)",
+    "CREATE TABLE fnmr_standards (ID INT NOT NULL PRIMARY KEY, Name VARCHAR(64))",
+]
+
+# metrics of the comparison with the baseline: (True if higher is better, smallest absolute
+# change which counts as regression). the abort from the database depends on the phase of the
+# 0.5 s poll of the AbortSignal, so its latencies vary by a few hundred ms.
+METRICS = {"samples_per_hour": (True, 0), "overhead_s": (False, 0.02), "software_overhead_s": (False, 0.02),
+           "spinsolve_ms": (False, 100), "failed_ms": (False, 100)}
+
+
+class SimulatedEvaluationQueue(EvaluationQueue):
+    """
+    EvaluationQueue whose jobs run a process which keeps one CPU core busy, instead of the
+    ACD NMR Processor. Like AcdMacro, samples without a method are not evaluated.
+    """
+
+    def __init__(self, mysql_reader, seconds, workers=1):
+        self.seconds = seconds
+        EvaluationQueue.__init__(self, mysql_reader, workers)
+
+    def run_job(self, job):
+        if job["Method"]:
+            subprocess.run([sys.executable, "-c", "import time\nend = time.time() + " + repr(self.seconds) + "\nwhile time.time() < end: pass"])
+        self.finish(job, "Finished")
+
+
+def workload(name, count, rng, group=3, shim_every=4):
+    """
+    Returns the samples of a workload as list of (Holder, SampleType, Method).
+    """
+    holders = list(range(1, 32))
+    rng.shuffle(holders)
+    samples = []
+    if name == "repeated":
+        for i in range(count):
+            samples.append((holders[(i // group) % len(holders)], "Sample", None))
+    elif name == "shim":
+        for i in range(count):
+            if i % shim_every == 0:
+                samples.append((holders[i % len(holders)], "CheckShim", None))
+            else:
+                samples.append((holders[i % len(holders)], "Sample", None))
+    else:
+        for i in range(count):
+            samples.append((holders[i % len(holders)], "Sample", 1 if name == "acd" else None))
+    return samples
+
+
+def queue_samples(mysql_reader, samples, scan):
+    with mysql_reader.transaction() as cur:
+        cur.execute("DELETE FROM samples")
+        cur.execute("DELETE FROM sample_properties")
+        for i, (holder, sample_type, method) in enumerate(samples):
+            cur.execute("INSERT INTO samples (Name, Holder, Status, StartDate, SampleType, Protocol, Solvent, Method) "
+                        "VALUES (%s, %s, 'Queued', NULL, %s, 1, 'CDCl3', %s)",
+                        ("B-" + str(int(time.time() * 1000)) + "-" + str(i), holder, sample_type, method))
+            cur.execute("INSERT INTO sample_properties (sampleid, propid, strvalue) VALUES (%s, 1, %s)", (cur.lastrowid, scan))
+
+
+def count_samples(mysql_reader, statuses):
+    conn, cur = mysql_reader.connect_db()
+    try:
+        cur.execute("SELECT COUNT(*) AS n FROM samples WHERE Status IN (" + ", ".join(["%s"] * len(statuses)) + ")", statuses)
+        return cur.fetchone()["n"]
+    finally:
+        conn.close()
+
+
+def wait_until(condition, timeout, interval=0.005):
+    """
+    Polls condition until it is True. Returns the time at which it became True.
+    """
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise TimeoutError("The queue did not finish within " + str(timeout) + " seconds.")
+        time.sleep(interval)
+    return time.perf_counter()
+
+
+def wait_for_idle(queue, timeout):
+    wait_until(lambda: queue.abort_signal.is_set() and queue.engine.sample is None and queue.engine.state == queue.engine.IDLE
+               and queue.autosampler.errorcode in (0, 3), timeout, 0.05)
+
+
+def run_workload(stack, name, args, rng):
+    queue, virtual_autosampler, fake_spinsolve = stack["queue"], stack["autosampler"], stack["spinsolve"]
+    mysql_reader = queue.mysql_reader
+    fake_spinsolve.shim_failure_rate = args.shim_failure_rate if name == "shim" else 0.0
+    wait_for_idle(queue, args.timeout)
+    samples = workload(name, args.samples, rng)
+    queue_samples(mysql_reader, samples, args.scan)
+    spinsolve_before, autosampler_before = dict(fake_spinsolve.counters), dict(virtual_autosampler.counters)
+    evaluations_before = evaluation_count(mysql_reader)
+
+    start = time.perf_counter()
+    queue.abort_signal.release()
+    end = wait_until(lambda: count_samples(mysql_reader, ("Queued", "Running")) == 0 and queue.engine.sample is None, args.timeout, 0.02)
+    wall = end - start
+    if name == "acd":
+        # the evaluations run in the background, the queue does not wait for them
+        wait_until(lambda: evaluation_count(mysql_reader) - evaluations_before >= len(samples), args.timeout, 0.1)
+
+    acquisition = fake_spinsolve.counters["busy_seconds"] - spinsolve_before["busy_seconds"]
+    motion = virtual_autosampler.counters["busy_seconds"] - autosampler_before["busy_seconds"]
+    finished = count_samples(mysql_reader, ("Finished",))
+    return {"samples": len(samples),
+            "finished": finished,
+            "failed": count_samples(mysql_reader, ("Failed",)),
+            "shims": fake_spinsolve.counters["shims"] - spinsolve_before["shims"],
+            "insertions": virtual_autosampler.counters["insertions"] - autosampler_before["insertions"],
+            "wall_s": round(wall, 3),
+            "acquisition_s": round(acquisition, 3),
+            "motion_s": round(motion, 3),
+            "samples_per_hour": round(finished / wall * 3600, 1),
+            "overhead_s": round((wall - acquisition) / len(samples), 3),
+            "software_overhead_s": round((wall - acquisition - motion) / len(samples), 3),
+            "evaluations": evaluation_count(mysql_reader) - evaluations_before}
+
+
+def evaluation_count(mysql_reader):
+    conn, cur = mysql_reader.connect_db()
+    try:
+        cur.execute("SELECT COUNT(*) AS n FROM evaluation_jobs WHERE Status = 'Finished'")
+        return cur.fetchone()["n"]
+    finally:
+        conn.close()
+
+
+def run_abort(stack, path, args):
+    """
+    Aborts a running measurement, and returns the latencies in milliseconds.
+    """
+    queue, fake_spinsolve = stack["queue"], stack["spinsolve"]
+    mysql_reader = queue.mysql_reader
+    wait_for_idle(queue, args.timeout)
+    queue_samples(mysql_reader, [(1, "Sample", None)], "PowerScan")
+    queue.abort_signal.release()
+    wait_until(fake_spinsolve.is_running, args.timeout)
+    time.sleep(0.2)
+    start = time.perf_counter()
+    if path == "gui":
+        queue.abort_queue()
+    else:
+        queue.queueabort.set(0)
+    spinsolve = wait_until(fake_spinsolve.abort_event.is_set, args.timeout, 0.001)
+    failed = wait_until(lambda: count_samples(mysql_reader, ("Failed",)) == 1, args.timeout, 0.001)
+    return {"spinsolve_ms": round((spinsolve - start) * 1000, 1), "failed_ms": round((failed - start) * 1000, 1)}
+
+
+def setup(args, nmr_folder):
+    """
+    Creates the scratch database, starts the simulators and the program. Returns the stack.
+    """
+    virtual_autosampler = VirtualAutosampler(args.time_scale, seed=args.seed)
+    fake_spinsolve = FakeSpinsolve(port=0, time_scale=args.time_scale, seed=args.seed)
+    port = virtual_autosampler.start()
+    nmr_port = fake_spinsolve.start()
+
+    mysql_reader = MySQLReader(args.mysql_user, args.mysql_passwd, args.mysql_host, args.database, "")
+    conn, cur = mysql_reader.connect_db()
+    try:
+        for statement in SCHEMA:
+            cur.execute(statement)
+        cur.execute("INSERT INTO config (ASPort, NMRIP, NMRPort, NMRFolder, ACDFolder, ACDWorkers, EvaluationCacheFolder) "
+                    "VALUES (%s, '127.0.0.1', %s, %s, '', %s, %s)",
+                    (port, nmr_port, nmr_folder, args.acd_workers, os.path.join(nmr_folder, "evaluation_cache")))
+    finally:
+        conn.close()
+    Migrations(mysql_reader).migrate()
+
+    autosampler = Autosampler(mysql_reader)
+    abort_signal = AbortSignal(mysql_reader)
+    spinsolve = Spinsolve(mysql_reader, abort_signal)
+    evaluation_queue = SimulatedEvaluationQueue(mysql_reader, args.acd_seconds * args.time_scale, args.acd_workers)
+    queue = Queue(autosampler, spinsolve, mysql_reader, abort_signal, evaluation_queue=evaluation_queue)
+    if not autosampler.connect() or not spinsolve.connect():
+        raise SystemExit("Unable to connect to the simulators.")
+    autosampler.wait_for(lambda errorcode: errorcode == 0, 10)
+    return {"queue": queue, "autosampler": virtual_autosampler, "spinsolve": fake_spinsolve}
+
+
+def compare(result, baseline, tolerance):
+    """
+    Compares the metrics of a result with the baseline. Returns the comparison as dictionary.
+    """
+    comparison = {"parameters_match": result["parameters"] == baseline.get("parameters"), "metrics": [], "regressions": 0}
+    current_sections = dict(result["workloads"], **{"abort_" + path: values for path, values in result["abort"].items()})
+    baseline_sections = dict(baseline.get("workloads", {}), **{"abort_" + path: values for path, values in baseline.get("abort", {}).items()})
+    for section, values in current_sections.items():
+        for metric, (higher_is_better, noise) in METRICS.items():
+            if metric not in values or metric not in baseline_sections.get(section, {}):
+                continue
+            old, new = baseline_sections[section][metric], values[metric]
+            change = (new - old) / old if old else 0.0
+            if higher_is_better:
+                regression = change < -tolerance and old - new > noise
+            else:
+                regression = change > tolerance and new - old > noise
+            comparison["metrics"].append({"workload": section, "metric": metric, "baseline": old, "current": new,
+                                          "change": round(change, 3), "regression": regression})
+            comparison["regressions"] += regression
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workloads", default="mixed,repeated,shim,acd")
+    parser.add_argument("--samples", type=int, default=12, help="samples per workload")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="factor for all hardware times")
+    parser.add_argument("--scan", default="QuickScan", help="Scan option of the samples (QuickScan, StandardScan, PowerScan)")
+    parser.add_argument("--shim-failure-rate", type=float, default=0.5, help="probability of a failed shimming in the shim workload")
+    parser.add_argument("--acd-seconds", type=float, default=20.0, help="duration of one evaluation, before the time scale")
+    parser.add_argument("--acd-workers", type=int, default=1)
+    parser.add_argument("--abort-trials", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600, help="maximum time in seconds for one workload")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "queue_throughput_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store the result as new baseline")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if a metric regressed")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change of a metric which counts as regression")
+    parser.add_argument("--database", default="autosampler_queue_benchmark")
+    parser.add_argument("--keep", action="store_true", help="do not drop the scratch database")
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-passwd", default="")
+    parser.add_argument("--mysql-host", default="localhost")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the program")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    server = MySQLdb.connect(user=args.mysql_user, passwd=args.mysql_passwd, host=args.mysql_host)
+    server.cursor().execute("DROP DATABASE IF EXISTS " + args.database)
+    server.cursor().execute("CREATE DATABASE " + args.database)
+    nmr_folder = tempfile.mkdtemp(prefix="queue_benchmark_")
+    try:
+        stack = setup(args, nmr_folder + "/")
+        rng = random.Random(args.seed)
+        result = {"parameters": {key: getattr(args, key) for key in ("workloads", "samples", "time_scale", "scan", "shim_failure_rate",
+                                                                    "acd_seconds", "acd_workers", "abort_trials", "seed")},
+                  "workloads": {}, "abort": {}}
+        for name in args.workloads.split(","):
+            result["workloads"][name] = run_workload(stack, name, args, rng)
+        for path in ("gui", "database"):
+            trials = [run_abort(stack, path, args) for i in range(args.abort_trials)]
+            if trials:
+                result["abort"][path] = {key: round(sum(trial[key] for trial in trials) / len(trials), 1) for key in trials[0]}
+                result["abort"][path]["spinsolve_max_ms"] = max(trial["spinsolve_ms"] for trial in trials)
+
+        if args.save_baseline:
+            with open(args.baseline, "w") as baseline_file:
+                json.dump(result, baseline_file, indent=2)
+        elif os.path.isfile(args.baseline):
+            with open(args.baseline) as baseline_file:
+                result["comparison"] = compare(result, json.load(baseline_file), args.tolerance)
+        print(json.dumps(result, indent=2))
+        if args.fail_on_regression and result.get("comparison", {}).get("regressions"):
+            sys.exit(1)
+    finally:
+        if not args.keep:
+            server.cursor().execute("DROP DATABASE IF EXISTS " + args.database)
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
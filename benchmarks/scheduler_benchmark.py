@@ -0,0 +1,117 @@
+"""
+Benchmark of the sample schedulers on synthetic 32-holder queues.
+
+Simulates the time the hardware needs to work through a batch of samples with each scheduler,
+and reports the overhead (everything except the acquisition itself) per batch.
+
+Usage:
+    python benchmarks/scheduler_benchmark.py [--batches 200] [--samples 24] [--seed 1]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Scheduler import FifoScheduler, CostModelScheduler, SchedulerContext
+
+# timing model of the hardware in seconds
+HOLDERS = 32
+ROTATION_PER_HOLDER = 1.0
+INSERT = 15.0
+RETURN = 15.0
+PROTOCOL_CHANGE = 5.0
+SOLVENT_CHANGE = 5.0
+ACQUISITION = {1: 60.0, 2: 240.0}   # protocol id -> acquisition time
+
+
+def rotation(a, b):
+    if a is None:
+        # unknown position: the first insertion performs a homing
+        return HOLDERS / 2 * ROTATION_PER_HOLDER
+    steps = abs(a - b)
+    return min(steps, HOLDERS - steps) * ROTATION_PER_HOLDER
+
+
+def make_batch(rng, n):
+    """
+    Builds a queue of n samples on random holders. About a third of the samples are repeat
+    measurements of a holder which was queued earlier, not necessarily adjacent by ID.
+    """
+    samples = []
+    for i in range(n):
+        if samples and rng.random() < 0.33:
+            template = rng.choice(samples)
+            holder, solvent = template["Holder"], template["Solvent"]
+        else:
+            holder, solvent = rng.randint(1, HOLDERS - 1), rng.choice(["CDCl3", "DMSO"])
+        samples.append({"ID": i + 1, "Name": "S" + str(i + 1), "Holder": holder, "StartDate": None,
+                        "SampleType": "Sample", "Protocol": rng.choice([1, 2]), "Solvent": solvent})
+    return samples
+
+
+def simulate(samples, scheduler):
+    """
+    Returns (total time, overhead) in seconds to measure all samples with the given scheduler.
+    """
+    remaining = list(samples)
+    t = 0.0
+    acquisition = 0.0
+    position = None
+    loaded = None
+    previous = None
+    while remaining:
+        sample = scheduler.next_sample(remaining, SchedulerContext(position, loaded, previous, t), now=t)
+        remaining.remove(sample)
+        if sample["Holder"] != loaded:
+            if loaded is not None:
+                # return the sample which is still inside
+                t += rotation(position, loaded) + RETURN
+                position = loaded
+            t += rotation(position, sample["Holder"]) + INSERT
+            position = sample["Holder"]
+        if previous is not None:
+            if sample["Protocol"] != previous["Protocol"]:
+                t += PROTOCOL_CHANGE
+            if sample["Solvent"] != previous["Solvent"]:
+                t += SOLVENT_CHANGE
+        t += ACQUISITION[sample["Protocol"]]
+        acquisition += ACQUISITION[sample["Protocol"]]
+        loaded = sample["Holder"]
+        previous = sample
+    # the last sample is returned as well
+    t += rotation(position, loaded) + RETURN
+    return t, t - acquisition
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--samples", type=int, default=24)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    schedulers = {"fifo": FifoScheduler(),
+                  "cost": CostModelScheduler(HOLDERS, ROTATION_PER_HOLDER, INSERT + RETURN, PROTOCOL_CHANGE, SOLVENT_CHANGE)}
+    overhead = {name: 0.0 for name in schedulers}
+    total = {name: 0.0 for name in schedulers}
+    for i in range(args.batches):
+        batch = make_batch(rng, args.samples)
+        for name, scheduler in schedulers.items():
+            t, o = simulate(batch, scheduler)
+            total[name] += t
+            overhead[name] += o
+    result = {
+        "batches": args.batches,
+        "samples_per_batch": args.samples,
+        "mean_batch_time_s": {name: round(total[name] / args.batches, 1) for name in schedulers},
+        "mean_overhead_s": {name: round(overhead[name] / args.batches, 1) for name in schedulers},
+        "mean_saved_per_batch_s": round((total["fifo"] - total["cost"]) / args.batches, 1),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,10 @@ from Autosampler import *
 from Spinsolve import *
 from MySQLReader import *
 from Queue import *
+from AbortSignal import *
 from Gui import *
+from Migrations import *
+from Metrics import *
 
 ###########################################################
 #           "AUTOSAMPLER SATAN" CONTROL PROGRAM           #
@@ -46,13 +49,22 @@ for i in range(60):
 else:
     sys.exit("Unable to connect to mysql server.")
 
+# add the tables and indexes which are missing in the database
+Migrations(mysql_reader).migrate()
+
 config = mysql_reader.read_config()
 
 autosampler = Autosampler(mysql_reader)
 
-spec = Spinsolve(mysql_reader)
+abort_signal = AbortSignal(mysql_reader)
+
+spec = Spinsolve(mysql_reader, abort_signal)
+
+queue = Queue(autosampler, spec, mysql_reader, abort_signal)
 
-queue = Queue(autosampler, spec, mysql_reader)
+# metrics for Prometheus on http://localhost:9105/metrics, the port can be configured in the
+# config table (MetricsPort)
+metrics = Metrics(queue, config.get('MetricsPort') or 9105)
 
 gui.initialize(queue, xampp_location)
 
@@ -0,0 +1,275 @@
+import os
+import math
+import random
+import socket
+import struct
+import threading
+import time
+import logging
+from xml.sax.saxutils import quoteattr
+import numpy as np
+from XmlStreamFramer import XmlStreamFramer
+from Jcamp import Jcamp
+
+class FakeSpinsolve:
+    """
+    Simulates the remote control interface of the Spinsolve software: a TCP server which
+    receives the same XML messages as the Spinsolve (Set, Start, Abort) and answers with
+    StatusNotifications (Progress, Completed).
+
+    A measurement takes the time given by duration() (multiplied by time_scale), reports its
+    progress about once per second, and writes an output folder into the UserFolder, in the
+    format which SpinsolveDataset reads: data.1d (FID), spectrum.1d, acqu.par, protocol.par and
+    nmr_fid.dx. The data is a synthetic spectrum with a few lines, derived from the sample
+    name.
+
+    Only one measurement runs at a time; a Start during a measurement is refused.
+    """
+
+    # durations in seconds of the shimmings, and of the scans of the standard protocols
+    SHIM_DURATIONS = {"CheckShim": 40, "QuickShim": 300, "PowerShim": 1800}
+    SCAN_DURATIONS = {"QuickScan": 15, "StandardScan": 60, "PowerScan": 300}
+    DEFAULT_DURATION = 60
+    HEADER = struct.Struct("<8i")
+
+    def __init__(self, host="127.0.0.1", port=13000, time_scale=1.0, failure_rate=0.0, shim_failure_rate=0.0,
+                 seed=None, points=8192):
+        """
+        Arguments:
+        host              -- address the server listens on
+        port              -- TCP port, 0 to pick a free one (see the port attribute after start)
+        time_scale        -- factor for all durations, e.g. 0.01 for a simulation which runs
+                             100x faster than the real spectrometer
+        failure_rate      -- probability that a measurement is not successful
+        shim_failure_rate -- probability that a shimming is not successful
+        seed              -- seed of the random failures
+        points            -- number of points of the FID and the spectrum
+        """
+        self.host = host
+        self.port = port
+        self.time_scale = time_scale
+        self.failure_rate = failure_rate
+        self.shim_failure_rate = shim_failure_rate
+        self.random = random.Random(seed)
+        self.points = points
+        self.server = None
+        self.clients = []
+        self._lock = threading.Lock()
+        self.settings = {}               # the values of the last Set messages
+        self.measurement = None          # thread of the running measurement
+        self.abort_event = threading.Event()
+        # counters, see stats()
+        self.counters = {"measurements": 0, "shims": 0, "successful": 0, "failed": 0, "aborted": 0, "refused": 0,
+                         "busy_seconds": 0.0}
+
+    def start(self):
+        """
+        Starts the server in the background. Returns the port.
+        """
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        thread = threading.Thread(target=self.accept, args=(), name="FakeSpinsolve-accept")
+        thread.daemon = True
+        thread.start()
+        logging.info("Fake Spinsolve listening on " + self.host + ":" + str(self.port) + ".")
+        return self.port
+
+    def stats(self):
+        """
+        Returns the counters of the simulator as a dictionary.
+        """
+        return dict(self.counters, running=self.is_running(), clients=len(self.clients))
+
+    def is_running(self):
+        return self.measurement is not None and self.measurement.is_alive()
+
+    def accept(self):
+        while True:
+            client, address = self.server.accept()
+            with self._lock:
+                self.clients.append(client)
+            thread = threading.Thread(target=self.serve, args=(client,), name="FakeSpinsolve-client")
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, client):
+        """
+        Reads the messages of one client until it disconnects.
+        """
+        framer = XmlStreamFramer()
+        try:
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                for root in framer.feed(data):
+                    self.process(root)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                if client in self.clients:
+                    self.clients.remove(client)
+            client.close()
+
+    def send(self, body):
+        """
+        Sends a message to all clients.
+        """
+        message = ("<?xml version='1.0' encoding='UTF-8'?><Message>" + body + "</Message>").encode()
+        with self._lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(message)
+                except OSError:
+                    self.clients.remove(client)
+
+    def process(self, root):
+        for element in root:
+            if element.tag == "Set":
+                for setting in element:
+                    if setting.tag == "DataFolder":
+                        user_folder = setting.find("UserFolder")
+                        if user_folder is not None:
+                            self.settings["UserFolder"] = user_folder.text or ""
+                    elif setting.tag == "UserData":
+                        for data in setting.findall("Data"):
+                            self.settings[data.get("key")] = data.get("value")
+                    else:
+                        self.settings[setting.tag] = setting.text or ""
+            elif element.tag == "Start":
+                self.start_measurement(element.get("protocol"), {option.get("name"): option.get("value") for option in element.findall("Option")})
+            elif element.tag == "Abort":
+                self.abort_event.set()
+            else:
+                logging.debug("Fake Spinsolve ignores the message " + element.tag + ".")
+
+    def start_measurement(self, protocol, options):
+        if self.is_running():
+            logging.warning("Fake Spinsolve is busy, refusing to start " + str(protocol) + ".")
+            self.counters["refused"] += 1
+            self.send("<StartResponse error='Busy'/>")
+            return
+        self.abort_event.clear()
+        self.send("<StartResponse error=''/>")
+        self.measurement = threading.Thread(target=self.measure, args=(protocol, options, dict(self.settings)),
+                                            name="FakeSpinsolve-measurement")
+        self.measurement.daemon = True
+        self.measurement.start()
+
+    def duration(self, protocol, options):
+        """
+        Returns the duration of a measurement in seconds (without time_scale).
+        """
+        if protocol == "SHIM":
+            return self.SHIM_DURATIONS.get(options.get("Shim"), self.DEFAULT_DURATION)
+        if options.get("Scan") in self.SCAN_DURATIONS:
+            return self.SCAN_DURATIONS[options["Scan"]]
+        try:
+            return float(options["Number"]) * float(options["RepetitionTime"])
+        except (KeyError, ValueError):
+            return self.DEFAULT_DURATION
+
+    def measure(self, protocol, options, settings):
+        """
+        Runs one measurement, see the class description.
+        """
+        shim = protocol == "SHIM"
+        self.counters["shims" if shim else "measurements"] += 1
+        duration = self.duration(protocol, options) * self.time_scale
+        interval = min(max(self.time_scale, 0.05), 1.0)
+        started = time.monotonic()
+        aborted = False
+        while True:
+            elapsed = time.monotonic() - started
+            if elapsed >= duration:
+                break
+            percentage = int(100 * elapsed / duration)
+            self.send("<StatusNotification><Progress protocol=" + quoteattr(protocol) + " percentage='" + str(percentage) +
+                      "' secondsRemaining='" + str(int(math.ceil(duration - elapsed))) + "'/></StatusNotification>")
+            if self.abort_event.wait(min(interval, duration - elapsed)):
+                aborted = True
+                break
+        if aborted:
+            self.counters["aborted"] += 1
+            self.counters["busy_seconds"] += time.monotonic() - started
+            self.send("<StatusNotification><Completed protocol=" + quoteattr(protocol) + " completed='false' successful='false'/></StatusNotification>")
+            return
+        successful = self.random.random() >= (self.shim_failure_rate if shim else self.failure_rate)
+        if successful:
+            try:
+                self.write_folder(settings.get("UserFolder"), protocol, options, settings, not shim)
+            except OSError:
+                logging.exception("")
+                successful = False
+        self.counters["successful" if successful else "failed"] += 1
+        self.counters["busy_seconds"] += time.monotonic() - started
+        self.send("<StatusNotification><Progress protocol=" + quoteattr(protocol) + " percentage='100' secondsRemaining='0'/></StatusNotification>")
+        self.send("<StatusNotification><Completed protocol=" + quoteattr(protocol) + " completed='true' successful='" +
+                  ("true" if successful else "false") + "'/></StatusNotification>")
+
+    def write_folder(self, folder, protocol, options, settings, with_data=True):
+        """
+        Writes the output folder of a measurement.
+        """
+        if not folder:
+            raise OSError("No UserFolder was set.")
+        os.makedirs(folder, exist_ok=True)
+        sample = settings.get("Sample", "")
+        b1_freq = 40.7 if "FLUORINE" in protocol.upper() else 43.3     # MHz
+        bandwidth = 5000.0                                               # Hz
+        parameters = {"Sample": sample, "Solvent": settings.get("Solvent", ""), "Protocol": protocol,
+                      "Comment": settings.get("Comment", ""), "b1Freq": b1_freq, "bandwidth": bandwidth / 1000,
+                      "nrPnts": self.points, "dwellTime": 1e6 / bandwidth, "startTime": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        self.write_parameters(os.path.join(folder, "acqu.par"), parameters)
+        if with_data:
+            time_axis, fid, ppm, spectrum = self.synthesize(sample, b1_freq, bandwidth)
+            self.write_binary(os.path.join(folder, "data.1d"), time_axis, fid)
+            self.write_binary(os.path.join(folder, "spectrum.1d"), ppm, spectrum)
+            jdx = Jcamp.parse("##TITLE=" + sample + "\n##JCAMP-DX=5.01\n##DATA TYPE=NMR FID\n"
+                              "##.OBSERVE FREQUENCY=" + str(b1_freq) + "\n##END=")
+            jdx.x = time_axis.astype(float)
+            jdx.data["Y"] = fid.real.astype(float)
+            jdx.write(os.path.join(folder, "nmr_fid.dx"))
+        # protocol.par is written last, the Spinsolve class takes it as sign of a successful shim
+        self.write_parameters(os.path.join(folder, "protocol.par"), dict(options, Protocol=protocol))
+
+    def synthesize(self, sample, b1_freq, bandwidth):
+        """
+        Returns the time axis, FID, ppm axis and spectrum of a synthetic measurement with a few
+        lines, which only depend on the sample name.
+        """
+        rng = np.random.default_rng(sum(sample.encode()) + 7 * len(sample))
+        time_axis = (np.arange(self.points) / bandwidth).astype(np.float32)
+        lines = rng.uniform(0.5, 9.5, 4)
+        fid = np.zeros(self.points, dtype=np.complex128)
+        for ppm, amplitude in zip(lines, rng.uniform(0.2, 1.0, len(lines))):
+            fid += amplitude * np.exp(2j * np.pi * (ppm - 5.0) * b1_freq * time_axis - time_axis / 0.3)
+        fid += rng.normal(0, 0.002, self.points) + 1j * rng.normal(0, 0.002, self.points)
+        spectrum = np.fft.fftshift(np.fft.fft(fid))
+        ppm_axis = (5.0 + np.fft.fftshift(np.fft.fftfreq(self.points, 1 / bandwidth)) / b1_freq).astype(np.float32)
+        return time_axis, fid.astype(np.complex64), ppm_axis, spectrum.astype(np.complex64)
+
+    def write_binary(self, filename, axis, data):
+        """
+        Writes a binary file of the Spinsolve software: header, axis, complex data (data type
+        504, see SpinsolveDataset).
+        """
+        with open(filename, "wb") as binary_file:
+            binary_file.write(self.HEADER.pack(0x50726f73, 0x54446174, 1, 504, len(data), 1, 1, 1))
+            binary_file.write(axis.astype("<f4").tobytes())
+            binary_file.write(data.astype("<c8").tobytes())
+
+    @staticmethod
+    def write_parameters(filename, parameters):
+        with open(filename, "w", encoding="latin-1") as par_file:
+            for key, value in parameters.items():
+                if isinstance(value, str):
+                    try:
+                        float(value)
+                    except ValueError:
+                        value = '"' + value + '"'
+                par_file.write(key.ljust(26) + "= " + str(value) + "\n")
@@ -0,0 +1,270 @@
+import os
+import select
+import threading
+import queue
+import random
+import time
+import tty
+import logging
+
+class VirtualAutosampler:
+    """
+    Simulates the Arduino of the Autosampler on a pseudo terminal (Linux only).
+
+    The Autosampler class can open the slave side of the pty (see port) like the real serial
+    port. The simulator understands the command set of the Arduino:
+
+    M<n> -- homing, then insert the sample of holder n into the spectrometer. If a tube is
+            stuck in the spectrometer, it is ejected to holder 32 instead (error 6).
+    N<n> -- insert the sample of holder n, without homing (used within a queue).
+    R<n> -- return the sample from the spectrometer to holder n.
+    m<n> -- rotate the carousel to holder n.
+    h    -- homing.
+    E    -- error raised by the PC (error 9).
+    r    -- reset the error.
+    a, b -- push/pull the pusher.
+    c, d -- push/vent the air.
+    z    -- buzz.
+
+    The commands are executed one after the other, with the motion times in DURATIONS and
+    ROTATION (in seconds, multiplied by time_scale). The status is reported as a single digit
+    (see Autosampler.errorcodelist) whenever it changes, and once per second as heartbeat.
+    While in an error state, only E, r, z and the pusher/air commands are executed.
+    """
+
+    HOLDERS = 32           # holder 32 takes the samples which were ejected from the spectrometer
+    ROTATION = 0.3         # time to rotate the carousel by one holder
+    DURATIONS = {"homing": 6.0, "insert": 10.0, "return": 12.0, "pusher": 1.0, "air": 1.0, "buzz": 0.5}
+    MOTION_ERRORS = (2, 4, 5)
+
+    def __init__(self, time_scale=1.0, tubes=None, error_rate=0.0, seed=None, heartbeat=1.0):
+        """
+        Arguments:
+        time_scale -- factor for all motion times, e.g. 0.01 for a simulation which runs
+                      100x faster than the real Autosampler
+        tubes      -- holders which contain a tube, by default 1 to 31
+        error_rate -- probability that an insertion or return fails with a random error
+                      (2, 4 or 5)
+        seed       -- seed of the random errors
+        heartbeat  -- time in seconds between two status reports without a change
+        """
+        self.time_scale = time_scale
+        if tubes is None:
+            tubes = range(1, self.HOLDERS)
+        self.tubes = set(tubes)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.heartbeat = heartbeat
+        self.errorcode = 0
+        self.position = 1              # holder below the spectrometer
+        self.inside = None             # holder of the tube in the spectrometer, or None
+        self.next_errors = []          # error codes for the next motions, see fail_next()
+        self.commands = queue.Queue()
+        self._write_lock = threading.Lock()
+        # counters, see stats()
+        self.counters = {"commands": 0, "insertions": 0, "returns": 0, "rotations": 0, "errors": 0, "busy_seconds": 0.0}
+        self.master, self.slave = os.openpty()
+        # raw mode, so that the line discipline does not echo or translate anything
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        # the slave side stays open, so that the pty survives when the Autosampler disconnects
+        self.port = os.ttyname(self.slave)
+        self.threads = []
+
+    def start(self):
+        """
+        Starts the threads of the simulator. Returns the serial port.
+        """
+        for target, name in ((self.listen, "VirtualAutosampler-listen"), (self.work, "VirtualAutosampler-work"),
+                             (self.beat, "VirtualAutosampler-heartbeat")):
+            thread = threading.Thread(target=target, args=(), name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        logging.info("Virtual Autosampler listening on " + self.port + ".")
+        return self.port
+
+    def fail_next(self, errorcode):
+        """
+        Lets the next insertion or return fail with the given error code.
+        """
+        self.next_errors.append(errorcode)
+
+    def stats(self):
+        """
+        Returns the counters of the simulator as a dictionary.
+        """
+        return dict(self.counters, errorcode=self.errorcode, position=self.position, inside=self.inside)
+
+    def report(self, errorcode=None):
+        """
+        Sends the status to the PC. Sets it first, if errorcode is given.
+        """
+        if errorcode is not None:
+            self.errorcode = errorcode
+        with self._write_lock:
+            try:
+                os.write(self.master, (str(self.errorcode) + "\r\n").encode())
+            except (BlockingIOError, OSError):
+                # nobody is reading the port, the status is dropped like on a real serial line
+                pass
+
+    def listen(self):
+        """
+        Background process which reads the commands from the pty. A command ends at the next
+        letter, at a whitespace, or when nothing more arrives for 0.1 s.
+        """
+        command = ""
+        while True:
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                if command:
+                    self.commands.put(command)
+                    command = ""
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except (BlockingIOError, OSError):
+                # the slave side is not open right now
+                time.sleep(0.1)
+                continue
+            for char in data.decode("ascii", "replace"):
+                if char.isalpha():
+                    if command:
+                        self.commands.put(command)
+                    command = char
+                elif char.isdigit() and command:
+                    command += char
+                elif command:
+                    self.commands.put(command)
+                    command = ""
+
+    def beat(self):
+        """
+        Background process which sends the heartbeat.
+        """
+        while True:
+            time.sleep(self.heartbeat)
+            self.report()
+
+    def work(self):
+        """
+        Background process which executes the commands in the order in which they arrived.
+        """
+        while True:
+            command = self.commands.get()
+            self.counters["commands"] += 1
+            letter, argument = command[0], command[1:]
+            started = time.monotonic()
+            try:
+                self.execute(letter, int(argument) if argument else None)
+            except:
+                logging.exception("")
+            self.counters["busy_seconds"] += time.monotonic() - started
+
+    def execute(self, letter, holder):
+        if letter == "E":
+            self.report(9)
+        elif letter == "r":
+            self.report(3 if self.inside is not None else 0)
+        elif letter == "z":
+            self.sleep("buzz")
+        elif letter in "ab":
+            self.motion("pusher")
+        elif letter in "cd":
+            self.motion("air")
+        elif self.is_error():
+            logging.info("Virtual Autosampler ignores " + letter + " in error state " + str(self.errorcode) + ".")
+        elif letter in "MNRm" and (holder is None or not 1 <= holder <= self.HOLDERS):
+            logging.warning("Virtual Autosampler: invalid holder in command " + letter + str(holder) + ".")
+        elif letter == "h":
+            self.report(1)
+            self.homing()
+            self.report(self.idle_code())
+        elif letter == "m":
+            self.report(1)
+            self.rotate(holder)
+            self.report(self.idle_code())
+        elif letter in "MN":
+            self.report(1)
+            if letter == "M":
+                self.homing()
+                if self.inside is not None:
+                    # eject the stuck tube to holder 32, and refuse to start
+                    self.rotate(self.HOLDERS)
+                    self.sleep("return")
+                    self.tubes.add(self.HOLDERS)
+                    self.inside = None
+                    self.report(6)
+                    return
+            self.rotate(holder)
+            if holder not in self.tubes:
+                self.report(8)
+            elif self.fails():
+                pass
+            else:
+                self.sleep("insert")
+                self.tubes.discard(holder)
+                self.inside = holder
+                self.counters["insertions"] += 1
+                self.report(3)
+        elif letter == "R":
+            self.report(1)
+            if self.inside is None:
+                self.report(7)
+                return
+            self.rotate(holder)
+            if not self.fails():
+                self.sleep("return")
+                self.tubes.add(holder)
+                self.inside = None
+                self.counters["returns"] += 1
+                self.report(0)
+        else:
+            logging.warning("Virtual Autosampler: unknown command " + letter + ".")
+
+    def is_error(self):
+        return self.errorcode == 2 or self.errorcode > 3
+
+    def idle_code(self):
+        return 3 if self.inside is not None else 0
+
+    def fails(self):
+        """
+        Decides whether the current insertion or return fails, and reports the error.
+        """
+        if self.next_errors:
+            errorcode = self.next_errors.pop(0)
+        elif self.error_rate and self.random.random() < self.error_rate:
+            errorcode = self.random.choice(self.MOTION_ERRORS)
+        else:
+            return False
+        self.sleep("pusher")
+        self.counters["errors"] += 1
+        self.report(errorcode)
+        return True
+
+    def motion(self, kind):
+        old_errorcode = self.errorcode
+        if not self.is_error():
+            self.report(1)
+        self.sleep(kind)
+        self.report(old_errorcode)
+
+    def homing(self):
+        self.sleep("homing")
+        self.position = 1
+
+    def rotate(self, holder):
+        """
+        Rotates the carousel the shorter way round to a holder.
+        """
+        steps = abs(holder - self.position)
+        steps = min(steps, self.HOLDERS - steps)
+        if steps:
+            self.counters["rotations"] += 1
+            time.sleep(steps * self.ROTATION * self.time_scale)
+        self.position = holder
+
+    def sleep(self, kind):
+        time.sleep(self.DURATIONS[kind] * self.time_scale)
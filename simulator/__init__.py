@@ -0,0 +1,6 @@
+"""
+Simulators of the hardware, for running the program (e.g. the Queue, or the benchmarks)
+without the Autosampler and the Spinsolve spectrometer.
+"""
+from .VirtualAutosampler import VirtualAutosampler
+from .FakeSpinsolve import FakeSpinsolve
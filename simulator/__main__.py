@@ -0,0 +1,74 @@
+"""
+Runs the virtual Autosampler and the fake Spinsolve until Ctrl+C is pressed.
+
+With --configure, the serial port and the address of the simulators are written into the
+config table, so that the program (main.pyw) connects to them instead of the real hardware.
+The NMRFolder of the config must be writable, the fake Spinsolve writes the spectra there.
+
+Usage (from the folder of the program, Linux only):
+    python -m simulator [--time-scale 0.1] [--nmr-port 13000] [--configure]
+"""
+import argparse
+import json
+import logging
+import time
+from simulator import VirtualAutosampler, FakeSpinsolve
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--time-scale", type=float, default=1.0, help="factor for all motion and measurement times")
+    parser.add_argument("--nmr-host", default="127.0.0.1")
+    parser.add_argument("--nmr-port", type=int, default=13000)
+    parser.add_argument("--tubes", default="1-31", help="holders which contain a tube, e.g. 1-10,12")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an Autosampler error per insertion/return")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of a failed measurement")
+    parser.add_argument("--shim-failure-rate", type=float, default=0.0, help="probability of a failed shimming")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--configure", action="store_true", help="write ASPort, NMRIP and NMRPort into the config table")
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-passwd", default="")
+    parser.add_argument("--mysql-host", default="localhost")
+    parser.add_argument("--mysql-db", default="autosampler")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    autosampler = VirtualAutosampler(args.time_scale, parse_holders(args.tubes), args.error_rate, args.seed)
+    spinsolve = FakeSpinsolve(args.nmr_host, args.nmr_port, args.time_scale, args.failure_rate, args.shim_failure_rate, args.seed)
+    port = autosampler.start()
+    nmr_port = spinsolve.start()
+    if args.configure:
+        # only needed here, the simulators themselves run without a database
+        from MySQLReader import MySQLReader
+        mysql_reader = MySQLReader(args.mysql_user, args.mysql_passwd, args.mysql_host, args.mysql_db, "")
+        conn, cur = mysql_reader.connect_db()
+        if conn is None:
+            raise SystemExit("Unable to connect to mysql server.")
+        try:
+            cur.execute("UPDATE config SET ASPort = %s, NMRIP = %s, NMRPort = %s", (port, args.nmr_host, nmr_port))
+        finally:
+            conn.close()
+        logging.info("Config was changed to the simulators.")
+    print(json.dumps({"ASPort": port, "NMRIP": args.nmr_host, "NMRPort": nmr_port}), flush=True)
+    try:
+        while True:
+            time.sleep(60)
+            logging.info("Autosampler: " + json.dumps(autosampler.stats()) + ", Spinsolve: " + json.dumps(spinsolve.stats()))
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_holders(text):
+    """
+    Parses a list of holders like "1-10,12" into a set.
+    """
+    holders = set()
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        if first.strip():
+            holders.update(range(int(first), int(last or first) + 1))
+    return holders
+
+
+if __name__ == "__main__":
+    main()
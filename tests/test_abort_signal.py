@@ -0,0 +1,65 @@
+import threading
+import time
+import pytest
+
+MySQLdb = pytest.importorskip("MySQLdb")
+import AbortSignal
+
+
+class SlowQueueAbort:
+    """
+    Stands in for the QueueAbortRepository of a slow database: every access takes delay
+    seconds, or raises error if it is set.
+    """
+
+    def __init__(self, queue_stat, delay):
+        self.queue_stat = queue_stat
+        self.delay = delay
+        self.error = None
+        self.reading = threading.Event()
+
+    def read(self, cur=None):
+        self.reading.set()
+        value = self.queue_stat
+        time.sleep(self.delay)
+        return value
+
+    def set(self, queue_stat, cur=None):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.queue_stat = queue_stat
+
+
+def make_signal(monkeypatch, queue_stat, delay, poll_interval=0.01):
+    queueabort = SlowQueueAbort(queue_stat, delay)
+    monkeypatch.setattr(AbortSignal, "QueueAbortRepository", lambda mysql_reader: queueabort)
+    return AbortSignal.AbortSignal(None, poll_interval), queueabort
+
+
+def test_trigger_does_not_wait_for_the_database(monkeypatch):
+    signal, queueabort = make_signal(monkeypatch, 1, 0.5)
+    signal.release()
+    assert not signal.is_set()
+    queueabort.reading.clear()
+    assert queueabort.reading.wait(2)
+    # the watcher is in the middle of a slow read of QueueStat = 1
+    started = time.monotonic()
+    thread = threading.Thread(target=signal.trigger)
+    thread.start()
+    assert signal.wait(0.1)
+    assert time.monotonic() - started < 0.1
+    thread.join()
+    # the stale QueueStat = 1 of the read which was running is discarded
+    time.sleep(1.2)
+    assert signal.is_set()
+    assert queueabort.queue_stat == 0
+
+
+def test_database_errors_are_not_raised(monkeypatch):
+    signal, queueabort = make_signal(monkeypatch, 1, 0, poll_interval=60)
+    queueabort.error = MySQLdb.OperationalError(1205, "Lock wait timeout exceeded")
+    signal.trigger("test")
+    assert signal.is_set()
+    signal.release()
+    assert not signal.is_set()
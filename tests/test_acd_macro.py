@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+
+pytest.importorskip("MySQLdb")
+import AcdMacro
+
+REAL_POPEN = subprocess.Popen
+
+# stands in for specman: exports the PDF, creates the ESP file empty, and writes it after a
+# while; specman itself is never closed by the macro
+FAKE_SPECMAN = """
+import sys, time
+pdf, esp, delay = sys.argv[1], sys.argv[2], float(sys.argv[3])
+open(pdf, "w").write("pdf")
+open(esp, "w").close()
+time.sleep(delay)
+with open(esp, "w") as f:
+    f.write("esp" * 1000)
+time.sleep(60)
+"""
+
+
+@pytest.fixture
+def macro(tmp_path, monkeypatch):
+    (tmp_path / "S1").mkdir()
+
+    def fake_popen(command, cwd=None):
+        return REAL_POPEN([sys.executable, "-c", FAKE_SPECMAN, str(tmp_path / "S1" / "S1.pdf"),
+                           str(tmp_path / "S1" / "S1.esp"), "1"])
+
+    monkeypatch.setattr(AcdMacro.subprocess, "Popen", fake_popen)
+    # no taskkill here, the fake process is killed by cleanup()
+    monkeypatch.setattr(AcdMacro.subprocess, "run", lambda *args, **kwargs: None)
+    monkeypatch.setattr(AcdMacro.AcdMacro, "STABLE_TIME", 0.5)
+    acd_macro = AcdMacro.AcdMacro.__new__(AcdMacro.AcdMacro)
+    acd_macro.fname = acd_macro.fname1 = "S1"
+    acd_macro.workdir = str(tmp_path)
+    acd_macro.timeout = 10
+    config = {"NMRFolder": str(tmp_path) + "/", "ACDFolder": str(tmp_path)}
+    return acd_macro, config, tmp_path / "S1" / "S1.esp"
+
+
+def test_waits_until_the_esp_file_is_written(macro):
+    acd_macro, config, esp = macro
+    started = time.time()
+    assert acd_macro.run_specman("specman", "macro", config)
+    # the empty ESP file which exists right after the start does not count
+    assert time.time() - started >= 1.5
+    assert esp.stat().st_size == 3000
+
+
+def test_stale_outputs_are_ignored(macro, monkeypatch):
+    acd_macro, config, esp = macro
+    monkeypatch.setattr(AcdMacro.subprocess, "Popen",
+                        lambda command, cwd=None: REAL_POPEN([sys.executable, "-c", "import time; time.sleep(60)"]))
+    esp.write_text("old")
+    (esp.parent / "S1.pdf").write_text("old")
+    time.sleep(0.05)
+    acd_macro.timeout = 1
+    assert not acd_macro.run_specman("specman", "macro", config)
+
+
+def test_leftovers_are_not_killed_while_another_process_runs_macros(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(AcdMacro.subprocess, "run", lambda command, **kwargs: commands.append(command))
+    # the marker of another program, which is running a macro right now
+    with open(tmp_path / (AcdMacro.AcdMacro.MARKER_PREFIX + "1234"), "a+b") as marker:
+        AcdMacro.AcdMacro.lock(marker, blocking=False)
+        AcdMacro.AcdMacro.kill_leftovers(str(tmp_path))
+        assert commands == []
+    # the marker is left behind by a program which has ended
+    AcdMacro.AcdMacro.kill_leftovers(str(tmp_path))
+    assert any("SPECMAN.EXE" in command for command in commands)
+    assert not (tmp_path / (AcdMacro.AcdMacro.MARKER_PREFIX + "1234")).exists()
+
+
+def test_marker_is_held_while_a_macro_runs(macro):
+    acd_macro, config, esp = macro
+    thread = threading.Thread(target=acd_macro.run_specman, args=("specman", "macro", config))
+    thread.start()
+    marker = esp.parent.parent / (AcdMacro.AcdMacro.MARKER_PREFIX + str(os.getpid()))
+    deadline = time.time() + 5
+    while not marker.exists() and time.time() < deadline:
+        time.sleep(0.05)
+    assert marker.exists()
+    thread.join()
+    assert not marker.exists()
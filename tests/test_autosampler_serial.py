@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+import pytest
+
+pytest.importorskip("serial")
+pytest.importorskip("MySQLdb")
+from Autosampler import Autosampler, StatusFrameParser
+
+
+class FakeConfigService:
+    def subscribe(self, key, callback):
+        pass
+
+
+class FakeWriter:
+    def submit(self, key, statement, args):
+        pass
+
+
+class FakeMySQLReader:
+    """
+    Just enough of a MySQLReader for the Autosampler: the config and the DbWriter of the
+    StatusPublisher.
+    """
+
+    def __init__(self, port):
+        self.config = {"ASPort": port, "ASHeartbeat": 5}
+        self.config_service = FakeConfigService()
+        self.writer = FakeWriter()
+
+    def read_config(self):
+        return self.config
+
+
+@pytest.fixture
+def device():
+    """
+    A pty pair: the Autosampler opens the slave side as its serial port, the test writes the
+    status frames of the Arduino into the master side.
+    """
+    master, slave = os.openpty()
+    yield master, os.ttyname(slave)
+    os.close(master)
+    os.close(slave)
+
+
+def test_parser_skips_line_breaks_and_junk():
+    parser = StatusFrameParser()
+    assert parser.feed(b"0\r\n1") == [0, 1]
+    assert parser.feed(b"\n") == []
+    assert parser.feed(b"x3 \r\n") == [3]
+
+
+def test_split_status_frames(device):
+    master, port = device
+    autosampler = Autosampler(FakeMySQLReader(port))
+    received = []
+    done = threading.Event()
+
+    def subscriber(errorcode):
+        received.append(errorcode)
+        if len(received) == 6:
+            done.set()
+
+    autosampler.subscribe(subscriber)
+    assert autosampler.connect()
+    try:
+        # frames split at every possible place: between digit and line break, inside the line
+        # break, several frames in one chunk
+        for chunk in (b"0", b"\r", b"\n1\r", b"\n", b"1\r\n3", b"\r\n0\r\n2\r\n"):
+            os.write(master, chunk)
+            time.sleep(0.05)
+        assert done.wait(5)
+        assert received == [0, 1, 1, 3, 0, 2]
+        assert autosampler.errorcode == 2
+        assert autosampler.stats()["transitions"][(1, 3)] == 1
+    finally:
+        autosampler.disconnect()
+
+
+def test_contact_timeout(device):
+    master, port = device
+    autosampler = Autosampler(FakeMySQLReader(port))
+    assert autosampler.connect()
+    try:
+        os.write(master, b"0\r\n")
+        assert autosampler.wait_for(lambda errorcode: errorcode == 0, 5)
+        silent_since = time.monotonic()
+        # the connection is considered lost after 5 seconds without a status
+        assert autosampler.wait_for(lambda errorcode: errorcode == -2, autosampler.contact_timeout + 3)
+        elapsed = time.monotonic() - silent_since
+        assert autosampler.contact_timeout - 0.5 <= elapsed <= autosampler.contact_timeout + 1.5
+        # the next status restores the connection
+        os.write(master, b"0\r\n")
+        assert autosampler.wait_for(lambda errorcode: errorcode == 0, 5)
+    finally:
+        autosampler.disconnect()
+
+
+def test_no_contact_timeout_while_at_work(device):
+    master, port = device
+    autosampler = Autosampler(FakeMySQLReader(port))
+    autosampler.contact_timeout = 1
+    assert autosampler.connect()
+    try:
+        os.write(master, b"1\r\n")
+        assert autosampler.wait_for(lambda errorcode: errorcode == 1, 5)
+        # the Autosampler may stay silent while it moves (errorcode 1)
+        assert not autosampler.wait_for(lambda errorcode: errorcode == -2, 2.5)
+    finally:
+        autosampler.disconnect()
+
+
+def test_move_to_pos_waits_for_the_acknowledgement(device):
+    master, port = device
+    autosampler = Autosampler(FakeMySQLReader(port))
+    assert autosampler.connect()
+    try:
+        os.write(master, b"0\r\n")
+        assert autosampler.wait_for(lambda errorcode: errorcode == 0, 5)
+
+        def short_rotation():
+            # the busy status is over before the caller could see it
+            assert os.read(master, 16) == b"m12"
+            os.write(master, b"1\r\n0\r\n")
+
+        thread = threading.Thread(target=short_rotation)
+        thread.start()
+        started = time.monotonic()
+        assert autosampler.move_to_pos(12, 2)
+        assert time.monotonic() - started < 1
+        thread.join()
+        # no status after the command
+        assert not autosampler.move_to_pos(13, 0.5)
+        assert os.read(master, 16) == b"m13"
+    finally:
+        autosampler.disconnect()
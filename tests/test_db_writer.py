@@ -0,0 +1,77 @@
+import contextlib
+import pytest
+
+MySQLdb = pytest.importorskip("MySQLdb")
+from DbWriter import DbWriter
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.statements = []
+
+    def execute(self, statement, args=None):
+        error = self.db.errors.get(statement)
+        if error is not None:
+            if self.db.transient_once:
+                del self.db.errors[statement]
+            raise error
+        self.statements.append((statement, args))
+
+
+class FakeReader:
+    """
+    Stands in for the MySQLReader: a transaction is committed only if none of its statements
+    failed.
+    """
+
+    def __init__(self, errors=None, transient_once=False):
+        self.errors = dict(errors or {})
+        self.transient_once = transient_once
+        self.committed = []
+
+    @contextlib.contextmanager
+    def transaction(self):
+        cur = FakeCursor(self)
+        yield cur
+        self.committed.extend(cur.statements)
+
+
+def test_coalesces_updates():
+    reader = FakeReader()
+    writer = DbWriter(reader, delay=0.05)
+    for progress in range(5):
+        writer.submit(("samples", 1, "Progress"), "UPDATE progress", (progress,))
+    assert writer.flush(5)
+    assert reader.committed == [("UPDATE progress", (4,))]
+    assert writer.stats()["coalesced"] == 4
+
+
+def test_drops_a_statement_which_cannot_succeed():
+    bad = "INSERT INTO sample_timings"
+    reader = FakeReader({bad: MySQLdb.ProgrammingError(1146, "Table doesn't exist")})
+    writer = DbWriter(reader, delay=0.05)
+    writer.submit(None, "UPDATE first", (1,))
+    writer.submit(None, bad, (2,))
+    writer.submit(None, "UPDATE last", (3,))
+    assert writer.flush(5)
+    assert reader.committed == [("UPDATE first", (1,)), ("UPDATE last", (3,))]
+    stats = writer.stats()
+    assert stats["dropped"] == 1
+    assert stats["written"] == 2
+    # later updates are not held up
+    writer.submit(None, "UPDATE later", (4,))
+    assert writer.flush(5)
+    assert reader.committed[-1] == ("UPDATE later", (4,))
+
+
+def test_retries_a_lost_connection():
+    reader = FakeReader({"UPDATE status": MySQLdb.OperationalError(2006, "MySQL server has gone away")},
+                        transient_once=True)
+    writer = DbWriter(reader, delay=0.05)
+    writer.submit(None, "UPDATE status", ("Finished",))
+    assert writer.flush(5)
+    assert reader.committed == [("UPDATE status", ("Finished",))]
+    stats = writer.stats()
+    assert stats["dropped"] == 0
+    assert stats["failures"] == 1
@@ -0,0 +1,108 @@
+import os
+import re
+import pytest
+
+np = pytest.importorskip("numpy")
+from Jcamp import Jcamp, decode_affn, decode_asdf, decode_xydata, encode_xydata
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def with_exponent_abscissae(lines):
+    """
+    Rewrites the abscissa at the beginning of every data line in E notation (1.5E+03).
+    """
+    data = lines.index("##XYDATA=(X++(Y..Y))") + 1
+    rewritten = []
+    for line in lines[data:]:
+        match = re.match(r"-?[\d.]+", line)
+        rewritten.append("{:.6E}".format(float(match.group())) + line[match.end():])
+    return lines[:data] + rewritten
+
+
+def test_difdup_round_trip():
+    rng = np.random.default_rng(1)
+    y = np.cumsum(rng.integers(-50, 50, 1000))
+    y[100:130] = y[100]
+    x = np.linspace(1500, 2500, len(y))
+    jcamp = Jcamp.parse("\n".join(["##TITLE=test"] + encode_xydata(x, y) + ["##END="]))
+    np.testing.assert_array_equal(jcamp.y, y)
+    np.testing.assert_allclose(jcamp.x, x)
+
+
+@pytest.mark.parametrize("mode", ["DIFDUP", "AFFN"])
+def test_round_trip_with_exponent_abscissae(mode):
+    rng = np.random.default_rng(2)
+    y = np.cumsum(rng.integers(-500, 500, 257))
+    x = np.linspace(1500, -2500, len(y))
+    lines = with_exponent_abscissae(encode_xydata(x, y, mode))
+    assert "E+03" in "\n".join(lines)
+    jcamp = Jcamp.parse("\n".join(["##TITLE=test"] + lines + ["##END="]))
+    np.testing.assert_array_equal(jcamp.y, y)
+    np.testing.assert_allclose(jcamp.x, x)
+
+
+def test_exponent_abscissa_is_not_read_as_sqz():
+    # SQZ 11, SQZ 22, DIF +3; the next line repeats 25 as check value, then DIF +1
+    np.testing.assert_array_equal(decode_asdf("1.5E+03A1B2L\n1.6E+03B5J"), [11, 22, 25, 26])
+    np.testing.assert_array_equal(decode_xydata("1.5E+03A2J"), [12, 13])
+
+
+def test_abscissa_without_separator():
+    # "1500E12": abscissa 1500, followed by the SQZ ordinate 512
+    np.testing.assert_array_equal(decode_asdf("1500E12"), [512])
+
+
+def test_malformed_asdf_raises():
+    with pytest.raises(ValueError):
+        decode_asdf("A12B3\n")
+    with pytest.raises(ValueError):
+        decode_asdf("100 A1.5")
+
+
+def test_affn_with_missing_values():
+    np.testing.assert_array_equal(decode_affn("0 1.5 -2 ?\n3 4E+02;5,6"), [1.5, -2, np.nan, 400, 5, 6])
+
+
+def test_acd_integrals():
+    jdx = Jcamp.read(os.path.join(DATA, "acd_integrals.jdx"))
+    assert jdx.labels["DATATYPE"] == "NMR SPECTRUM"
+    assert jdx.labels["JCAMPDX"] == "5.00"
+    integrals = jdx.integrals
+    assert integrals.dtype.names == ("x1", "x2", "logvalue")
+    np.testing.assert_allclose(integrals.x1, [-62.1, -62.1004, -75.5, -110])
+    np.testing.assert_allclose(integrals.logvalue, [100, 55, 38.25, 12.5])
+    np.testing.assert_allclose(jdx.tables["PEAKTABLE"].x, [-63, -76.25])
+    np.testing.assert_allclose(jdx.tables["PEAKTABLE"].y, [1200.5, 480.25])
+    np.testing.assert_array_equal(jdx.y, [5, 11, 21.5, 10.5])
+    np.testing.assert_allclose(jdx.x, [-60, -62, -64, -66])
+
+
+def test_match_integrals():
+    jdx = Jcamp.read(os.path.join(DATA, "acd_integrals.jdx"))
+    result = jdx.match_integrals([-62.1005, -62.1, -75.5, -110.002, -80],
+                                 [-63.9, -64.5, -77.0009, -112, -81])
+    # within the tolerance of 1e-3 ppm on both borders; the second interval only matches the
+    # second row, although the first one is closer in X1. The fourth is 2e-3 ppm off.
+    np.testing.assert_array_equal(result, [100, 55, 38.25, np.nan, np.nan])
+    assert np.isnan(jdx.match_integrals([-110.002], [-112], tolerance=1e-3)[0])
+    assert jdx.match_integrals([-110.002], [-112], tolerance=5e-3)[0] == 12.5
+    assert len(Jcamp.parse("##TITLE=empty\n##END=").match_integrals([1, 2], [3, 4])) == 2
+
+
+def test_tables_survive_a_round_trip():
+    jdx = Jcamp.read(os.path.join(DATA, "acd_integrals.jdx"))
+    copy = Jcamp.parse(jdx.to_string())
+    assert "##$INTEGRALS=ACDTABLE(X1,X2,LogValue)" in jdx.to_string()
+    np.testing.assert_allclose(copy.integrals.tolist(), jdx.integrals.tolist())
+    np.testing.assert_allclose(copy.y, jdx.y)
+
+
+def test_ntuples_fid():
+    fid = Jcamp.read(os.path.join(DATA, "spinsolve_fid.dx"))
+    assert set(fid.data) == {"R", "I"}
+    # the FACTOR of each symbol applies to its own page
+    np.testing.assert_allclose(fid.data["R"], np.array([10, 12, 14, 14, 14, 13, 11, 8]) * 0.5)
+    np.testing.assert_allclose(fid.data["I"], np.array([-5, -3, -1, 1, 1, 1, 0, -2]) * 0.25)
+    np.testing.assert_allclose(fid.x, np.linspace(0, 0.0007, 8))
+    assert fid.labels["NTUPLES"] == "NMR FID"
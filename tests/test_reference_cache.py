@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+import pytest
+
+pytest.importorskip("MySQLdb")
+from MySQLReader import MySQLReader, ReferenceCache
+
+
+class FakeDatabase:
+    """
+    The reference tables and sample_properties as lists of dictionaries. The checksum of a
+    table changes whenever it is changed with change().
+    """
+
+    def __init__(self):
+        self.tables = {
+            "methods": [{"ID": 3, "Name": "yield", "Nucleus": 19, "Mass": 19}],
+            "peaks": [{"ID": 1, "method": 3, "role": 2}],
+            "protocols": [{"protocolid": 1, "xmlKey": "1D FLUORINE+"}],
+            "protocol_properties": [{"propid": 7, "friendlyName": "Scans", "xmlKey": "Number"}],
+            "fnmr_standards": [],
+            "sample_properties": [{"samplepropid": 1, "sampleid": 5, "propid": 7, "strvalue": "16"}],
+        }
+        self.checksums = {table: 1 for table in ReferenceCache.TABLES}
+        self.checksum_delay = 0
+        self.queries = []
+
+    def change(self, table, row):
+        self.tables[table].append(row)
+        if table in self.checksums:
+            self.checksums[table] += 1
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.db.queries.append(query)
+        if query.startswith("CHECKSUM TABLE"):
+            time.sleep(self.db.checksum_delay)
+            self.rows = [{"Table": table, "Checksum": self.db.checksums.get(table)} for table in ReferenceCache.TABLES]
+            return
+        table = re.search(r"FROM (\w+)", query, re.I).group(1)
+        self.rows = list(self.db.tables[table])
+        if args:
+            self.rows = [row for row in self.rows if row["sampleid"] == args[0]]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+class FakeReader:
+    def __init__(self, db):
+        self.db = db
+
+    def connect_db(self):
+        return FakeConnection(), FakeCursor(self.db)
+
+
+def test_changed_checksum_reloads_the_tables():
+    db = FakeDatabase()
+    cache = ReferenceCache(FakeReader(db), probe_interval=0)
+    assert list(cache.data()["protocol_properties"]) == [7]
+    assert list(cache.data()["protocol_properties"]) == [7]
+    assert cache.stats() == {"loads": 1, "probes": 2}
+    db.change("protocol_properties", {"propid": 8, "friendlyName": "Delay", "xmlKey": "RepetitionTime"})
+    assert sorted(cache.data()["protocol_properties"]) == [7, 8]
+    assert cache.stats() == {"loads": 2, "probes": 3}
+
+
+def test_probe_interval():
+    db = FakeDatabase()
+    cache = ReferenceCache(FakeReader(db), probe_interval=60)
+    cache.data()
+    db.change("peaks", {"ID": 2, "method": 3, "role": 2})
+    assert len(cache.data()["peaks"][(3, 2)]) == 1
+    assert cache.stats() == {"loads": 1, "probes": 1}
+
+
+def test_unknown_property_reloads_the_cache():
+    db = FakeDatabase()
+    reader = MySQLReader.__new__(MySQLReader)
+    reader.reference = ReferenceCache(FakeReader(db), probe_interval=60)
+    reader.connect_db = FakeReader(db).connect_db
+    assert [prop["friendlyName"] for prop in reader.read_sample_properties(5)] == ["Scans"]
+    # a property which was added after the last probe, within the probe interval
+    db.change("protocol_properties", {"propid": 8, "friendlyName": "Delay", "xmlKey": "RepetitionTime"})
+    db.change("sample_properties", {"samplepropid": 2, "sampleid": 5, "propid": 8, "strvalue": "2"})
+    props = reader.read_sample_properties(5)
+    assert [prop["friendlyName"] for prop in props] == ["Scans", "Delay"]
+    assert reader.reference.stats()["loads"] == 2
+
+
+def test_readers_do_not_wait_for_a_probe():
+    db = FakeDatabase()
+    cache = ReferenceCache(FakeReader(db), probe_interval=0)
+    data = cache.data()
+    db.checksum_delay = 0.5
+    prober = threading.Thread(target=cache.data)
+    prober.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    assert cache.data() is data
+    assert time.monotonic() - started < 0.1
+    prober.join()
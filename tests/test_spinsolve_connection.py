@@ -0,0 +1,79 @@
+import socket
+import threading
+import time
+import pytest
+
+pytest.importorskip("MySQLdb")
+from Spinsolve import Spinsolve
+
+
+class FakeConfigService:
+    def subscribe(self, key, callback):
+        pass
+
+
+class FakeMySQLReader:
+    def __init__(self):
+        self.config_service = FakeConfigService()
+
+    def read_config(self):
+        return {"NMRFolder": "C:/NMR", "NMRIP": "127.0.0.1", "NMRPort": 13000}
+
+
+class FakeAbortSignal:
+    def __init__(self):
+        self.reasons = []
+
+    def add_listener(self, callback):
+        pass
+
+    def trigger(self, reason=""):
+        self.reasons.append(reason)
+
+
+class SlowShutdownSocket:
+    """
+    A socket whose shutdown() takes a while after it has woken up the listener, so that the
+    listener runs while disconnect() has not replaced Spinsolve.socket yet.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+        time.sleep(0.3)
+
+    def close(self):
+        self.sock.close()
+
+
+def connected_spinsolve():
+    spinsolve = Spinsolve(FakeMySQLReader(), FakeAbortSignal())
+    ours, theirs = socket.socketpair()
+    spinsolve.socket = SlowShutdownSocket(ours)
+    spinsolve.connected.set()
+    return spinsolve, theirs
+
+
+def test_disconnect_does_not_abort_the_queue():
+    spinsolve, theirs = connected_spinsolve()
+    time.sleep(0.1)
+    spinsolve.disconnect()
+    time.sleep(0.2)
+    assert spinsolve.abort_signal.reasons == []
+    theirs.close()
+
+
+def test_lost_connection_aborts_the_queue():
+    spinsolve, theirs = connected_spinsolve()
+    time.sleep(0.1)
+    theirs.close()
+    deadline = time.time() + 2
+    while not spinsolve.abort_signal.reasons and time.time() < deadline:
+        time.sleep(0.05)
+    assert spinsolve.abort_signal.reasons == ["Lost connection to Spinsolve."]
+    assert not spinsolve.connected.is_set()
@@ -0,0 +1,132 @@
+import struct
+import sys
+import pytest
+
+from SpinsolveDataset import SpinsolveDataset
+
+ACQU_PAR = '''Sample = "Müller 19F"
+Solvent = "CDCl3"
+nrScans = 16
+rxGain = 31
+b1Freq = 56.292
+bandwidth = 5000
+Protocol = "1D FLUORINE+"
+broken line without separator
+'''
+
+
+def write_1d(path, data_type, x_dim, values, axis=None, y_dim=1, truncate=0):
+    """
+    Writes a binary file in the format of the Spinsolve software. values are floats, or
+    (real, imaginary) pairs for the complex data types.
+    """
+    formats = {500: "f", 501: "ff", 502: "d", 503: "f", 504: "ff"}
+    body = struct.pack("<8i", 0, 1, 1, data_type, x_dim, y_dim, 1, 1)
+    if axis is not None:
+        body += struct.pack("<" + "f" * len(axis), *axis)
+    for value in values:
+        body += struct.pack("<" + formats[data_type], *(value if isinstance(value, tuple) else (value,)))
+    path.write_bytes(body[:len(body) - truncate])
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    folder = tmp_path / "S1"
+    folder.mkdir()
+    write_1d(folder / "data.1d", 504, 4, [(1, -1), (0.5, 0.25), (0, 0), (-2, 3)], axis=[0, 0.1, 0.2, 0.3])
+    write_1d(folder / "spectrum.1d", 503, 3, [10, 20, 30], axis=[-60, -70, -80])
+    (folder / "acqu.par").write_text(ACQU_PAR, encoding="latin-1")
+    return SpinsolveDataset(str(folder))
+
+
+def test_is_complete(dataset, tmp_path):
+    assert dataset.is_complete("data.1d") is True
+    assert dataset.is_complete("spectrum.1d") is True
+    assert dataset.is_complete("missing.1d") is False
+    # still being written
+    write_1d(tmp_path / "S1" / "spectrum.1d", 503, 3, [10, 20, 30], axis=[-60, -70, -80], truncate=4)
+    assert dataset.is_complete("spectrum.1d") is False
+    (tmp_path / "S1" / "short.1d").write_bytes(b"\0" * 10)
+    assert dataset.is_complete("short.1d") is False
+    # unknown data type: the size can not be checked
+    (tmp_path / "S1" / "other.1d").write_bytes(struct.pack("<8i", 0, 1, 1, 599, 2, 1, 1, 1) + b"\0" * 8)
+    assert dataset.is_complete("other.1d") is None
+
+
+def test_is_complete_does_not_import_numpy(dataset):
+    numpy = sys.modules.pop("numpy", None)
+    try:
+        sys.modules["numpy"] = None    # any import of numpy fails
+        assert dataset.is_complete("data.1d") is True
+    finally:
+        del sys.modules["numpy"]
+        if numpy is not None:
+            sys.modules["numpy"] = numpy
+
+
+@pytest.mark.parametrize("data_type, values, dtype", [
+    (500, [1.5, -2, 3], "float32"),
+    (501, [(1, 2), (3, -4), (0, 0.5)], "complex64"),
+    (502, [1e-300, 2, -3], "float64"),
+])
+def test_data_types_without_axis(tmp_path, data_type, values, dtype):
+    np = pytest.importorskip("numpy")
+    write_1d(tmp_path / "data.1d", data_type, 3, values)
+    with SpinsolveDataset(str(tmp_path)) as dataset:
+        assert dataset.time_axis is None
+        assert dataset.fid.dtype == np.dtype(dtype)
+        expected = [complex(*value) if isinstance(value, tuple) else value for value in values]
+        np.testing.assert_allclose(dataset.fid, np.array(expected, dtype=dtype))
+
+
+def test_xy_data_and_memmap(dataset):
+    np = pytest.importorskip("numpy")
+    np.testing.assert_allclose(dataset.fid, [1 - 1j, 0.5 + 0.25j, 0, -2 + 3j])
+    np.testing.assert_allclose(dataset.time_axis, [0, 0.1, 0.2, 0.3], rtol=1e-6)
+    np.testing.assert_allclose(dataset.spectrum, [10, 20, 30])
+    np.testing.assert_allclose(dataset.frequency_axis, [-60, -70, -80])
+    # views into the read-only mapping
+    assert not dataset.fid.flags.writeable
+
+
+def test_multidimensional_shape(tmp_path):
+    np = pytest.importorskip("numpy")
+    write_1d(tmp_path / "data.1d", 500, 3, range(6), y_dim=2)
+    with SpinsolveDataset(str(tmp_path)) as dataset:
+        np.testing.assert_array_equal(dataset.fid, [[0, 1, 2], [3, 4, 5]])
+
+
+def test_invalid_files_are_not_mapped(dataset, tmp_path):
+    pytest.importorskip("numpy")
+    write_1d(tmp_path / "S1" / "data.1d", 504, 4, [(1, -1)], axis=[0, 0.1, 0.2, 0.3])
+    with pytest.raises(ValueError):
+        dataset.fid
+    (tmp_path / "S1" / "spectrum.1d").write_bytes(struct.pack("<8i", 0, 1, 1, 599, 2, 1, 1, 1))
+    with pytest.raises(ValueError):
+        dataset.spectrum
+    (tmp_path / "S1" / "spectrum.1d").unlink()
+    with pytest.raises(FileNotFoundError):
+        dataset.spectrum
+
+
+def test_parameters_are_parsed_lazily(dataset, tmp_path):
+    assert dataset._parameters == {}
+    acqu = dataset.acqu
+    assert acqu["Sample"] == "Müller 19F"
+    assert acqu["nrScans"] == 16
+    assert acqu["b1Freq"] == 56.292
+    assert acqu["Protocol"] == "1D FLUORINE+"
+    assert "broken line without separator" not in acqu
+    # parsed once, then cached
+    (tmp_path / "S1" / "acqu.par").write_text("nrScans = 1\n")
+    assert dataset.acqu["nrScans"] == 16
+    assert dataset.protocol == {}
+
+
+def test_find(tmp_path):
+    for name, filename in (("B", "spectrum.1d"), ("A", "data.1d"), ("C", "acqu.par")):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / filename).write_bytes(b"")
+    (tmp_path / "data.1d").write_bytes(b"")
+    assert [dataset.name for dataset in SpinsolveDataset.find(str(tmp_path))] == ["A", "B"]
+    assert list(SpinsolveDataset.find(str(tmp_path / "missing"))) == []
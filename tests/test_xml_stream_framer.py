@@ -0,0 +1,85 @@
+from XmlStreamFramer import XmlStreamFramer
+
+PROGRESS = ("<?xml version='1.0' encoding='UTF-8'?>"
+            "<Message><StatusNotification><Progress percentage='42' secondsRemaining='17'/>"
+            "</StatusNotification></Message>")
+COMPLETED = ("<?xml version='1.0' encoding='UTF-8'?>\r\n"
+             "<Message><StatusNotification><Completed completed='true' successful='true'/>"
+             "</StatusNotification></Message>")
+# multi-byte characters in an attribute and in the text
+SAMPLE = ("<?xml version='1.0' encoding='UTF-8'?>"
+          "<Message><Set><Sample name='Müller µL 19F'>Probe ä→ö</Sample></Set></Message>")
+EMPTY = "<?xml version='1.0' encoding='UTF-8'?><Message/>"
+
+STREAM = (PROGRESS + COMPLETED + SAMPLE + EMPTY).encode("UTF-8")
+
+
+def feed_chunks(chunks):
+    framer = XmlStreamFramer()
+    documents = []
+    for chunk in chunks:
+        documents.extend(framer.feed(chunk))
+    return documents
+
+
+def check_stream(documents):
+    assert len(documents) == 4
+    progress = documents[0].find("StatusNotification/Progress")
+    assert progress.get("percentage") == "42"
+    assert progress.get("secondsRemaining") == "17"
+    completed = documents[1].find("StatusNotification/Completed")
+    assert completed.get("completed") == "true"
+    assert completed.get("successful") == "true"
+    sample = documents[2].find("Set/Sample")
+    assert sample.get("name") == "Müller µL 19F"
+    assert sample.text == "Probe ä→ö"
+    assert documents[3].tag == "Message"
+    assert len(documents[3]) == 0
+
+
+def test_whole_stream_in_one_chunk():
+    check_stream(feed_chunks([STREAM]))
+
+
+def test_byte_by_byte():
+    check_stream(feed_chunks([STREAM[i:i + 1] for i in range(len(STREAM))]))
+
+
+def test_every_split_point():
+    # covers splits inside tags, attribute names and values, the XML declaration and the
+    # multi-byte characters
+    for split in range(1, len(STREAM)):
+        check_stream(feed_chunks([STREAM[:split], STREAM[split:]]))
+
+
+def test_split_inside_multibyte_character():
+    encoded = SAMPLE.encode("UTF-8")
+    start = encoded.index("µ".encode("UTF-8"))
+    documents = feed_chunks([encoded[:start + 1], encoded[start + 1:]])
+    assert documents[0].find("Set/Sample").get("name") == "Müller µL 19F"
+
+
+def test_document_is_returned_as_soon_as_it_is_complete():
+    framer = XmlStreamFramer()
+    encoded = PROGRESS.encode("UTF-8")
+    assert framer.feed(encoded[:-1]) == []
+    documents = framer.feed(encoded[-1:] + COMPLETED.encode("UTF-8")[:10])
+    assert len(documents) == 1
+    assert documents[0].find("StatusNotification/Progress") is not None
+
+
+def test_resync_after_garbage():
+    garbage = b"\x00\xffthis is no xml <<>"
+    documents = feed_chunks([garbage + PROGRESS.encode("UTF-8") + garbage + COMPLETED.encode("UTF-8")])
+    assert len(documents) == 2
+    assert documents[0].find("StatusNotification/Progress") is not None
+    assert documents[1].find("StatusNotification/Completed") is not None
+
+
+def test_resync_after_broken_document():
+    broken = b"<?xml version='1.0' encoding='UTF-8'?><Message><Oops></Message>"
+    stream = broken + PROGRESS.encode("UTF-8")
+    for split in range(1, len(stream)):
+        documents = feed_chunks([stream[:split], stream[split:]])
+        assert len(documents) == 1
+        assert documents[0].find("StatusNotification/Progress").get("percentage") == "42"